@@ -0,0 +1,224 @@
+"""
+@file basemap_rendering.py
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+import math
+import multiprocessing
+import time
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
+from mpl_toolkits.basemap import Basemap #have to do 'pip install basemap'
+
+# the projections showing the whole world, for which Basemap ignores the corners of the map,
+# so one base layer serves every itinerary
+_WORLD_PROJECTIONS = {"robin", "moll", "hammer", "kav7", "eck4", "mbtfpq", "sinu", "vandg", "ortho", "geos", "nsper"}
+
+def _bounding_box(coordinates: list[tuple[float, float]], padding: float = 5, min_size: float = 50,
+                  step: float = 5) -> tuple[float, float, float, float]:
+    """
+    Returns the limits of a map showing some coordinates: at least min_size degrees in each
+    direction, with the coordinates at least padding degrees from the edges. The limits are
+    rounded outwards to multiples of step degrees, so that close itineraries share a base layer.
+
+    :param coordinates: the (latitude, longitude) of the cities to show.
+    :return: the tuple (min_lat, max_lat, min_lon, max_lon).
+    """
+    limits = []
+    for values, bound in (([lat for lat, _ in coordinates], 90), ([lon for _, lon in coordinates], 180)):
+        low, high = min(values) - padding, max(values) + padding
+        if high - low < min_size:
+            centre = (low + high) / 2
+            low, high = centre - min_size / 2, centre + min_size / 2
+        low, high = math.floor(low / step) * step, math.ceil(high / step) * step
+        limits += [max(low, -bound), min(high, bound)]
+    return tuple(limits)
+
+
+class BaseLayer():
+    """
+    A figure with a map already drawn on it: coastlines, countries and continents.
+    Itineraries are drawn over it, saved, then removed, so the figure is reused.
+    """
+
+    def __init__(self, projection: str, resolution: str, box: tuple[float, float, float, float] | None,
+                 size: tuple[float, float]) -> None:
+        """
+        Draws the base layer of a map.
+
+        :param projection: The map projection to use.
+        :param resolution: the resolution of the coastlines and borders, 'c', 'l', 'i', 'h' or 'f'.
+        :param box: the limits (min_lat, max_lat, min_lon, max_lon) of the map, or None for the whole world.
+        :param size: the size of the figure in inches.
+        :return: None
+        """
+        # maps are only written to files, so figures are drawn with Agg directly rather than through
+        # pyplot, which would open windows with an interactive backend
+        self.figure = Figure(figsize=size)
+        FigureCanvasAgg(self.figure)
+        axes = self.figure.add_axes([0.02, 0.02, 0.96, 0.96])
+        corners = {}
+        if box is not None:
+            min_lat, max_lat, min_lon, max_lon = box
+            corners = dict(llcrnrlat=min_lat, urcrnrlat=max_lat, llcrnrlon=min_lon, urcrnrlon=max_lon)
+        self.world_map = Basemap(projection=projection, lat_0=0, lon_0=0, resolution=resolution, ax=axes, **corners)
+        self.world_map.drawcoastlines(linewidth=1, color='gray')
+        self.world_map.drawcountries(linewidth=1, color='gray')
+        self.world_map.fillcontinents(color='#C1BBBA', lake_color='white')
+
+    def draw(self, coordinates: list[tuple[float, float]], path: str, line_width: float, colour: str, dpi: int) -> None:
+        """
+        Draws the legs between consecutive coordinates along great circles, writes the map to a file,
+        and removes the legs, leaving the base layer as it was.
+
+        :param coordinates: the (latitude, longitude) of the cities of the itinerary.
+        :param path: the path of the file to write.
+        :param line_width: The width of the line to draw.
+        :param colour: The colour of the line to draw.
+        :param dpi: the resolution of the image, in dots per inch.
+        :return: None
+        """
+        lines = []
+        try:
+            for start, end in zip(coordinates[:-1], coordinates[1:]):
+                lines += self.world_map.drawgreatcircle(start[1], start[0], end[1], end[0], linewidth=line_width, color=colour)
+            self.figure.savefig(path, dpi=dpi)
+        finally:
+            for line in lines:
+                line.remove()
+
+    def close(self) -> None:
+        """
+        Closes the figure, freeing its memory.
+        """
+        self.figure.clear()
+
+
+class MapRenderer():
+    """
+    Plots itineraries on maps and writes them to files.
+
+    Drawing coastlines, countries and continents takes most of the time of a map, so base
+    layers are kept by projection and bounding box, and only the legs of each itinerary are
+    drawn on them. At most max_cached base layers (each an open figure) are kept; the least
+    recently used is closed when another is needed.
+    """
+
+    def __init__(self, projection: str = 'robin', resolution: str = 'l', max_cached: int = 8,
+                 size: tuple[float, float] = (8, 6), dpi: int = 100) -> None:
+        """
+        :param projection: The map projection to use.
+        :param resolution: the resolution of the coastlines and borders, 'c', 'l', 'i', 'h' or 'f'.
+        :param max_cached: the maximum number of base layers kept.
+        :param size: the size of the figures in inches.
+        :param dpi: the resolution of the images, in dots per inch.
+        :return: None
+        """
+        self.projection = projection
+        self.resolution = resolution
+        self.max_cached = max_cached
+        self.size = size
+        self.dpi = dpi
+        # associates bounding boxes to base layers, least recently used first
+        self._layers = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def layer_key(self, coordinates: list[tuple[float, float]]) -> tuple[float, float, float, float] | None:
+        """
+        Returns the bounding box of the base layer of a map showing some coordinates,
+        or None if the projection always shows the whole world.
+        """
+        return None if self.projection in _WORLD_PROJECTIONS else _bounding_box(coordinates)
+
+    def base_layer(self, coordinates: list[tuple[float, float]]) -> BaseLayer:
+        """
+        Returns a base layer showing some coordinates, drawing it if it is not cached.
+
+        :param coordinates: the (latitude, longitude) of the cities to show.
+        :return: the base layer.
+        """
+        box = self.layer_key(coordinates)
+        layer = self._layers.get(box)
+        if layer is not None:
+            self.hits += 1
+            self._layers.move_to_end(box)
+            return layer
+        self.misses += 1
+        layer = self._layers[box] = BaseLayer(self.projection, self.resolution, box, self.size)
+        while len(self._layers) > self.max_cached:
+            self._layers.popitem(last=False)[1].close()
+        return layer
+
+    def render(self, coordinates: list[tuple[float, float]], path: str, line_width: float = 2, colour: str = 'b') -> float:
+        """
+        Plots the legs between consecutive coordinates on a map and writes it to a file.
+
+        :param coordinates: the (latitude, longitude) of the cities of the itinerary.
+        :param path: the path of the file to write.
+        :param line_width: The width of the line to draw.
+        :param colour: The colour of the line to draw.
+        :return: the number of seconds it took.
+        """
+        start = time.perf_counter()
+        self.base_layer(coordinates).draw(coordinates, path, line_width, colour, self.dpi)
+        return time.perf_counter() - start
+
+    def close(self) -> None:
+        """
+        Closes the figures of all the base layers.
+        """
+        while self._layers:
+            self._layers.popitem()[1].close()
+
+
+# the renderer of each projection, kept between calls to plot_itinerary
+_renderers = {}
+
+def renderer(projection: str) -> MapRenderer:
+    """
+    Returns the renderer of a projection, creating it on first use.
+    """
+    if projection not in _renderers:
+        _renderers[projection] = MapRenderer(projection)
+    return _renderers[projection]
+
+def _render_in_worker(projection: str, coordinates: list[tuple[float, float]], path: str, line_width: float,
+                      colour: str) -> float:
+    """
+    Renders one map in a worker process of render_many, with the renderers of that process.
+    """
+    return renderer(projection).render(coordinates, path, line_width, colour)
+
+def render_many(coordinates: list[list[tuple[float, float]]], paths: list[str], projection: str = 'robin',
+                line_width: float = 2, colour: str = 'b', workers: int = 0) -> list[float]:
+    """
+    Plots many itineraries, each on its own map, and writes them to files.
+    Maps sharing a base layer are rendered one after the other, so it is drawn once.
+
+    :param coordinates: the (latitude, longitude) of the cities of each itinerary.
+    :param paths: the path of the file of each map.
+    :param projection: The map projection to use.
+    :param line_width: The width of the line to draw.
+    :param colour: The colour of the line to draw.
+    :param workers: the number of worker processes rendering maps in parallel, 0 to render them in this process.
+    :return: the number of seconds each map took to render, in the order of the itineraries.
+    """
+    projection_renderer = renderer(projection)
+    # grouping the maps by base layer, so that each is drawn once per process
+    order = sorted(range(len(coordinates)), key=lambda position: str(projection_renderer.layer_key(coordinates[position])))
+    seconds = [0.0] * len(coordinates)
+    if workers > 0:
+        # the workers get coordinates rather than cities, which only exist in this process
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            chunk_size = max(1, len(order) // (4 * workers))
+            times = executor.map(_render_in_worker, [projection] * len(order), [coordinates[position] for position in order],
+                                 [paths[position] for position in order], [line_width] * len(order), [colour] * len(order),
+                                 chunksize=chunk_size)
+            for position, duration in zip(order, times):
+                seconds[position] = duration
+    else:
+        for position in order:
+            seconds[position] = projection_renderer.render(coordinates[position], paths[position], line_width, colour)
+    return seconds
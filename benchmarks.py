@@ -0,0 +1,291 @@
+"""
+@file benchmarks.py
+"""
+from __future__ import annotations
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import csv
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable
+import numpy as np
+
+# the types of the cities of the generated gazetteers, and how often each appears
+# (each country also gets one primary city)
+_CITY_TYPES = ("admin", "minor", "")
+_CITY_TYPE_WEIGHTS = (0.1, 0.2, 0.7)
+
+def generate_gazetteer(path: str, city_count: int, seed: int = 0) -> None:
+    """
+    Writes a synthetic CSV file of cities, with the columns of worldcities.csv.
+    Cities are scattered around the centres of about sqrt(city_count) / 2 countries, each with
+    one primary city, and have log-normal populations. The same seed gives the same file.
+
+    :param path: the path of the file to write.
+    :param city_count: the number of cities.
+    :param seed: the seed of the random generator.
+    :return: None
+    """
+    generator = np.random.default_rng(seed)
+    country_count = int(min(250, max(5, math.sqrt(city_count) / 2)))
+    centres = np.column_stack((generator.uniform(-60, 70, country_count), generator.uniform(-180, 180, country_count)))
+    countries = generator.integers(0, country_count, city_count)
+    # the first city of each country is its primary city
+    countries[:min(country_count, city_count)] = np.arange(min(country_count, city_count))
+    latitudes = np.clip(centres[countries, 0] + generator.normal(0, 4, city_count), -89.9, 89.9)
+    longitudes = (centres[countries, 1] + generator.normal(0, 6, city_count) + 180) % 360 - 180
+    city_types = generator.choice(len(_CITY_TYPES), city_count, p=_CITY_TYPE_WEIGHTS)
+    populations = generator.lognormal(9, 1.5, city_count).astype(np.int64)
+
+    with open(path, "w", newline="") as csv_file:
+        writer = csv.writer(csv_file)
+        writer.writerow(["city", "city_ascii", "lat", "lng", "country", "iso2", "iso3", "admin_name", "capital", "population", "id"])
+        for row in range(city_count):
+            country = int(countries[row])
+            city_type = "primary" if row < country_count else _CITY_TYPES[city_types[row]]
+            writer.writerow([f"City{row}", f"City{row}", f"{latitudes[row]:.4f}", f"{longitudes[row]:.4f}",
+                             f"Country{country}", f"C{country % 100}", f"C{country:03d}", "", city_type,
+                             int(populations[row]), 1_000_000_000 + row])
+
+def gazetteer_path(directory: str, city_count: int, seed: int = 0) -> str:
+    """
+    Returns the path of a synthetic gazetteer in a directory, generating it if it does not exist yet.
+
+    :param directory: the directory of the generated files.
+    :param city_count: the number of cities.
+    :param seed: the seed of the random generator.
+    :return: the path of the CSV file.
+    """
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"gazetteer_{city_count}_{seed}.csv")
+    if not os.path.exists(path):
+        temporary_path = f"{path}.{os.getpid()}.tmp"
+        generate_gazetteer(temporary_path, city_count, seed)
+        os.replace(temporary_path, path)
+    return path
+
+def load_peak_memory(path_to_csv: str) -> int:
+    """
+    Returns the peak memory allocated while loading a gazetteer, in KB. Cities can only be loaded
+    once in a process, so this is meant to run in a process of its own, see run_benchmarks.
+
+    :param path_to_csv: the path of the gazetteer.
+    :return: the peak memory in KB.
+    """
+    from csv_parsing import create_cities_countries_from_csv
+    tracemalloc.start()
+    create_cities_countries_from_csv(path_to_csv)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak // 1024
+
+def _measure(function: Callable[[], object], repeats: int, operations: int = 1) -> dict:
+    """
+    Times a function repeatedly, then measures the memory it allocates during one more run.
+
+    :param function: the function, run with no arguments.
+    :param repeats: the number of timed runs.
+    :param operations: the number of operations (calls, queries...) in one run, to report the time of one.
+    :return: the median and best seconds of a run, the median seconds of an operation,
+             and the peak memory allocated by a run, in KB.
+    """
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    # tracing allocations slows Python down, so it is only done once the times are taken
+    tracemalloc.start()
+    function()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": statistics.median(times), "best_seconds": min(times), "operations": operations,
+            "seconds_per_operation": statistics.median(times) / operations, "peak_memory_kb": peak // 1024}
+
+def benchmark_size(path_to_csv: str, seed: int = 0, repeats: int = 5, route_pairs: int = 5,
+                   plot_backend: str = "html") -> dict[str, dict]:
+    """
+    Runs every benchmark on a gazetteer. Cities can only be loaded once in a process, so
+    this is meant to run in a process of its own, see run_benchmarks.
+
+    :param path_to_csv: the path of the gazetteer.
+    :param seed: the seed choosing the cities of the queries.
+    :param repeats: the number of timed runs of each benchmark.
+    :param route_pairs: the number of pairs of cities routed between with each vehicle.
+    :param plot_backend: the backend of plot_itinerary, see map_plotting.BACKENDS.
+    :return: the measures of each benchmark, by name.
+    """
+    from city import City
+    from csv_parsing import create_cities_countries_from_csv
+    from itinerary import Itinerary
+    from map_plotting import plot_itinerary
+    from path_finding import find_shortest_path
+    from vehicles import create_example_vehicles
+
+    results = {}
+    # loading happens once, and its memory is measured in another process, see load_peak_memory
+    start = time.perf_counter()
+    create_cities_countries_from_csv(path_to_csv)
+    seconds = time.perf_counter() - start
+    results["create_cities_countries_from_csv"] = {"seconds": seconds, "best_seconds": seconds, "operations": 1,
+                                                   "seconds_per_operation": seconds}
+    cities = City.index_to_cities
+    generator = random.Random(seed)
+
+    pairs = [generator.sample(cities, 2) for _ in range(10_000)]
+    def distances() -> None:
+        for first, second in pairs:
+            first.distance(second)
+    results["City.distance"] = _measure(distances, repeats, len(pairs))
+
+    for vehicle in create_example_vehicles():
+        route = [generator.sample(cities, 2) for _ in range(route_pairs)]
+        # the first search also builds the routing graph of the vehicle, which later searches reuse
+        start = time.perf_counter()
+        find_shortest_path(vehicle, *route[0])
+        first_seconds = time.perf_counter() - start
+        def shortest_paths() -> None:
+            for from_city, to_city in route:
+                find_shortest_path(vehicle, from_city, to_city)
+        results[f"find_shortest_path[{type(vehicle).__name__}]"] = {**_measure(shortest_paths, repeats, len(route)),
+                                                                     "first_seconds": first_seconds}
+
+    stops = generator.sample(cities, min(100, len(cities)))
+    inserted = generator.sample(cities, min(100, len(cities)))
+    def insertions() -> None:
+        itinerary = Itinerary(list(stops))
+        for city in inserted:
+            itinerary.min_distance_insert_city(city)
+    results["Itinerary.min_distance_insert_city"] = _measure(insertions, repeats, len(inserted))
+
+    itinerary = Itinerary(generator.sample(cities, min(10, len(cities))))
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "map.png" if plot_backend == "basemap" else "map.html")
+        results[f"plot_itinerary[{plot_backend}]"] = _measure(lambda: plot_itinerary(itinerary, path=path, backend=plot_backend),
+                                                              repeats)
+    return results
+
+def scaling_exponents(results: dict[str, dict[str, dict]]) -> dict[str, float]:
+    """
+    Returns how the time of each benchmark grows with the number of cities: the exponent k of
+    the power law seconds ~ cities ** k fitting the measures best (1 is linear).
+
+    :param results: the measures of each benchmark, by number of cities (as a string, as in JSON).
+    :return: the exponent of each benchmark measured on at least two sizes.
+    """
+    exponents = {}
+    names = {name for by_name in results.values() for name in by_name}
+    for name in sorted(names):
+        points = [(int(size), by_name[name]["seconds_per_operation"]) for size, by_name in results.items()
+                  if name in by_name and by_name[name]["seconds_per_operation"] > 0]
+        if len(points) >= 2:
+            sizes, seconds = np.log([size for size, _ in points]), np.log([seconds for _, seconds in points])
+            exponents[name] = float(np.polyfit(sizes, seconds, 1)[0])
+    return exponents
+
+def run_benchmarks(sizes: list[int], seed: int = 0, repeats: int = 5, route_pairs: int = 5,
+                   plot_backend: str = "html", data_directory: str | None = None) -> dict:
+    """
+    Runs the benchmarks on synthetic gazetteers of several sizes, each in a new process.
+
+    :param sizes: the numbers of cities of the gazetteers.
+    :param seed: the seed of the gazetteers and of the queries.
+    :param repeats: the number of timed runs of each benchmark.
+    :param route_pairs: the number of pairs of cities routed between with each vehicle.
+    :param plot_backend: the backend of plot_itinerary.
+    :param data_directory: where the gazetteers are generated, by default in the temporary directory.
+    :return: the results, ready for json.dump: the environment, the measures by size and benchmark,
+             and the scaling exponents.
+    """
+    data_directory = data_directory or os.path.join(tempfile.gettempdir(), "navigator_benchmarks")
+    results = {}
+    for size in sizes:
+        path = gazetteer_path(data_directory, size, seed)
+        # new processes for each size, as the cities of a gazetteer cannot be unloaded
+        context = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[str(size)] = executor.submit(benchmark_size, path, seed, repeats, route_pairs, plot_backend).result()
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+            results[str(size)]["create_cities_countries_from_csv"]["peak_memory_kb"] = executor.submit(load_peak_memory, path).result()
+    return {"environment": {"python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                            "seed": seed, "repeats": repeats, "time": time.strftime("%Y-%m-%dT%H:%M:%S")},
+            "results": results, "scaling": scaling_exponents(results)}
+
+def compare_to_baseline(current: dict, baseline: dict, tolerance: float = 0.25) -> list[str]:
+    """
+    Returns the regressions of some results compared to a baseline: the benchmarks, measured on
+    gazetteers of the same size, whose time per operation or peak memory grew by more than tolerance.
+
+    :param current: the results, as returned by run_benchmarks.
+    :param baseline: earlier results, as returned by run_benchmarks.
+    :param tolerance: the largest growth tolerated, 0.25 for 25 %.
+    :return: a description of each regression.
+    """
+    regressions = []
+    for size, by_name in current["results"].items():
+        for name, measures in by_name.items():
+            reference = baseline["results"].get(size, {}).get(name)
+            if reference is None:
+                continue
+            # with the smallest growth flagged, as tiny differences are noise
+            for key, unit, scale, noise in (("seconds_per_operation", "ms", 1000, 1e-6), ("peak_memory_kb", "KB", 1, 64)):
+                if reference[key] > 0 and measures[key] > reference[key] * (1 + tolerance) and measures[key] - reference[key] > noise:
+                    regressions.append(f"{name} with {size} cities: {key} {measures[key] * scale:.4g} {unit} "
+                                       f"vs {reference[key] * scale:.4g} {unit} ({measures[key] / reference[key] - 1:+.0%})")
+    return regressions
+
+def print_results(report: dict) -> None:
+    """
+    Prints the time per operation and the peak memory of each benchmark for each size, and the scaling exponents.
+    """
+    results = report["results"]
+    sizes = list(results)
+    names = sorted({name for by_name in results.values() for name in by_name})
+    width = max(len(name) for name in names)
+    print(f"{'benchmark':<{width}}" + "".join(f"{size + ' cities':>26}" for size in sizes) + f"{'scaling':>10}")
+    for name in names:
+        cells = []
+        for size in sizes:
+            measures = results[size].get(name)
+            cells.append(f"{measures['seconds_per_operation'] * 1000:11.4f} ms {measures['peak_memory_kb']:8d} KB"
+                         if measures is not None else " " * 26)
+        exponent = report["scaling"].get(name)
+        print(f"{name:<{width}}" + "".join(f"{cell:>26}" for cell in cells) + (f"{exponent:10.2f}" if exponent is not None else ""))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks loading, distances, routing, insertion and plotting "
+                                                 "on synthetic gazetteers.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1_000, 10_000, 100_000],
+                        help="the numbers of cities of the gazetteers, from 1000 to 1000000")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeats", type=int, default=5)
+    parser.add_argument("--route-pairs", type=int, default=5, help="the number of routes searched with each vehicle")
+    parser.add_argument("--plot-backend", default="html", help="the backend of plot_itinerary, html or basemap")
+    parser.add_argument("--data-dir", default=None, help="where the gazetteers are generated")
+    parser.add_argument("--output", default=None, help="a JSON file to write the results to")
+    parser.add_argument("--baseline", default=None, help="a JSON file of earlier results to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="the growth flagged as a regression, 0.25 for 25 %%")
+    arguments = parser.parse_args()
+
+    report = run_benchmarks(arguments.sizes, arguments.seed, arguments.repeats, arguments.route_pairs,
+                            arguments.plot_backend, arguments.data_dir)
+    print_results(report)
+    if arguments.output is not None:
+        with open(arguments.output, "w") as output:
+            json.dump(report, output, indent=2)
+    if arguments.baseline is not None:
+        with open(arguments.baseline) as baseline_file:
+            regressions = compare_to_baseline(report, json.load(baseline_file), arguments.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        print(f"{len(regressions)} regressions compared with {arguments.baseline}")
+        sys.exit(1 if regressions else 0)
@@ -2,17 +2,33 @@
 @file city.py
 """
 from __future__ import annotations #https://peps.python.org/pep-0563/
-from typing import Tuple
+from typing import Tuple, TYPE_CHECKING
 import math
-import geopy.distance
+import sys
+import numpy as np
+from city_table import CityTable
+from distances import great_circle_km
+import instrumentation
+
+if TYPE_CHECKING:
+    from country import Country
 
 class City():
     """
     Represents a city.
+
+    The data of the city is stored in a row of City.table; an instance only holds
+    the index of its row, its name and its country.
     """
+    __slots__ = ("index", "name", "_country")
+
     id_to_cities = dict() #associates an id to an instance of City
     name_to_cities = dict() # associates city names to a list of instances of City.
     table_headers = ["Name", "Coordinates", "City type", "Population", "City ID"]
+    table = CityTable() # holds the data of every city in columns
+    distance_engine = table # the table also answers batch distance queries on the cities
+    index_to_cities = [] # associates the index of a city in the table to its instance of City
+    registry_version = 0 # incremented whenever a city is created or changed, so that derived data can tell it is stale
 
     def __init__(self, name: str, coordinates: Tuple[float, float], city_type: str,\
                   population: int, city_id: int) -> None:
@@ -27,7 +43,13 @@ class City():
         :return: None
         """
 
-        self.name = name
+        # names repeat a lot across cities, so share a single copy of each
+        self.name = sys.intern(name)
+        # the city is in no country yet, so none is told about its type and population
+        self._country = None
+        # index of the city's row in the table
+        self.index = City.table.add_point(coordinates)
+        City.index_to_cities.append(self)
         self.coordinates = coordinates
         self.city_type = city_type
         self.population = population
@@ -46,6 +68,80 @@ class City():
             City.name_to_cities[self.name] = [self]
 
 
+    @property
+    def coordinates(self) -> Tuple[float, float]:
+        """
+        The coordinates of the city (latitude, longitude).
+        """
+        return (float(City.table.latitude[self.index]), float(City.table.longitude[self.index]))
+
+    @coordinates.setter
+    def coordinates(self, coordinates: Tuple[float, float]) -> None:
+        City.table.set_point(self.index, coordinates)
+        City.registry_version += 1
+
+    @property
+    def city_type(self) -> str:
+        """
+        The type of city (e.g. admin). Can be empty.
+        """
+        return City.table.city_types[City.table.type_code[self.index]]
+
+    @city_type.setter
+    def city_type(self, city_type: str) -> None:
+        previous_type = self.city_type
+        City.table.type_code[self.index] = City.table.code_of_type(city_type)
+        if city_type != previous_type:
+            # routing depends on the types of the cities
+            City.registry_version += 1
+            # the country keeps its cities by type
+            if self._country is not None:
+                self._country.update_city_type(self, previous_type)
+
+    @property
+    def population(self) -> int:
+        """
+        The population of the city.
+        """
+        return int(City.table.population[self.index])
+
+    @population.setter
+    def population(self, population: int) -> None:
+        previous_population = self.population
+        City.table.population[self.index] = population
+        if population != previous_population:
+            # the name index ranks the cities by population
+            City.registry_version += 1
+            # the country keeps its cities sorted by population
+            if self._country is not None:
+                self._country.update_city_population(self, previous_population)
+
+    @property
+    def city_id(self) -> int:
+        """
+        An integer unique to this city.
+        """
+        return int(City.table.city_id[self.index])
+
+    @city_id.setter
+    def city_id(self, city_id: int) -> None:
+        if city_id != self.city_id:
+            City.table.city_id[self.index] = city_id
+            # caches and indices may identify the cities by ID
+            City.registry_version += 1
+
+    @property
+    def country(self) -> Country | None:
+        """
+        The country of the city, None until the city is added to one.
+        """
+        return self._country
+
+    @country.setter
+    def country(self, country: Country | None) -> None:
+        self._country = country
+        City.table.country_index[self.index] = country.index if country is not None else -1
+
     def distance(self, other_city: City) -> int:
         """
         Returns the distance in kilometers between two cities using the great circle method,
@@ -54,7 +150,20 @@ class City():
         :param other_city: a city to measure the distance to
         :return: the rounded-up distance in kilometers
         """
-        return math.ceil(geopy.distance.great_circle(self.coordinates, other_city.coordinates).km)
+        if instrumentation.active is not None:
+            instrumentation.active.count("distance_calls")
+        return math.ceil(great_circle_km(*self.coordinates, *other_city.coordinates))
+
+    def distances(self, other_cities: list[City]) -> list[int]:
+        """
+        Returns the distances in kilometers between this city and each of the given cities,
+        rounded up to integers. Gives the same results as calling distance on each city,
+        but computes them in one batch.
+
+        :param other_cities: the cities to measure the distance to
+        :return: the rounded-up distances in kilometers, in the same order as other_cities
+        """
+        return City.distance_engine.one_to_many(self.index, [city.index for city in other_cities]).tolist()
 
     def __str__(self) -> str:
         """
@@ -78,6 +187,41 @@ class City():
         return [self.name, '{}'.format(self.coordinates), self.city_type, '{}'.format(self.population), '{}'.format(self.city_id)]
 
 
+def create_cities(names: list[str], latitudes: np.ndarray, longitudes: np.ndarray, city_types: list[str],
+                  populations: np.ndarray, city_ids: np.ndarray) -> list[City]:
+    """
+    Creates many cities at once, filling the columns of City.table in bulk.
+    The result is the same as creating each city with City(...) in order.
+
+    :param names: the names of the cities.
+    :param latitudes: the latitudes of the cities.
+    :param longitudes: the longitudes of the cities.
+    :param city_types: the types of the cities (e.g. admin). Can be empty.
+    :param populations: the populations of the cities.
+    :param city_ids: the IDs of the cities, each unique to its city.
+    :return: the list of created cities, in the same order as the data.
+    """
+    table = City.table
+    start = table.add_points(latitudes, longitudes)
+    stop = start + len(names)
+    table.population[start:stop] = populations
+    table.city_id[start:stop] = city_ids
+    table.type_code[start:stop] = [table.code_of_type(city_type) for city_type in city_types]
+
+    cities = []
+    for index, name, city_id in zip(range(start, stop), names, np.asarray(city_ids).tolist()):
+        # the row is already filled, only the instance remains to be made and registered
+        city = City.__new__(City)
+        city.index = index
+        city.name = sys.intern(name)
+        city._country = None
+        City.index_to_cities.append(city)
+        City.id_to_cities[city_id] = city
+        City.name_to_cities.setdefault(city.name, []).append(city)
+        cities.append(city)
+    City.registry_version += 1
+    return cities
+
 def get_city_by_id(city_id: int) -> City | None:
     """
     Given a city ID, returns the city with that ID if one is known, None otherwise.
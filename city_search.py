@@ -0,0 +1,244 @@
+"""
+@file city_search.py
+"""
+from __future__ import annotations
+from bisect import bisect_left
+import re
+import unicodedata
+import numpy as np
+from city import City, create_example_cities
+
+def normalize_name(name: str) -> str:
+    """
+    Returns the form of a city name used to compare names: without accents, case folded,
+    and with punctuation and runs of spaces replaced by a single space.
+    For example, "São  Paulo" and "sao-paulo" both become "sao paulo".
+
+    :param name: the name.
+    :return: the normalized name.
+    """
+    without_accents = "".join(character for character in unicodedata.normalize("NFKD", name)
+                              if not unicodedata.combining(character))
+    return re.sub(r"[\W_]+", " ", without_accents.casefold()).strip()
+
+def _trigrams(name: str) -> set[str]:
+    """
+    Returns the sequences of 3 characters of a normalized name, marking its start and end.
+    """
+    padded = f"${name}$"
+    return {padded[start:start + 3] for start in range(len(padded) - 2)}
+
+def edit_distance(first: str, second: str) -> int:
+    """
+    Returns the Levenshtein distance between two strings: the number of characters to insert,
+    delete or replace to turn one into the other.
+
+    :param first: the first string.
+    :param second: the second string.
+    :return: the distance.
+    """
+    codes = np.array([[ord(character) for character in second]], dtype=np.int32).reshape(1, len(second))
+    return int(_edit_distances(first, codes, np.array([len(second)]))[0])
+
+def _edit_distances(query: str, codes: np.ndarray, lengths: np.ndarray, max_distance: int | None = None) -> np.ndarray:
+    """
+    Returns the Levenshtein distances between a string and many others at once.
+
+    :param query: the string.
+    :param codes: the code points of the other strings, one per row, padded with zeros.
+    :param lengths: the lengths of the other strings.
+    :param max_distance: the largest distance of interest, or None for exact distances.
+                         Larger distances are only known to be larger, and returned as max_distance + 1.
+    :return: the distances.
+    """
+    width = codes.shape[1]
+    columns = np.arange(width + 1)
+    distances = np.full(len(codes), max_distance + 1 if max_distance is not None else 0, dtype=np.int64)
+    # the rows of the strings still within max_distance
+    rows = np.arange(len(codes))
+    # the distances between the first characters of the query and every prefix of the other strings,
+    # starting with none of the characters of the query
+    previous = np.broadcast_to(columns, (len(codes), width + 1))
+    for row, character in enumerate(query, start=1):
+        # replacing (or keeping) a character, or deleting one from the query
+        best = np.minimum(previous[:, :-1] + (codes != ord(character)), previous[:, 1:] + 1)
+        # inserting characters: the distance to prefix j is the smallest distance to a shorter
+        # prefix k plus j - k, which is a running minimum once the column number is subtracted
+        current = np.empty_like(previous)
+        current[:, 0] = row
+        current[:, 1:] = best
+        previous = np.minimum.accumulate(current - columns, axis=1) + columns
+        if max_distance is not None:
+            # distances never get smaller than the smallest of a row, so the strings
+            # already too far are dropped
+            close = previous.min(axis=1) <= max_distance
+            if not close.all():
+                rows, codes, lengths, previous = rows[close], codes[close], lengths[close], previous[close]
+    distances[rows] = previous[np.arange(len(rows)), lengths]
+    if max_distance is not None:
+        distances = np.minimum(distances, max_distance + 1)
+    return distances
+
+
+class CityNameIndex():
+    """
+    An index of the names of cities, to find cities from what a user typed: the exact name,
+    the start of a name, or a name with a few typos, ignoring case and accents.
+
+    The distinct normalized names are kept in a sorted list, so the names starting with
+    a prefix are a contiguous range found by binary search. Typos are tolerated by looking
+    up the names sharing enough trigrams (sequences of 3 characters) with the query, then
+    computing their edit distance to it. Matches are ranked by population.
+    """
+
+    def __init__(self, cities: list[City]) -> None:
+        """
+        Indexes the names of some cities.
+
+        :param cities: the cities.
+        :return: None
+        """
+        by_name = {}
+        for city in cities:
+            by_name.setdefault(normalize_name(city.name), []).append(city)
+        self.names = sorted(by_name)
+        # the cities of each name, most populated first
+        self.cities = [sorted(by_name[name], key=lambda city: -city.population) for name in self.names]
+        self.positions = {name: position for position, name in enumerate(self.names)}
+        # the largest population of the cities of each name, to rank names
+        self.populations = np.array([cities[0].population for cities in self.cities], dtype=np.int64)
+        self.lengths = np.array([len(name) for name in self.names], dtype=np.int64)
+        # the code points of the characters of each name, padded with zeros, to compute edit distances in bulk
+        self.codes = np.zeros((len(self.names), max(self.lengths, default=0)), dtype=np.int32)
+        for position, name in enumerate(self.names):
+            self.codes[position, :len(name)] = [ord(character) for character in name]
+
+        postings = {}
+        for position, name in enumerate(self.names):
+            for trigram in _trigrams(name):
+                postings.setdefault(trigram, []).append(position)
+        self.trigrams = {trigram: np.array(positions, dtype=np.int32) for trigram, positions in postings.items()}
+        self.registry_version = City.registry_version
+
+    def __len__(self) -> int:
+        """
+        Returns the number of distinct normalized names.
+        """
+        return len(self.names)
+
+    def exact(self, query: str) -> list[City]:
+        """
+        Returns the cities whose name is the query once normalized, most populated first.
+
+        :param query: the name typed by the user.
+        :return: the cities, possibly none.
+        """
+        position = self.positions.get(normalize_name(query))
+        return list(self.cities[position]) if position is not None else []
+
+    def _most_populated(self, positions: np.ndarray, limit: int) -> list[int]:
+        """
+        Returns the positions of the limit names with the largest populations, largest first.
+        """
+        if len(positions) > limit:
+            positions = positions[np.argpartition(-self.populations[positions], limit - 1)[:limit]]
+        return positions[np.argsort(-self.populations[positions], kind="stable")].tolist()
+
+    def _prefix_range(self, prefix: str) -> tuple[int, int]:
+        """
+        Returns the range of positions of the names starting with a normalized prefix.
+        """
+        return bisect_left(self.names, prefix), bisect_left(self.names, prefix + "\U0010ffff")
+
+    def _fuzzy(self, query: str, max_edits: int) -> list[tuple[int, int]]:
+        """
+        Returns the positions of the names at most max_edits edits away from a normalized query,
+        with their edit distance.
+        """
+        trigrams = _trigrams(query)
+        postings = [self.trigrams[trigram] for trigram in trigrams if trigram in self.trigrams]
+        if not postings:
+            return []
+        # an edit changes at most 3 trigrams, so a close name shares most trigrams with the query
+        shared = np.bincount(np.concatenate(postings), minlength=len(self.names))
+        candidates = np.flatnonzero((shared >= max(1, len(trigrams) - 3 * max_edits))
+                                    & (np.abs(self.lengths - len(query)) <= max_edits))
+        if len(candidates) == 0:
+            return []
+        lengths = self.lengths[candidates]
+        distances = _edit_distances(query, self.codes[candidates, :lengths.max()], lengths, max_edits)
+        close = distances <= max_edits
+        return list(zip(candidates[close].tolist(), distances[close].tolist()))
+
+    def search(self, query: str, limit: int = 10) -> list[City]:
+        """
+        Returns the cities best matching what a user typed: first the cities with that exact
+        name, then those whose name starts with it, then those whose name is a few typos away
+        from it. Cities are ranked by population within each group, and fewer typos first.
+
+        :param query: the name, or the start of the name, typed by the user.
+        :param limit: the maximum number of cities to return.
+        :return: the matching cities, best first.
+        """
+        query = normalize_name(query)
+        if not query or limit <= 0:
+            return []
+        ranked = []
+        seen = set()
+
+        def add(position: int) -> None:
+            if position not in seen:
+                seen.add(position)
+                ranked.extend(self.cities[position])
+
+        first, last = self._prefix_range(query)
+        # the exact name, if any, is the first of the names starting with it
+        if first < last and self.names[first] == query:
+            add(first)
+        for position in self._most_populated(np.arange(first, last), limit):
+            if len(ranked) >= limit:
+                break
+            add(position)
+
+        # typos are only looked for when too few names start with the query
+        max_edits = 0 if len(query) < 3 else 1 if len(query) < 8 else 2
+        if len(ranked) < limit and max_edits > 0:
+            matches = self._fuzzy(query, max_edits)
+            for position, _ in sorted(matches, key=lambda match: (match[1], -self.populations[match[0]])):
+                if len(ranked) >= limit:
+                    break
+                add(position)
+        return ranked[:limit]
+
+
+# the index of the names of the cities known, rebuilt when cities are added or changed
+_name_index = None
+
+def city_name_index() -> CityNameIndex:
+    """
+    Returns an index of the names of all the cities known, building it if it does not
+    exist yet or if cities were created or changed since it was built.
+
+    :return: the index.
+    """
+    global _name_index
+    if _name_index is None or _name_index.registry_version != City.registry_version:
+        _name_index = CityNameIndex(City.index_to_cities)
+    return _name_index
+
+def search_cities(query: str, limit: int = 10) -> list[City]:
+    """
+    Returns the cities best matching what a user typed, ignoring case and accents:
+    the cities with that name, then those whose name starts with it, then those whose
+    name is close to it, each ranked by population. See CityNameIndex.search.
+
+    :param query: the name, or the start of the name, typed by the user.
+    :param limit: the maximum number of cities to return.
+    :return: the matching cities, best first.
+    """
+    return city_name_index().search(query, limit)
+
+if __name__ == "__main__":
+    create_example_cities()
+    for query in ["santiago", "SANTIAGO", "mel", "Sidney", "kuala lumpor", "Canbera", "xyz"]:
+        print(f"{query}: {', '.join(str(city) for city in search_cities(query, 5))}")
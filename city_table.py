@@ -0,0 +1,77 @@
+"""
+@file city_table.py
+"""
+from __future__ import annotations
+from typing import Sequence
+import numpy as np
+from distances import DistanceEngine
+
+class CityTable(DistanceEngine):
+    """
+    Stores the data of every city in columns, one NumPy array per attribute,
+    with one row per city. Instances of City are lightweight views on a row.
+
+    The table is also the distance engine of the cities: rows are the indices
+    its distance queries take.
+    """
+
+    columns = {
+        **DistanceEngine.columns,
+        "latitude": (np.float64, 0.0),
+        "longitude": (np.float64, 0.0),
+        "population": (np.int64, 0),
+        "type_code": (np.int16, 0), # index of the city type in city_types
+        "country_index": (np.int32, -1), # index of the country in Country.index_to_countries, -1 if none
+        "city_id": (np.int64, 0),
+    }
+
+    def __init__(self, capacity: int = 1024) -> None:
+        """
+        Creates an empty table.
+
+        :param capacity: the number of rows to allocate room for up front.
+        :return: None
+        """
+        super().__init__(capacity)
+        self.city_types = [""] # associates a type code to a city type
+        self._type_codes = {"": 0} # associates a city type to its type code
+
+    def code_of_type(self, city_type: str) -> int:
+        """
+        Returns the code of a city type, giving it a new code if it has none yet.
+
+        :param city_type: the type of city (e.g. admin). Can be empty.
+        :return: the code of the city type.
+        """
+        code = self._type_codes.get(city_type)
+        if code is None:
+            code = self._type_codes[city_type] = len(self.city_types)
+            self.city_types.append(city_type)
+        return code
+
+    def set_point(self, index: int, coordinates: tuple[float, float]) -> None:
+        super().set_point(index, coordinates)
+        self.latitude[index] = coordinates[0]
+        self.longitude[index] = coordinates[1]
+
+    def set_points(self, start: int, latitudes: Sequence[float] | np.ndarray,
+                   longitudes: Sequence[float] | np.ndarray) -> None:
+        super().set_points(start, latitudes, longitudes)
+        self.latitude[start:start + len(latitudes)] = latitudes
+        self.longitude[start:start + len(longitudes)] = longitudes
+
+    def column(self, name: str) -> np.ndarray:
+        """
+        Returns one of the columns, with one value per row.
+        The array is a view: it must not be kept while rows are added.
+
+        :param name: the name of the column, one of the keys of CityTable.columns.
+        :return: the array of values.
+        """
+        return getattr(self, name)[:len(self)]
+
+    def nbytes(self) -> int:
+        """
+        Returns the memory used by the columns, in bytes.
+        """
+        return sum(getattr(self, name).nbytes for name in self.columns)
@@ -1,15 +1,21 @@
 """
 @file country.py
 """
-from tabulate import tabulate
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from operator import itemgetter
+import numpy as np
 from city import City, create_example_cities
 
 class Country():
     """
     Represents a country.
     """
+    __slots__ = ("name", "iso3", "cities", "version", "index", "_type_positions", "_by_population", "_population_keys")
 
     name_to_countries = {} # a dict that associates country names to instances.
+    index_to_countries = [] # associates the index of a country (as stored in City.table) to its instance
+    registry_version = 0 # incremented whenever a country is created or gains a city
 
     def __init__(self, name: str, iso3: str) -> None:
         """
@@ -22,7 +28,14 @@ class Country():
         self.name = name
         self.iso3 = iso3
         self.cities = []
+        self.version = 0 # incremented whenever this country gains a city
+        self._type_positions = {} # associates a city type to the positions in self.cities of the cities of that type
+        self._by_population = [] # the cities, from most to least populous
+        self._population_keys = [] # minus the population of each city of _by_population, in increasing order
+        self.index = len(Country.index_to_countries)
+        Country.index_to_countries.append(self)
         Country.name_to_countries[name] = self
+        Country.registry_version += 1
         
     def add_city(self, city: City) -> None:
         """
@@ -32,7 +45,82 @@ class Country():
         :return: None
         """
         self.cities.append(city)
+        self._type_positions.setdefault(city.city_type, []).append(len(self.cities) - 1)
+        self._insert_by_population(city)
         city.country = self
+        self.version += 1
+        Country.registry_version += 1
+
+    def add_cities(self, cities: list[City]) -> None:
+        """
+        Adds several cities to the country at once, in order. Gives the same result as
+        calling add_city on each, but reads their types and populations in bulk.
+
+        :param cities: The cities to add to this country
+        :return: None
+        """
+        start = len(self.cities)
+        self.cities.extend(cities)
+        indices = np.array([city.index for city in cities], dtype=np.intp)
+        table = City.table
+        for position, type_code in enumerate(table.type_code[indices].tolist(), start=start):
+            self._type_positions.setdefault(table.city_types[type_code], []).append(position)
+        # a stable sort keeps the cities with the same population in the order they were added
+        entries = sorted(zip(self._population_keys + (-table.population[indices]).tolist(), self._by_population + cities),
+                         key=itemgetter(0))
+        self._population_keys = [key for key, _ in entries]
+        self._by_population = [city for _, city in entries]
+        for city in cities:
+            city._country = self
+        table.country_index[indices] = self.index
+        self.version += 1
+        Country.registry_version += 1
+
+    def _insert_by_population(self, city: City) -> None:
+        """
+        Inserts a city in the population-sorted view, after the cities with the same population.
+        """
+        position = bisect_right(self._population_keys, -city.population)
+        self._population_keys.insert(position, -city.population)
+        self._by_population.insert(position, city)
+
+    def _remove_by_population(self, city: City, population: int) -> None:
+        """
+        Removes a city from the population-sorted view, given the population it was sorted by.
+        """
+        position = bisect_left(self._population_keys, -population)
+        while self._by_population[position] is not city:
+            position += 1
+        del self._population_keys[position]
+        del self._by_population[position]
+
+    def update_city_type(self, city: City, previous_type: str) -> None:
+        """
+        Moves a city of the country to the bucket of its new type. Called by City when the type changes.
+
+        :param city: the city, with its new type.
+        :param previous_type: the type the city had.
+        :return: None
+        """
+        previous_positions = self._type_positions[previous_type]
+        positions = [position for position in previous_positions if self.cities[position] is city]
+        self._type_positions[previous_type] = [position for position in previous_positions if self.cities[position] is not city]
+        if not self._type_positions[previous_type]:
+            del self._type_positions[previous_type]
+        # buckets stay in the order of self.cities
+        self._type_positions[city.city_type] = sorted(self._type_positions.get(city.city_type, []) + positions)
+
+    def update_city_population(self, city: City, previous_population: int) -> None:
+        """
+        Moves a city of the country to its new place in the population-sorted view.
+        Called by City when the population changes.
+
+        :param city: the city, with its new population.
+        :param previous_population: the population the city had.
+        :return: None
+        """
+        self._remove_by_population(city, previous_population)
+        self._insert_by_population(city)
 
     def get_cities(self, city_type: list[str] = None) -> list[City]:
         """
@@ -47,11 +135,32 @@ class Country():
         :return: a list of cities in this country that have the specified city types.
         """
         if city_type != None:
-            # return cities based on a predicate if there is one
-            return [city for city in self.cities if city.city_type in city_type]
+            # take the cities from the bucket of each type, in the order they were added to the country
+            buckets = [self._type_positions[one_type] for one_type in set(city_type) if one_type in self._type_positions]
+            positions = buckets[0] if len(buckets) == 1 else merge(*buckets)
+            return [self.cities[position] for position in positions]
         else:
             # otherwise just return all cities
-            return [city for city in self.cities]
+            return list(self.cities)
+
+    def get_most_populous_cities(self, count: int | None = None, city_type: list[str] | None = None) -> list[City]:
+        """
+        Returns the most populous cities of this country, from most to least populous.
+        Cities with the same population are in the order they were added to the country.
+
+        :param count: the maximum number of cities to return, or None for all of them.
+        :param city_type: None, or a list of strings, each of which describes the type of city.
+        :return: a list of the cities.
+        """
+        if city_type == None:
+            return self._by_population[:count]
+        cities = []
+        for city in self._by_population:
+            if count is not None and len(cities) >= count:
+                break
+            if city.city_type in city_type:
+                cities.append(city)
+        return cities
 
     def print_cities(self) -> None:
         """
@@ -63,11 +172,13 @@ class Country():
         # this will be a list of lists of each row of the table. pre-populate it with the headers
         table_rows = [["Order", "Name", "Coordinates", "City type", "Population", "City ID"]]
 
-        # sort the cities based on their population. we get this using a lambda function
-        # then iterate through this sorted list, using enumerate so we can get the order (index) into another variable
-        for index, city in enumerate(sorted(self.cities, key=lambda city: city.population, reverse=True)):
+        # the cities are kept sorted by population as they are added, so they only need to be numbered
+        # using enumerate so we can get the order (index) into another variable
+        for index, city in enumerate(self._by_population):
             table_rows.append([index, city.name, city.coordinates, city.city_type, city.population, city.city_id])
 
+        # tabulate is only needed here, so programs that never print a table do not pay for importing it
+        from tabulate import tabulate
         print("Cities of {}".format(self.name))
         print(tabulate(table_rows))
 
@@ -94,6 +205,20 @@ def add_city_to_country(city: City, country_name: str, country_iso3: str) -> Non
         new_country = Country(country_name, country_iso3)
         new_country.add_city(city)
 
+def add_cities_to_country(cities: list[City], country_name: str, country_iso3: str) -> None:
+    """
+    Adds several cities to a country, like add_city_to_country does for one.
+    If the country does not exist, create it.
+
+    :param cities: The cities to add
+    :param country_name: The name of the country
+    :param country_iso3: The unique 3-letter identifier of this country
+    :return: None
+    """
+    if country_name not in Country.name_to_countries:
+        Country(country_name, country_iso3)
+    Country.name_to_countries[country_name].add_cities(cities)
+
 def find_country_of_city(city: City) -> Country:
     """
     Returns the Country this city belongs to.
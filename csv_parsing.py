@@ -2,8 +2,102 @@
 @file city_country_csv_reader.py
 """
 import csv
-from city import City
-from country import Country, add_city_to_country
+import hashlib
+import itertools
+import os
+import time
+import zipfile
+from typing import Callable, Iterable, Iterator
+import numpy as np
+from city import City, create_cities
+from country import Country, add_cities_to_country
+import instrumentation
+
+# Version of the layout of snapshot files, to be incremented whenever it changes
+SNAPSHOT_VERSION = 1
+
+# The columns of the CSV file that are loaded, and the type of each
+CSV_COLUMNS = {"city_ascii": str, "lat": float, "lng": float, "capital": str,
+               "population": int, "id": int, "country": str, "iso3": str}
+
+def read_csv_columns(path_to_csv: str) -> dict[str, np.ndarray]:
+    """
+    Reads a CSV file given its path in one pass and returns its data column by column.
+    Populations that are not integers are read as 0.
+
+    :param path_to_csv: The path to the CSV file.
+    :return: a dict that associates each name of CSV_COLUMNS to an array with one value per line.
+    :raise ValueError: if a line has fewer fields than the header needs.
+    """
+    with open(path_to_csv, 'r') as csvfile:
+        csvreader = csv.reader(csvfile)
+        positions = _column_positions(next(csvreader))
+        return _columns_from_rows(list(_row_values(csvreader, positions, path_to_csv)))
+
+def _column_positions(header: list[str]) -> list[int]:
+    """
+    Returns the position in a row of each of CSV_COLUMNS, given the header of the CSV file.
+    """
+    return [header.index(name) for name in CSV_COLUMNS]
+
+def _row_values(csvreader: Iterator[list[str]], positions: list[int], path_to_csv: str) -> Iterator[list[str]]:
+    """
+    Yields the values of CSV_COLUMNS of each line read by a CSV reader, skipping empty lines.
+
+    :raise ValueError: if a line has too few fields, with the line of the file it is on.
+    """
+    field_count = max(positions) + 1
+    for row in csvreader:
+        if not row:
+            continue
+        if len(row) < field_count:
+            raise ValueError(f'{path_to_csv}, line {csvreader.line_num}: {len(row)} fields instead of at least {field_count}')
+        yield [row[position] for position in positions]
+
+def _columns_from_rows(rows: list[list[str]]) -> dict[str, np.ndarray]:
+    """
+    Converts rows of strings, with one value per name of CSV_COLUMNS, to typed columns.
+    """
+    # transpose the rows into one tuple of strings per column
+    values = dict(zip(CSV_COLUMNS, zip(*rows))) if rows else {name: () for name in CSV_COLUMNS}
+
+    columns = {}
+    for name, kind in CSV_COLUMNS.items():
+        if kind is str:
+            columns[name] = np.array(values[name], dtype=str)
+        elif kind is float:
+            columns[name] = np.array(values[name], dtype=np.float64)
+        elif name == "population":
+            columns[name] = np.array([_parse_population(value) for value in values[name]], dtype=np.int64)
+        else:
+            columns[name] = np.array([int(value) for value in values[name]], dtype=np.int64)
+    return columns
+
+def _parse_population(value: str) -> int:
+    """
+    Returns a population read from the CSV file, 0 if it is not an integer.
+    """
+    try:
+        return int(value)
+    except ValueError:
+        return 0
+
+def create_cities_countries_from_columns(columns: dict[str, np.ndarray]) -> list[City]:
+    """
+    Creates instances of City and Country for each line of data returned by read_csv_columns.
+
+    :param columns: the data, column by column.
+    :return: the cities created, in order.
+    """
+    cities = create_cities(columns['city_ascii'].tolist(), columns['lat'], columns['lng'], columns['capital'].tolist(),
+                           columns['population'], columns['id'])
+    # add the cities to the country specified, in order, with the countries created in the order they first appear
+    by_country = {}
+    for city, country, iso3 in zip(cities, columns['country'].tolist(), columns['iso3'].tolist()):
+        by_country.setdefault(country, (iso3, []))[1].append(city)
+    for country, (iso3, country_cities) in by_country.items():
+        add_cities_to_country(country_cities, country, iso3)
+    return cities
 
 def create_cities_countries_from_csv(path_to_csv: str) -> None:
     """
@@ -11,27 +105,266 @@ def create_cities_countries_from_csv(path_to_csv: str) -> None:
 
     :param path_to_csv: The path to the CSV file.
     """
-    with open(path_to_csv, 'r') as csvfile:
-        csvreader = csv.DictReader(csvfile)
-
-        # Creating the country by iterating through each row in csv file
-        for row in csvreader:
-            country = str(row['country'])
-            iso3 = str(row['iso3'])
-            name = str(row['city_ascii'])
-            coordinates = (float(row['lat']), float(row['lng']))
-            city_type = str(row['capital'])
+    with instrumentation.phase("dataset_load"):
+        create_cities_countries_from_columns(read_csv_columns(path_to_csv))
+
+def default_snapshot_path(path_to_csv: str) -> str:
+    """
+    Returns the path of the snapshot of a CSV file used when none is given.
+
+    :param path_to_csv: The path to the CSV file.
+    :return: the path of the snapshot, next to the CSV file.
+    """
+    return path_to_csv + '.snapshot.npz'
+
+def _file_hash(path: str) -> str:
+    """
+    Returns the SHA-256 hash of the content of a file, in hexadecimal.
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def write_snapshot(columns: dict[str, np.ndarray], path_to_csv: str, snapshot_path: str) -> None:
+    """
+    Writes the data read from a CSV file to a binary snapshot, along with what identifies
+    the version of the CSV file it was read from: its modification time, size and hash.
+
+    :param columns: the data, as returned by read_csv_columns.
+    :param path_to_csv: The path to the CSV file the data was read from.
+    :param snapshot_path: The path of the snapshot to write.
+    :return: None
+    """
+    status = os.stat(path_to_csv)
+    # unique per process, as several processes may load the same file at once
+    temporary_path = f'{snapshot_path}.{os.getpid()}.tmp.npz'
+    np.savez(temporary_path, snapshot_version=SNAPSHOT_VERSION, source_mtime_ns=status.st_mtime_ns,
+             source_size=status.st_size, source_hash=_file_hash(path_to_csv), **columns)
+    # replace the snapshot in one step so that a reader never sees half of it
+    os.replace(temporary_path, snapshot_path)
+
+def read_snapshot(path_to_csv: str, snapshot_path: str) -> dict[str, np.ndarray] | None:
+    """
+    Returns the data of a snapshot if it was written from the current version of a CSV file
+    by the current version of this module, or None otherwise.
+    The hash of the CSV file is only computed if its modification time or size changed.
+
+    :param path_to_csv: The path to the CSV file.
+    :param snapshot_path: The path of the snapshot.
+    :return: the data, column by column, or None if the snapshot is missing or stale.
+    """
+    try:
+        with np.load(snapshot_path, allow_pickle=False) as snapshot:
+            if int(snapshot['snapshot_version']) != SNAPSHOT_VERSION:
+                return None
+            status = os.stat(path_to_csv)
+            unchanged = (int(snapshot['source_mtime_ns']) == status.st_mtime_ns
+                         and int(snapshot['source_size']) == status.st_size)
+            if not unchanged and str(snapshot['source_hash']) != _file_hash(path_to_csv):
+                return None
+            return {name: snapshot[name] for name in CSV_COLUMNS}
+    except (OSError, EOFError, KeyError, ValueError, zipfile.BadZipFile):
+        return None
+
+class LoadReport():
+    """
+    Describes how the cities and countries were loaded.
+    """
+
+    def __init__(self, path_to_csv: str, from_snapshot: bool, seconds: float, city_count: int) -> None:
+        """
+        :param path_to_csv: The path to the CSV file.
+        :param from_snapshot: True if the data came from a snapshot (a warm load), False if the CSV was parsed.
+        :param seconds: how long loading took.
+        :param city_count: the number of cities loaded.
+        """
+        self.path_to_csv = path_to_csv
+        self.from_snapshot = from_snapshot
+        self.seconds = seconds
+        self.city_count = city_count
+
+    def __str__(self) -> str:
+        """
+        Returns a description of the load, for example
+        "Loaded 47868 cities from worldcities.csv (warm, from snapshot) in 0.091 s"
+        """
+        kind = 'warm, from snapshot' if self.from_snapshot else 'cold, parsed'
+        return f'Loaded {self.city_count} cities from {self.path_to_csv} ({kind}) in {self.seconds:.3f} s'
+
+def load_cities_countries(path_to_csv: str, snapshot_path: str | None = None) -> LoadReport:
+    """
+    Creates instances of City and Country for each line of a CSV file, like
+    create_cities_countries_from_csv, but reads the data from a binary snapshot if there
+    is an up to date one. Otherwise the CSV file is parsed and the snapshot (re)written,
+    so that the next load is fast.
+
+    :param path_to_csv: The path to the CSV file.
+    :param snapshot_path: The path of the snapshot, by default next to the CSV file.
+    :return: a report of how long loading took and whether the snapshot was used.
+    """
+    start = time.perf_counter()
+    snapshot_path = snapshot_path or default_snapshot_path(path_to_csv)
+    with instrumentation.phase("dataset_load"):
+        columns = read_snapshot(path_to_csv, snapshot_path)
+        from_snapshot = columns is not None
+        if not from_snapshot:
+            columns = read_csv_columns(path_to_csv)
             try:
-                city_population = int(row['population'])
-            except ValueError:
-                city_population = 0
-            city_id = int(row['id'])
+                write_snapshot(columns, path_to_csv, snapshot_path)
+            except OSError:
+                # a snapshot is only an optimisation, loading goes on without one
+                pass
+        create_cities_countries_from_columns(columns)
+    return LoadReport(path_to_csv, from_snapshot, time.perf_counter() - start, len(columns['id']))
+
+class RowFilter():
+    """
+    Selects the lines of a CSV file to load, before any city is created for them.
+    A line is kept if it passes every criterion that is set.
+    """
+
+    def __init__(self, countries: Iterable[str] | None = None, min_population: int = 0,
+                 city_types: Iterable[str] | None = None) -> None:
+        """
+        :param countries: the names or ISO3 codes of the countries to keep, or None to keep all.
+        :param min_population: the smallest population to keep.
+        :param city_types: the types of cities to keep (e.g. "primary", or "" for none), or None to keep all.
+        :return: None
+        """
+        self.countries = sorted(set(countries)) if countries is not None else None
+        self.min_population = min_population
+        self.city_types = sorted(set(city_types)) if city_types is not None else None
+
+    def mask(self, columns: dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Returns which lines of some data to keep.
+
+        :param columns: the data, column by column, as returned by read_csv_columns.
+        :return: an array of booleans, True for each line to keep.
+        """
+        keep = columns['population'] >= self.min_population
+        if self.countries is not None:
+            keep &= np.isin(columns['country'], self.countries) | np.isin(columns['iso3'], self.countries)
+        if self.city_types is not None:
+            keep &= np.isin(columns['capital'], self.city_types)
+        return keep
+
+    def apply(self, columns: dict[str, np.ndarray]) -> dict[str, np.ndarray]:
+        """
+        Returns the lines of some data to keep, column by column.
+
+        :param columns: the data, column by column, as returned by read_csv_columns.
+        :return: the same columns, without the lines that are filtered out.
+        """
+        keep = self.mask(columns)
+        return {name: column[keep] for name, column in columns.items()}
+
+class IngestProgress():
+    """
+    How far the streaming ingestion of a CSV file has got.
+    """
+
+    def __init__(self, total_bytes: int) -> None:
+        """
+        :param total_bytes: the size of the CSV file in bytes.
+        :return: None
+        """
+        self.total_bytes = total_bytes
+        self.bytes_read = 0
+        self.rows_read = 0
+        self.rows_kept = 0
+        self.chunks = 0
+
+    @property
+    def fraction(self) -> float:
+        """
+        The fraction of the CSV file read so far, between 0 and 1.
+        """
+        return self.bytes_read / self.total_bytes if self.total_bytes else 1.0
+
+    def __str__(self) -> str:
+        """
+        Returns a description of the progress, for example
+        "41.5% read: 1200000 rows, 8300 kept"
+        """
+        return f'{100 * self.fraction:.1f}% read: {self.rows_read} rows, {self.rows_kept} kept'
+
+def iter_csv_chunks(path_to_csv: str, chunk_size: int = 65536,
+                    progress: IngestProgress | None = None) -> Iterator[dict[str, np.ndarray]]:
+    """
+    Reads a CSV file given its path in chunks of at most chunk_size lines, and yields the
+    data of each chunk column by column, as read_csv_columns would return it.
+    Only one chunk is held in memory at a time.
+
+    :param path_to_csv: The path to the CSV file.
+    :param chunk_size: the maximum number of lines per chunk.
+    :param progress: updated with the number of bytes and lines read before each chunk is yielded.
+    :return: a generator of chunks.
+    :raise ValueError: if a line has fewer fields than the header needs.
+    """
+    with open(path_to_csv, 'rb') as binary_file:
+        def lines() -> Iterator[str]:
+            # decode the lines here rather than through a text file, so that the bytes read can be counted
+            for line in binary_file:
+                if progress is not None:
+                    progress.bytes_read += len(line)
+                yield line.decode('utf-8')
+
+        csvreader = csv.reader(lines())
+        values = _row_values(csvreader, _column_positions(next(csvreader)), path_to_csv)
+        while True:
+            rows = list(itertools.islice(values, chunk_size))
+            if not rows:
+                return
+            if progress is not None:
+                progress.rows_read += len(rows)
+                progress.chunks += 1
+            yield _columns_from_rows(rows)
 
-            # create and add city to country specified
-            city_created = City(name, coordinates, city_type, city_population, city_id)
-            add_city_to_country(city_created, country, iso3)
+def stream_cities_countries(path_to_csv: str, chunk_size: int = 65536, row_filter: RowFilter | None = None,
+                            on_progress: Callable[[IngestProgress], None] | None = None) -> Iterator[list[City]]:
+    """
+    Creates instances of City and Country for the lines of a CSV file that pass a filter,
+    reading the file in chunks so that files too large for memory can be loaded.
+    Lines are filtered before any object is created for them, so peak memory is bounded by
+    the size of a chunk plus the cities kept.
+
+    The cities of each chunk are yielded as soon as they are created, so a caller can use
+    partial results or stop early; the file is only read as far as the generator is consumed.
+
+    :param path_to_csv: The path to the CSV file.
+    :param chunk_size: the maximum number of lines read at a time.
+    :param row_filter: which lines to load, by default all of them.
+    :param on_progress: called with the progress after each chunk.
+    :return: a generator of the lists of cities created from each chunk.
+    """
+    progress = IngestProgress(os.path.getsize(path_to_csv))
+    for columns in iter_csv_chunks(path_to_csv, chunk_size, progress):
+        if row_filter is not None:
+            columns = row_filter.apply(columns)
+        cities = create_cities_countries_from_columns(columns)
+        progress.rows_kept += len(cities)
+        if on_progress is not None:
+            on_progress(progress)
+        yield cities
+
+def ingest_cities_countries(path_to_csv: str, chunk_size: int = 65536, row_filter: RowFilter | None = None,
+                            on_progress: Callable[[IngestProgress], None] | None = None) -> int:
+    """
+    Loads the lines of a CSV file that pass a filter with stream_cities_countries, to the end.
+
+    :param path_to_csv: The path to the CSV file.
+    :param chunk_size: the maximum number of lines read at a time.
+    :param row_filter: which lines to load, by default all of them.
+    :param on_progress: called with the progress after each chunk.
+    :return: the number of cities created.
+    """
+    return sum(len(cities) for cities in stream_cities_countries(path_to_csv, chunk_size, row_filter, on_progress))
 
 if __name__ == "__main__":
-    create_cities_countries_from_csv("worldcities_truncated.csv")
+    # the first run parses the CSV file (cold), later runs read its snapshot (warm)
+    print(load_cities_countries("worldcities_truncated.csv"))
     for country in Country.name_to_countries.values():
         country.print_cities()
@@ -0,0 +1,407 @@
+"""
+@file dinghy_index.py
+"""
+from __future__ import annotations
+import argparse
+import hashlib
+import math
+import random
+import time
+import numpy as np
+from city import City, get_city_by_id
+from country import Country
+from primary_backbone import fastest_hub_trips, hub_path
+from vehicles import DiplomacyDonutDinghy
+
+# Version of the layout of index files, to be incremented whenever it changes
+INDEX_VERSION = 1
+
+class DinghyIndex():
+    """
+    A hub-labelling index of the routing graph of a DiplomacyDonutDinghy, which answers
+    fastest-itinerary queries with a few array lookups instead of a graph search.
+
+    Any itinerary that is not a single trip inside a country goes through primary cities,
+    and only leaves the country of its departure city from one of them. So every city is
+    labelled with the travel time to each primary city of its country (its hubs), and the
+    fastest travel times between all pairs of primary cities are precomputed. A query takes
+    the best of the direct trip and of every departure hub + hub to hub + arrival hub.
+
+    The index holds city IDs rather than City instances, so it can be saved to disk and
+    loaded in another process that loaded the same cities. Cities without a country are
+    not indexed.
+    """
+
+    def __init__(self, in_country_speed: int, between_primary_speed: int, arrays: dict[str, np.ndarray]) -> None:
+        """
+        Creates an index from the arrays computed by build_dinghy_index or loaded from a file.
+
+        :param in_country_speed: the in-country speed of the vehicle the index was built for.
+        :param between_primary_speed: the speed between primary cities of that vehicle.
+        :param arrays: the arrays of the index, by name (see build_dinghy_index).
+        :return: None
+        """
+        self.in_country_speed = in_country_speed
+        self.between_primary_speed = between_primary_speed
+        self.arrays = arrays
+        self.city_ids = arrays['city_ids']
+        self.hubs = arrays['hubs']
+        self.hub_hours = arrays['hub_hours']
+        self.hub_next = arrays['hub_next']
+        self.hub_via = arrays['hub_via']
+        self.label_starts = arrays['label_starts']
+        self.label_hubs = arrays['label_hubs']
+        self.label_hours = arrays['label_hours']
+        self.fingerprint = str(arrays['fingerprint'])
+
+        # the indexed cities, and the row of each city of City.table in the index (-1 if not indexed)
+        self.cities = [get_city_by_id(city_id) for city_id in self.city_ids.tolist()]
+        self._rows = np.full(len(City.table), -1, dtype=np.intp)
+        if None not in self.cities:
+            self._rows[[city.index for city in self.cities]] = np.arange(len(self.cities))
+
+    def __len__(self) -> int:
+        """
+        Returns the number of cities in the index.
+        """
+        return len(self.city_ids)
+
+    def nbytes(self) -> int:
+        """
+        Returns the memory used by the arrays of the index, in bytes.
+
+        :return: the number of bytes.
+        """
+        return sum(array.nbytes for array in self.arrays.values())
+
+    def matches(self, vehicle: DiplomacyDonutDinghy) -> bool:
+        """
+        Returns True if the index was built for a vehicle with the same speeds.
+
+        :param vehicle: the vehicle.
+        :return: True if the index answers queries for the vehicle.
+        """
+        return (vehicle.in_country_speed, vehicle.between_primary_speed) == (self.in_country_speed, self.between_primary_speed)
+
+    def is_current(self) -> bool:
+        """
+        Returns True if the cities and countries loaded are still the ones the index was built from.
+
+        :return: True if the index can be used.
+        """
+        if None in self.cities or len(self.cities) != _indexed_city_count():
+            return False
+        return _fingerprint(self.cities) == self.fingerprint
+
+    def _row(self, city: City) -> int:
+        """
+        Returns the row of a city in the index, or -1 if it is not indexed.
+        """
+        return int(self._rows[city.index]) if city.index < len(self._rows) else -1
+
+    def _direct_hours(self, from_city: City, to_city: City) -> float:
+        """
+        Returns the travel time of the direct trip between two cities of the same country,
+        or math.inf if they are in different countries.
+        """
+        if from_city.country is None or from_city.country is not to_city.country:
+            return math.inf
+        distance = from_city.distance(to_city)
+        hours = math.ceil(distance / self.in_country_speed)
+        if from_city.city_type == to_city.city_type == 'primary':
+            hours = max(hours, math.ceil(distance / self.between_primary_speed))
+        return hours
+
+    def _labels(self, row: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the hubs of the city in a row of the index, and the travel time to each.
+        """
+        start, stop = self.label_starts[row], self.label_starts[row + 1]
+        return self.label_hubs[start:stop], self.label_hours[start:stop]
+
+    def _best_route(self, from_city: City, to_city: City) -> tuple[float, int, int]:
+        """
+        Returns the fastest travel time between two indexed cities, with the departure and
+        arrival hubs it goes through, or -1 for both if the direct trip is the fastest.
+        """
+        hours = self._direct_hours(from_city, to_city)
+        from_hubs, from_hours = self._labels(self._row(from_city))
+        to_hubs, to_hours = self._labels(self._row(to_city))
+        if len(from_hubs) == 0 or len(to_hubs) == 0:
+            return hours, -1, -1
+
+        totals = from_hours[:, np.newaxis] + self.hub_hours[np.ix_(from_hubs, to_hubs)] + to_hours[np.newaxis, :]
+        best = np.unravel_index(np.argmin(totals), totals.shape)
+        # on a tie the direct trip is preferred, as it has the fewest legs
+        if totals[best] < hours:
+            return float(totals[best]), int(from_hubs[best[0]]), int(to_hubs[best[1]])
+        return hours, -1, -1
+
+    def travel_time(self, from_city: City, to_city: City) -> float:
+        """
+        Returns the travel time of a fastest itinerary between two cities.
+
+        :param from_city: The departure city.
+        :param to_city: The arrival city.
+        :return: the travel time in hours, or math.inf if there is no itinerary.
+        """
+        if from_city is to_city:
+            return 0.0
+        return self._best_route(from_city, to_city)[0]
+
+    def _hub_path(self, from_hub: int, to_hub: int) -> list[City]:
+        """
+        Returns the cities of a fastest itinerary between two hubs, both included.
+        """
+        return [self.cities[row] for row in hub_path(from_hub, to_hub, self.hub_next, self.hub_via, self.hubs)]
+
+    def shortest_path(self, from_city: City, to_city: City) -> list[City] | None:
+        """
+        Returns the cities of a fastest itinerary between two cities, or None if there is none.
+
+        :param from_city: The departure city.
+        :param to_city: The arrival city.
+        :return: the list of cities from departure to arrival, or None.
+        """
+        if from_city is to_city:
+            return [from_city]
+        hours, from_hub, to_hub = self._best_route(from_city, to_city)
+        if hours == math.inf:
+            return None
+        if from_hub < 0:
+            return [from_city, to_city]
+
+        hub_cities = self._hub_path(from_hub, to_hub)
+        # the departure and arrival cities may be hubs themselves
+        return ([from_city] if hub_cities[0] is not from_city else []) + hub_cities + \
+               ([to_city] if hub_cities[-1] is not to_city else [])
+
+    def indexes(self, city: City) -> bool:
+        """
+        Returns True if a city is in the index.
+
+        :param city: the city.
+        :return: True if queries can be answered for the city.
+        """
+        return self._row(city) >= 0
+
+    def save(self, path: str) -> None:
+        """
+        Saves the index to a file.
+
+        :param path: the path of the file, usually ending in .npz.
+        :return: None
+        """
+        with open(path, 'wb') as file:
+            np.savez(file, index_version=INDEX_VERSION, in_country_speed=self.in_country_speed,
+                     between_primary_speed=self.between_primary_speed, **self.arrays)
+
+    @classmethod
+    def load(cls, path: str) -> DinghyIndex:
+        """
+        Loads an index saved with save. The cities it was built from must be loaded.
+
+        :param path: the path of the file.
+        :return: the index.
+        :raise ValueError: if the file was saved by another version of this module.
+        """
+        with np.load(path, allow_pickle=False) as data:
+            if int(data['index_version']) != INDEX_VERSION:
+                raise ValueError(f'{path} is an index of version {int(data["index_version"])}, not {INDEX_VERSION}')
+            arrays = {name: data[name] for name in data.files
+                      if name not in ('index_version', 'in_country_speed', 'between_primary_speed')}
+            return cls(int(data['in_country_speed']), int(data['between_primary_speed']), arrays)
+
+    def __str__(self) -> str:
+        """
+        Returns a summary of the index, for example
+        "DinghyIndex (300 km/h | 200 km/h): 47868 cities, 243 hubs, 1.2 MB"
+        """
+        return (f'DinghyIndex ({self.in_country_speed} km/h | {self.between_primary_speed} km/h): '
+                f'{len(self)} cities, {len(self.hubs)} hubs, {self.nbytes() / 1e6:.1f} MB')
+
+
+def _indexed_cities() -> list[City]:
+    """
+    Returns the cities to index: the cities of every country, country by country.
+    """
+    cities = {}
+    for country in Country.index_to_countries:
+        for city in country.get_cities():
+            cities.setdefault(city.index, city)
+    return list(cities.values())
+
+def _indexed_city_count() -> int:
+    """
+    Returns the number of cities build_dinghy_index would index now.
+    """
+    return len({city.index for country in Country.index_to_countries for city in country.cities})
+
+def _fingerprint(cities: list[City]) -> str:
+    """
+    Returns a hash of what the travel times between some cities depend on:
+    their IDs, coordinates, types and countries.
+    """
+    indices = np.array([city.index for city in cities], dtype=np.intp)
+    table = City.table
+    digest = hashlib.sha256()
+    digest.update(table.city_id[indices].astype(np.int64).tobytes())
+    digest.update(table.latitude[indices].tobytes())
+    digest.update(table.longitude[indices].tobytes())
+    digest.update((table.type_code[indices] == table.code_of_type('primary')).tobytes())
+    digest.update('\n'.join(city.country.name for city in cities).encode())
+    return digest.hexdigest()
+
+def build_dinghy_index(vehicle: DiplomacyDonutDinghy) -> DinghyIndex:
+    """
+    Builds the hub-labelling index of a vehicle over the cities and countries loaded.
+
+    :param vehicle: the vehicle.
+    :return: the index.
+    """
+    cities = _indexed_cities()
+    engine = City.distance_engine
+    indices = np.array([city.index for city in cities], dtype=np.intp)
+    primary = np.array([city.city_type == 'primary' for city in cities], dtype=bool)
+    country_of_rows = np.array([city.country.index for city in cities], dtype=np.intp)
+    hubs = np.flatnonzero(primary)
+    hub_of_rows = np.full(len(cities), -1, dtype=np.intp)
+    hub_of_rows[hubs] = np.arange(len(hubs))
+    in_speed, between_speed = vehicle.in_country_speed, vehicle.between_primary_speed
+
+    label_hubs, label_hours = [np.empty(0, dtype=np.int32)] * len(cities), [np.empty(0)] * len(cities)
+    # the other cities of each country, as rows of the index, and their travel times to its hubs
+    country_trips = {}
+    for country_index in np.unique(country_of_rows).tolist():
+        rows = np.flatnonzero(country_of_rows == country_index)
+        country_hubs = rows[primary[rows]]
+        others = rows[~primary[rows]]
+        if len(country_hubs) == 0:
+            continue
+        # every city's labels: the in-country trips to the primary cities of its country
+        hours = np.ceil(engine.many_to_many(indices[others], indices[country_hubs]) / in_speed)
+        for row, row_hours in zip(others.tolist(), hours):
+            label_hubs[row], label_hours[row] = hub_of_rows[country_hubs].astype(np.int32), row_hours
+        for row in country_hubs.tolist():
+            label_hubs[row], label_hours[row] = np.array([hub_of_rows[row]], dtype=np.int32), np.zeros(1)
+        # the hubs of a country are in the order of their rows, as in fastest_hub_trips
+        country_trips[country_index] = (others, hours)
+
+    hub_hours, hub_next, hub_via = fastest_hub_trips(
+        engine.many_to_many(indices[hubs], indices[hubs]), country_of_rows[hubs], in_speed, between_speed,
+        lambda country_index, country_hubs: country_trips[country_index])
+
+    label_starts = np.zeros(len(cities) + 1, dtype=np.int64)
+    label_starts[1:] = np.cumsum([len(labels) for labels in label_hubs])
+    arrays = {'city_ids': City.table.city_id[indices].astype(np.int64),
+              'hubs': hubs.astype(np.int32),
+              'hub_hours': hub_hours,
+              'hub_next': hub_next.astype(np.int32),
+              'hub_via': hub_via.astype(np.int32),
+              'label_starts': label_starts,
+              'label_hubs': np.concatenate(label_hubs) if cities else np.empty(0, dtype=np.int32),
+              'label_hours': np.concatenate(label_hours) if cities else np.empty(0),
+              'fingerprint': np.array(_fingerprint(cities))}
+    return DinghyIndex(in_speed, between_speed, arrays)
+
+
+def use_dinghy_index(index: DinghyIndex) -> None:
+    """
+    Makes find_shortest_path answer the queries of vehicles with the speeds of an index from it.
+
+    :param index: the index.
+    :return: None
+    :raise ValueError: if the cities loaded are not the ones the index was built from.
+    """
+    from routing_cache import routing_graph_cache
+    vehicle = DiplomacyDonutDinghy(index.in_country_speed, index.between_primary_speed)
+    routing_graph_cache.get(vehicle).use_index(index)
+
+def verify_dinghy_index(index: DinghyIndex, samples: int = 200, seed: int = 0) -> int:
+    """
+    Compares the answers of an index with an A* search over the edges of the routing graph
+    on random pairs of cities, and checks that the itineraries it returns take the time it says.
+
+    :param index: the index.
+    :param samples: the number of pairs of cities to compare.
+    :param seed: the seed of the random pairs.
+    :return: the number of pairs whose answers differ.
+    """
+    from routing_graphs import DinghyGraph
+    vehicle = DiplomacyDonutDinghy(index.in_country_speed, index.between_primary_speed)
+    graph = DinghyGraph(vehicle)
+    rng = random.Random(seed)
+    # half of the pairs are in the same country, where itineraries are less obvious
+    pairs = []
+    for sample in range(samples):
+        from_city = rng.choice(index.cities)
+        to_city = rng.choice(from_city.country.cities if sample % 2 else index.cities)
+        pairs.append((from_city, to_city))
+
+    mismatches = 0
+    for from_city, to_city in pairs:
+        # shortest_path would use the backbone, which is built like the index
+        expected = graph.search_path(from_city, to_city)
+        expected_hours = sum(vehicle.compute_travel_time(*leg) for leg in zip(expected, expected[1:])) \
+                         if expected is not None else math.inf
+        path = index.shortest_path(from_city, to_city)
+        path_hours = sum(vehicle.compute_travel_time(*leg) for leg in zip(path, path[1:])) \
+                     if path is not None else math.inf
+        if not expected_hours == path_hours == index.travel_time(from_city, to_city):
+            mismatches += 1
+            print(f"Mismatch from {from_city} to {to_city}: search {expected_hours} h, index {path_hours} h")
+    return mismatches
+
+def main() -> None:
+    """
+    The command line interface: builds, inspects or verifies an index.
+    """
+    from csv_parsing import load_cities_countries
+    parser = argparse.ArgumentParser(description="Precomputed routing index of a DiplomacyDonutDinghy.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="build an index and save it")
+    build.add_argument("csv", help="the CSV file of cities")
+    build.add_argument("in_country_speed", type=int)
+    build.add_argument("between_primary_speed", type=int)
+    build.add_argument("index", help="the file to save the index to")
+    inspect = commands.add_parser("inspect", help="describe a saved index")
+    inspect.add_argument("csv", help="the CSV file of cities the index was built from")
+    inspect.add_argument("index")
+    verify = commands.add_parser("verify", help="compare a saved index with graph searches")
+    verify.add_argument("csv", help="the CSV file of cities the index was built from")
+    verify.add_argument("index")
+    verify.add_argument("--samples", type=int, default=200)
+    verify.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    print(load_cities_countries(arguments.csv))
+    if arguments.command == "build":
+        start = time.perf_counter()
+        index = build_dinghy_index(DiplomacyDonutDinghy(arguments.in_country_speed, arguments.between_primary_speed))
+        print(f"Built {index} in {time.perf_counter() - start:.2f} s")
+        index.save(arguments.index)
+        return
+
+    index = DinghyIndex.load(arguments.index)
+    print(index)
+    print(f"Up to date with {arguments.csv}: {index.is_current()}")
+    if arguments.command == "inspect":
+        label_counts = np.diff(index.label_starts)
+        print(f"Hubs per city: {label_counts.mean():.2f} on average, {label_counts.max(initial=0)} at most")
+        reachable = index.hub_hours[np.isfinite(index.hub_hours)]
+        print(f"Hours between hubs: {reachable.max(initial=0):g} at most")
+        return
+
+    if not index.is_current():
+        raise SystemExit("The index was not built from these cities.")
+    start = time.perf_counter()
+    for from_city, to_city in zip(index.cities, reversed(index.cities)):
+        index.travel_time(from_city, to_city)
+    print(f"{1e6 * (time.perf_counter() - start) / max(len(index), 1):.1f} µs per query")
+    mismatches = verify_dinghy_index(index, arguments.samples, arguments.seed)
+    print(f"{arguments.samples - mismatches} of {arguments.samples} queries match a graph search")
+    if mismatches:
+        raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+"""
+@file distances.py
+"""
+from __future__ import annotations
+from typing import Iterator, Sequence
+import math
+import numpy as np
+import instrumentation
+
+# Mean earth radius in kilometers, the same value used by geopy.distance.great_circle
+EARTH_RADIUS_KM = 6371.009
+
+def great_circle_km(latitude1: float, longitude1: float, latitude2: float, longitude2: float) -> float:
+    """
+    Returns the great circle distance in kilometers between two points given in degrees.
+    This is the same formula, evaluated in the same order, as geopy.distance.great_circle,
+    so the results are identical to the ones geopy gives.
+
+    :param latitude1: the latitude of the first point.
+    :param longitude1: the longitude of the first point.
+    :param latitude2: the latitude of the second point.
+    :param longitude2: the longitude of the second point.
+    :return: the distance in kilometers (not rounded).
+    """
+    lat1, lng1 = math.radians(latitude1), math.radians(longitude1)
+    lat2, lng2 = math.radians(latitude2), math.radians(longitude2)
+    return _great_circle_km(math.sin(lat1), math.cos(lat1), math.sin(lat2), math.cos(lat2), lng2 - lng1)
+
+def _great_circle_km(sin_lat1: float, cos_lat1: float, sin_lat2: float, cos_lat2: float, delta_lng: float) -> float:
+    """
+    Returns the same as great_circle_km, given the sines and cosines of the latitudes and the
+    difference of the longitudes in radians.
+    """
+    cos_delta_lng, sin_delta_lng = math.cos(delta_lng), math.sin(delta_lng)
+
+    angle = math.atan2(math.sqrt((cos_lat2 * sin_delta_lng) ** 2 +
+                                 (cos_lat1 * sin_lat2 - sin_lat1 * cos_lat2 * cos_delta_lng) ** 2),
+                       sin_lat1 * sin_lat2 + cos_lat1 * cos_lat2 * cos_delta_lng)
+    return EARTH_RADIUS_KM * angle
+
+
+class DistanceEngine():
+    """
+    Keeps the coordinates of every city in contiguous float64 arrays and answers
+    distance queries on them in batch.
+
+    Points are referred to by the index returned by add_point. All the query methods
+    return distances in kilometers rounded up to an integer, like City.distance.
+    """
+
+    # the arrays holding one value per point, with their type and initial value:
+    # the sine and cosine of the latitude, and the longitude in radians
+    columns = {"_sin_lat": (np.float64, 0.0), "_cos_lat": (np.float64, 1.0), "_lng": (np.float64, 0.0)}
+
+    def __init__(self, capacity: int = 1024) -> None:
+        """
+        Creates an empty engine.
+
+        :param capacity: the number of points to allocate room for up front.
+        :return: None
+        """
+        self._size = 0
+        for name, (dtype, fill) in self.columns.items():
+            setattr(self, name, np.full(capacity, fill, dtype=dtype))
+
+    def __len__(self) -> int:
+        """
+        Returns the number of points known to the engine.
+        """
+        return self._size
+
+    def _reserve(self, count: int) -> None:
+        """
+        Makes room for count more points.
+        """
+        if self._size + count > len(self._lng):
+            # at least double the capacity so that adding n points costs O(n) overall
+            capacity = max(2 * len(self._lng), self._size + count, 1)
+            for name, (dtype, fill) in self.columns.items():
+                grown = np.full(capacity, fill, dtype=dtype)
+                grown[:self._size] = getattr(self, name)[:self._size]
+                setattr(self, name, grown)
+
+    def add_point(self, coordinates: tuple[float, float]) -> int:
+        """
+        Adds a point to the engine and returns its index.
+
+        :param coordinates: the coordinates of the point (latitude, longitude) in degrees.
+        :return: the index of the point.
+        """
+        self._reserve(1)
+        index = self._size
+        self._size += 1
+        self.set_point(index, coordinates)
+        return index
+
+    def add_points(self, latitudes: Sequence[float] | np.ndarray, longitudes: Sequence[float] | np.ndarray) -> int:
+        """
+        Adds many points to the engine at once. Their indices are consecutive.
+
+        :param latitudes: the latitudes of the points in degrees.
+        :param longitudes: the longitudes of the points in degrees, as many as latitudes.
+        :return: the index of the first point.
+        """
+        count = len(latitudes)
+        self._reserve(count)
+        start = self._size
+        self._size += count
+        self.set_points(start, latitudes, longitudes)
+        return start
+
+    def set_point(self, index: int, coordinates: tuple[float, float]) -> None:
+        """
+        Changes the coordinates of a point already known to the engine.
+
+        :param index: the index of the point.
+        :param coordinates: the new coordinates (latitude, longitude) in degrees.
+        :return: None
+        """
+        latitude = math.radians(coordinates[0])
+        self._sin_lat[index] = math.sin(latitude)
+        self._cos_lat[index] = math.cos(latitude)
+        self._lng[index] = math.radians(coordinates[1])
+
+    def set_points(self, start: int, latitudes: Sequence[float] | np.ndarray,
+                   longitudes: Sequence[float] | np.ndarray) -> None:
+        """
+        Changes the coordinates of consecutive points already known to the engine.
+
+        :param start: the index of the first point.
+        :param latitudes: the new latitudes of the points in degrees.
+        :param longitudes: the new longitudes of the points in degrees, as many as latitudes.
+        :return: None
+        """
+        count = len(latitudes)
+        # math rather than NumPy, so that the values are exactly the ones set_point gives
+        latitudes = [math.radians(latitude) for latitude in np.asarray(latitudes, dtype=np.float64).tolist()]
+        self._sin_lat[start:start + count] = np.fromiter(map(math.sin, latitudes), dtype=np.float64, count=count)
+        self._cos_lat[start:start + count] = np.fromiter(map(math.cos, latitudes), dtype=np.float64, count=count)
+        self._lng[start:start + count] = np.fromiter(map(math.radians, np.asarray(longitudes, dtype=np.float64).tolist()),
+                                                     dtype=np.float64, count=count)
+
+    def _kilometers(self, first: np.ndarray, second: np.ndarray) -> np.ndarray:
+        """
+        Returns the exact (not rounded) distances between the points first[k] and second[k].
+        The two index arrays are broadcast against each other.
+        """
+        if instrumentation.active is not None:
+            instrumentation.active.count("batched_distances", np.broadcast(first, second).size)
+        sin_lat1, cos_lat1 = self._sin_lat[first], self._cos_lat[first]
+        sin_lat2, cos_lat2 = self._sin_lat[second], self._cos_lat[second]
+        delta_lng = self._lng[second] - self._lng[first]
+        cos_delta_lng, sin_delta_lng = np.cos(delta_lng), np.sin(delta_lng)
+
+        angle = np.arctan2(np.sqrt((cos_lat2 * sin_delta_lng) ** 2 +
+                                   (cos_lat1 * sin_lat2 - sin_lat1 * cos_lat2 * cos_delta_lng) ** 2),
+                           sin_lat1 * sin_lat2 + cos_lat1 * cos_lat2 * cos_delta_lng)
+        return EARTH_RADIUS_KM * angle
+
+    def kilometers(self, first: Sequence[int] | np.ndarray, second: Sequence[int] | np.ndarray) -> np.ndarray:
+        """
+        Returns the exact (not rounded) distances in kilometers between the points
+        first[k] and second[k]. Useful for heuristics and bounds that must not be rounded.
+
+        :param first: the indices of the departure points.
+        :param second: the indices of the arrival points, broadcast against first.
+        :return: an array of float distances.
+        """
+        return self._kilometers(np.asarray(first, dtype=np.intp), np.asarray(second, dtype=np.intp))
+
+    def pairwise(self, first: Sequence[int] | np.ndarray, second: Sequence[int] | np.ndarray) -> np.ndarray:
+        """
+        Returns the distances between the points first[k] and second[k], for every k.
+
+        :param first: the indices of the departure points.
+        :param second: the indices of the arrival points, as many as in first.
+        :return: an array of distances in kilometers rounded up to an integer.
+        """
+        first, second = np.asarray(first, dtype=np.intp), np.asarray(second, dtype=np.intp)
+        kilometers = self._kilometers(first, second)
+        distances = np.ceil(kilometers)
+        # NumPy's sin, cos and arctan2 may differ from the math module's in the last bit, which
+        # changes the rounding of distances within that error of an integer: these few are
+        # computed again with the math module, so that they are exactly the ones of City.distance
+        near = np.abs(kilometers - np.rint(kilometers)) < 1e-9
+        if near.any():
+            first, second = np.broadcast_arrays(first, second)
+            distances[near] = [math.ceil(self._point_kilometers(point1, point2))
+                               for point1, point2 in zip(first[near].tolist(), second[near].tolist())]
+        return distances.astype(np.int64)
+
+    def _point_kilometers(self, first: int, second: int) -> float:
+        """
+        Returns the exact distance between two points as great_circle_km computes it.
+        """
+        return _great_circle_km(float(self._sin_lat[first]), float(self._cos_lat[first]), float(self._sin_lat[second]),
+                                float(self._cos_lat[second]), float(self._lng[second]) - float(self._lng[first]))
+
+    def one_to_many(self, index: int, others: Sequence[int] | np.ndarray) -> np.ndarray:
+        """
+        Returns the distances between one point and many others.
+
+        :param index: the index of the departure point.
+        :param others: the indices of the arrival points.
+        :return: an array of distances in kilometers rounded up to an integer, one per arrival point.
+        """
+        return self.pairwise(np.intp(index), others)
+
+    def many_to_many(self, rows: Sequence[int] | np.ndarray, columns: Sequence[int] | np.ndarray) -> np.ndarray:
+        """
+        Returns the matrix of distances between every point of rows and every point of columns.
+
+        :param rows: the indices of the departure points.
+        :param columns: the indices of the arrival points.
+        :return: a len(rows) x len(columns) array of distances in kilometers rounded up to an integer.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        columns = np.asarray(columns, dtype=np.intp)
+        return self.pairwise(rows[:, np.newaxis], columns[np.newaxis, :])
+
+    def pairwise_chunked(self, indices: Sequence[int] | np.ndarray,
+                         chunk_size: int = 1 << 20) -> Iterator[tuple[np.ndarray, np.ndarray, np.ndarray]]:
+        """
+        Yields the distances between every unordered pair of distinct points of indices,
+        a bounded number of pairs at a time so that memory does not grow with N^2.
+
+        Each chunk is a tuple (first, second, distances) of equally long arrays, where
+        first and second hold point indices (taken from indices) and distances holds
+        the distances in kilometers rounded up to an integer.
+
+        :param indices: the indices of the points.
+        :param chunk_size: the approximate number of pairs per chunk.
+        :return: an iterator over the chunks.
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        count = len(indices)
+        start = 0
+        while start < count - 1:
+            # take as many rows of the upper triangle as fit in one chunk (at least one)
+            stop = start + 1
+            pairs = count - stop
+            while stop < count - 1 and pairs + (count - stop - 1) <= chunk_size:
+                pairs += count - stop - 1
+                stop += 1
+            rows = np.arange(start, stop)
+            lengths = count - 1 - rows
+            first = np.repeat(rows, lengths)
+            # for each row r, the columns r+1 .. count-1
+            offsets = np.cumsum(lengths) - lengths
+            second = np.arange(len(first)) - np.repeat(offsets, lengths) + first + 1
+            yield indices[first], indices[second], self.pairwise(indices[first], indices[second])
+            start = stop
+
+    def unit_vectors(self, indices: Sequence[int] | np.ndarray) -> np.ndarray:
+        """
+        Returns the positions of points on the unit sphere, as an array of (x, y, z) rows.
+        Straight-line distances between these vectors grow with great circle distances,
+        which is what spatial indexes rely on.
+
+        :param indices: the indices of the points.
+        :return: a len(indices) x 3 array.
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        cos_lat, lng = self._cos_lat[indices], self._lng[indices]
+        return np.column_stack((cos_lat * np.cos(lng), cos_lat * np.sin(lng), self._sin_lat[indices]))
+
+
+def chord_length(kilometers: float) -> float:
+    """
+    Returns the straight-line distance between two points of the unit sphere
+    that are the given great circle distance apart on the earth.
+
+    :param kilometers: a great circle distance in kilometers.
+    :return: the corresponding chord length on the unit sphere, between 0 and 2.
+    """
+    angle = kilometers / EARTH_RADIUS_KM
+    return 2.0 if angle >= math.pi else 2 * math.sin(angle / 2)
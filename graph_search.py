@@ -0,0 +1,129 @@
+"""
+@file graph_search.py
+"""
+from __future__ import annotations
+from typing import Callable, Iterable
+import heapq
+import math
+import numpy as np
+import instrumentation
+
+# Returns the neighbours of a node and the cost of the edge to each of them
+Expander = Callable[[int], "tuple[np.ndarray, np.ndarray]"]
+# Returns a lower bound of the cost from each of the given nodes to the target
+Heuristic = Callable[[np.ndarray], np.ndarray]
+
+def a_star_search(source: int, target: int, node_count: int, expand: Expander,
+                  heuristic: Heuristic | None = None) -> tuple[list[int], float] | None:
+    """
+    Returns a cheapest path between two nodes of a graph whose edges are only known
+    through expand, which is called on a node the first time the search needs its neighbours.
+
+    Nodes are integers between 0 and node_count - 1. The heuristic must never overestimate
+    the cost to the target (it is admissible); without one the search is Dijkstra's algorithm.
+    Nodes are expanded again if a cheaper way to them is found later, so the result is
+    a cheapest path even if the heuristic is not consistent.
+
+    :param source: the node to start from.
+    :param target: the node to reach.
+    :param node_count: the number of nodes of the graph.
+    :param expand: a function that returns the neighbours of a node and the cost to each of them.
+    :param heuristic: a function that returns a lower bound of the cost to the target from each of some nodes.
+    :return: a tuple (path, cost) with the nodes of a cheapest path from source to target,
+             or None if the target cannot be reached.
+    """
+    best_costs = np.full(node_count, math.inf)
+    parents = np.full(node_count, -1, dtype=np.intp)
+    best_costs[source] = 0.0
+    start_bound = float(heuristic(np.array([source], dtype=np.intp))[0]) if heuristic is not None else 0.0
+    # entries are (lower bound of the total cost, cost so far, node)
+    heap = [(start_bound, 0.0, source)]
+    # counted here and recorded once at the end, so that instrumentation costs nothing per node
+    expanded = 0
+
+    try:
+        while heap:
+            _, cost, node = heapq.heappop(heap)
+            if cost > best_costs[node]:
+                # a cheaper way to this node was found after this entry was pushed
+                continue
+            if node == target:
+                return path_to(parents, source, target), cost
+
+            expanded += 1
+            neighbours, edge_costs = expand(node)
+            new_costs = cost + edge_costs
+            better = new_costs < best_costs[neighbours]
+            if not better.any():
+                continue
+            neighbours, new_costs = neighbours[better], new_costs[better]
+            best_costs[neighbours] = new_costs
+            parents[neighbours] = node
+            bounds = new_costs + heuristic(neighbours) if heuristic is not None else new_costs
+            for bound, new_cost, neighbour in zip(bounds.tolist(), new_costs.tolist(), neighbours.tolist()):
+                heapq.heappush(heap, (bound, new_cost, neighbour))
+        return None
+    finally:
+        instrumentation.count("nodes_expanded", expanded)
+
+
+def dijkstra_search(source: int, targets: Iterable[int], node_count: int,
+                    expand: Expander) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Computes the cheapest paths from one node to many others with Dijkstra's algorithm,
+    stopping as soon as the cheapest paths to all the targets are known.
+    The edges of the graph are only known through expand, as in a_star_search.
+
+    :param source: the node to start from.
+    :param targets: the nodes to reach.
+    :param node_count: the number of nodes of the graph.
+    :param expand: a function that returns the neighbours of a node and the cost to each of them.
+    :return: a tuple (costs, parents) of two arrays indexed by node: the cost of the cheapest path
+             to each target (math.inf if it cannot be reached), and the parents to give path_to.
+    """
+    best_costs = np.full(node_count, math.inf)
+    parents = np.full(node_count, -1, dtype=np.intp)
+    best_costs[source] = 0.0
+    remaining = set(targets)
+    heap = [(0.0, source)]
+    expanded = 0
+
+    while heap and remaining:
+        cost, node = heapq.heappop(heap)
+        if cost > best_costs[node]:
+            continue
+        remaining.discard(node)
+        if not remaining:
+            break
+
+        expanded += 1
+        neighbours, edge_costs = expand(node)
+        new_costs = cost + edge_costs
+        better = new_costs < best_costs[neighbours]
+        if not better.any():
+            continue
+        neighbours, new_costs = neighbours[better], new_costs[better]
+        best_costs[neighbours] = new_costs
+        parents[neighbours] = node
+        for new_cost, neighbour in zip(new_costs.tolist(), neighbours.tolist()):
+            heapq.heappush(heap, (new_cost, neighbour))
+    instrumentation.count("nodes_expanded", expanded)
+    return best_costs, parents
+
+
+def path_to(parents: np.ndarray, source: int, target: int) -> list[int]:
+    """
+    Returns the nodes of the path from source to target recorded in an array of parents,
+    where parents[node] is the node before node on the path.
+
+    :param parents: the parents of the nodes.
+    :param source: the first node of the path.
+    :param target: the last node of the path.
+    :return: the nodes of the path, from source to target.
+    """
+    path = [target]
+    node = target
+    while node != source:
+        node = int(parents[node])
+        path.append(node)
+    return path[::-1]
@@ -0,0 +1,269 @@
+"""
+@file instrumentation.py
+"""
+from __future__ import annotations
+from contextlib import contextmanager, nullcontext
+import cProfile
+import json
+import os
+import pstats
+import sys
+import time
+from typing import Any, Callable, ContextManager, Iterator
+
+class Instrumentation():
+    """
+    Counters and timings of what the routing pipeline does: distances and travel times computed,
+    edges built, nodes expanded, cache hits, and the time spent in each phase of a query
+    (loading, graph construction, edge weighting, search, itinerary formatting...).
+
+    Instrumented code only records anything while an instance is active, see instrumented.
+    Phases can be nested, and the time of a phase includes the time of the phases inside it.
+    """
+
+    def __init__(self, label: str = "") -> None:
+        """
+        Creates an instrumentation with nothing recorded.
+
+        :param label: a name for what is measured, copied into the records.
+        :return: None
+        """
+        self.label = label
+        # associates the name of a counter to its value
+        self.counters = {}
+        # associates the name of a phase to [number of times it ran, total seconds, longest seconds]
+        self.timings = {}
+
+    def count(self, name: str, amount: int = 1) -> None:
+        """
+        Adds to a counter.
+
+        :param name: the name of the counter, e.g. "distance_calls".
+        :param amount: what to add.
+        :return: None
+        """
+        self.counters[name] = self.counters.get(name, 0) + amount
+
+    def add_time(self, name: str, seconds: float) -> None:
+        """
+        Records that a phase ran for some time.
+
+        :param name: the name of the phase, e.g. "search".
+        :param seconds: how long it ran.
+        :return: None
+        """
+        timing = self.timings.get(name)
+        if timing is None:
+            self.timings[name] = [1, seconds, seconds]
+        else:
+            timing[0] += 1
+            timing[1] += seconds
+            timing[2] = max(timing[2], seconds)
+
+    def records(self) -> list[dict]:
+        """
+        Returns what was recorded as a list of flat dicts, ready to be written as JSON or to a table:
+        {"label", "kind": "counter", "name", "value"} for each counter, and
+        {"label", "kind": "phase", "name", "calls", "seconds", "max_seconds"} for each phase.
+
+        :return: the records, counters first, each kind sorted by name.
+        """
+        records = [{"label": self.label, "kind": "counter", "name": name, "value": value}
+                   for name, value in sorted(self.counters.items())]
+        records += [{"label": self.label, "kind": "phase", "name": name, "calls": calls, "seconds": seconds,
+                     "max_seconds": longest} for name, (calls, seconds, longest) in sorted(self.timings.items())]
+        return records
+
+    def write_records(self, path: str) -> None:
+        """
+        Appends the records to a file, one JSON object per line, so that the records of many
+        queries can be collected in one file.
+
+        :param path: the path of the file.
+        :return: None
+        """
+        with open(path, "a") as records_file:
+            for record in self.records():
+                records_file.write(json.dumps(record) + "\n")
+
+    def __str__(self) -> str:
+        """
+        Returns the counters and the timings, one per line, for example
+        "search: 3 calls, 12.345 ms (longest 8.000 ms)"
+        """
+        lines = [f"{name}: {value}" for name, value in sorted(self.counters.items())]
+        lines += [f"{name}: {calls} calls, {seconds * 1000:.3f} ms (longest {longest * 1000:.3f} ms)"
+                  for name, (calls, seconds, longest) in sorted(self.timings.items())]
+        return "\n".join(lines)
+
+
+# the instrumentation recording what the pipeline does, or None when instrumentation is disabled.
+# Instrumented code checks it before doing anything else, so that disabled instrumentation
+# costs one attribute lookup and comparison.
+active = None
+
+class _Phase():
+    """
+    Times a phase into an instrumentation, as a context manager.
+    """
+    __slots__ = ("instrumentation", "name", "start")
+
+    def __init__(self, instrumentation: Instrumentation, name: str) -> None:
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self) -> None:
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exception) -> None:
+        self.instrumentation.add_time(self.name, time.perf_counter() - self.start)
+
+# what phase returns when instrumentation is disabled
+_NO_PHASE = nullcontext()
+
+def phase(name: str) -> ContextManager:
+    """
+    Returns a context manager timing a phase when instrumentation is enabled, and doing nothing otherwise.
+    For example: with phase("search"): ...
+
+    :param name: the name of the phase.
+    :return: the context manager.
+    """
+    return _Phase(active, name) if active is not None else _NO_PHASE
+
+def count(name: str, amount: int = 1) -> None:
+    """
+    Adds to a counter when instrumentation is enabled. In hot loops, check active directly
+    rather than calling this, to save the call when it is disabled.
+
+    :param name: the name of the counter.
+    :param amount: what to add.
+    :return: None
+    """
+    if active is not None:
+        active.count(name, amount)
+
+@contextmanager
+def instrumented(label: str = "") -> Iterator[Instrumentation]:
+    """
+    Enables instrumentation for the duration of a with block, recording into a new Instrumentation.
+    For example:
+        with instrumented("Melbourne to Sydney") as recorded:
+            find_shortest_path(vehicle, melbourne, sydney)
+        print(recorded)
+
+    :param label: a name for what is measured, copied into the records.
+    :return: the instrumentation, filled in as the block runs.
+    """
+    global active
+    previous = active
+    active = Instrumentation(label)
+    try:
+        yield active
+    finally:
+        active = previous
+
+def profile_call(function: Callable[..., Any], *args, output_path: str | None = None, **kwargs) -> tuple[Any, pstats.Stats]:
+    """
+    Calls a function under cProfile, for example to see where one slow query spends its time.
+    The profile written can be explored with pstats, snakeviz, or turned into a flame graph by flameprof.
+
+    :param function: the function.
+    :param args: the positional arguments of the function.
+    :param output_path: the file to write the profile to, usually ending in .prof, or None.
+    :param kwargs: the keyword arguments of the function.
+    :return: the result of the function and the statistics of the profile.
+    """
+    profiler = cProfile.Profile()
+    result = profiler.runcall(function, *args, **kwargs)
+    if output_path is not None:
+        profiler.dump_stats(output_path)
+    return result, pstats.Stats(profiler)
+
+
+class FoldedStackProfiler():
+    """
+    Records the time spent in each distinct stack of calls, in the "folded" format read by
+    flamegraph.pl and speedscope: one line per stack, the functions from the outermost
+    separated by semicolons, then the microseconds spent in the innermost one.
+
+    Every call is traced, which slows Python down a lot, so this is meant for one query at a time.
+    """
+
+    def __init__(self) -> None:
+        # associates each stack, as a folded string, to the seconds spent in its innermost function
+        self.stacks = {}
+        # the calls in progress: [folded stack, start time, seconds spent in the calls it made]
+        self._calls = []
+
+    def _trace(self, frame, event: str, argument) -> None:
+        """
+        Called by the interpreter on every call and return, see sys.setprofile.
+        """
+        now = time.perf_counter()
+        if event == "call" or event == "c_call":
+            if event == "call":
+                code = frame.f_code
+                name = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            else:
+                name = f"{getattr(argument, '__qualname__', repr(argument))} (built-in)"
+            parent = self._calls[-1][0] + ";" if self._calls else ""
+            self._calls.append([parent + name, now, 0.0])
+        elif self._calls:
+            # a return from a call, or from a call made before tracing started, which is ignored
+            stack, start, in_calls = self._calls.pop()
+            elapsed = now - start
+            self.stacks[stack] = self.stacks.get(stack, 0.0) + elapsed - in_calls
+            if self._calls:
+                self._calls[-1][2] += elapsed
+
+    def run(self, function: Callable[..., Any], *args, **kwargs) -> Any:
+        """
+        Calls a function, recording its calls.
+
+        :return: the result of the function.
+        """
+        sys.setprofile(self._trace)
+        try:
+            return function(*args, **kwargs)
+        finally:
+            sys.setprofile(None)
+            self._calls.clear()
+
+    def write(self, path: str) -> None:
+        """
+        Writes the stacks in the folded format.
+
+        :param path: the path of the file, for example "query.folded".
+        :return: None
+        """
+        with open(path, "w") as folded_file:
+            for stack, seconds in sorted(self.stacks.items()):
+                microseconds = round(seconds * 1e6)
+                if microseconds > 0:
+                    folded_file.write(f"{stack} {microseconds}\n")
+
+if __name__ == "__main__":
+    # the instrumented modules read the instrumentation module, not this script
+    from instrumentation import instrumented, profile_call, FoldedStackProfiler
+    from city import City
+    from country import create_example_countries
+    from path_finding import find_shortest_path
+    from vehicles import create_example_vehicles
+    create_example_countries()
+    melbourne, kuala_lumpur = City.id_to_cities[1036533631], City.id_to_cities[1458988644]
+
+    for vehicle in create_example_vehicles():
+        with instrumented(str(vehicle)) as recorded:
+            print(find_shortest_path(vehicle, melbourne, kuala_lumpur))
+        print(f"{recorded}\n")
+
+    # the profile of one query, with the ten functions taking the most time
+    vehicle = create_example_vehicles()[1]
+    _, statistics = profile_call(find_shortest_path, vehicle, kuala_lumpur, melbourne)
+    statistics.sort_stats("cumulative").print_stats(10)
+    # and as stacks for a flame graph
+    profiler = FoldedStackProfiler()
+    profiler.run(find_shortest_path, vehicle, kuala_lumpur, melbourne)
+    profiler.write("query.folded")
+    print(f"{len(profiler.stacks)} stacks written to query.folded")
@@ -1,12 +1,32 @@
 """
 @file itinerary.py
 """
+from __future__ import annotations
+from typing import TYPE_CHECKING
+import itertools
+import math
+import numpy as np
 from city import City, create_example_cities, get_cities_by_name
+from route_optimization import TourOptimizer, nearest_neighbours
+import instrumentation
+
+if TYPE_CHECKING:
+    from vehicles import Vehicle
 
 class Itinerary():
     """
     A sequence of cities.
+
+    The distance of each leg, and the travel time of each leg for the vehicles asked about,
+    are kept along with their totals, and updated with O(1) distance computations when a city
+    is appended or inserted. So reading totals is O(1). The cities can only be changed with
+    the methods of the itinerary or by assigning a new sequence to cities: cities is a tuple,
+    and the itinerary keeps its own copy of the sequences it is given.
     """
+
+    # the largest itineraries optimize reorders by trying every order of their cities
+    BRUTE_FORCE_SIZE = 7
+
     def __init__(self, cities: list[City]) -> None:
         """
         Creates an itinerary with the provided sequence of cities,
@@ -17,18 +37,128 @@ class Itinerary():
         # Associate self.cities to the list of cities
         self.cities = cities
 
+    @property
+    def cities(self) -> tuple[City, ...]:
+        """
+        The sequence of cities to visit, which cannot be edited in place.
+        """
+        if self._cities_view is None:
+            self._cities_view = tuple(self._cities)
+        return self._cities_view
+
+    @cities.setter
+    def cities(self, cities: list[City]) -> None:
+        self._cities = list(cities)
+        self._cities_view = None
+        # the legs are computed when first needed
+        self._legs = None
+
+    def _check_legs(self) -> None:
+        """
+        Computes the distances of all legs in one batch if they are not known or may be stale,
+        and forgets the travel times computed from them.
+        """
+        if (self._legs is None or len(self._legs) != max(len(self._cities) - 1, 0)
+                or self._legs_version != City.registry_version):
+            instrumentation.count("itinerary_legs_computed", max(len(self._cities) - 1, 0))
+            indices = [city.index for city in self._cities]
+            self._legs = City.distance_engine.pairwise(indices[:-1], indices[1:]).tolist() if len(indices) > 1 else []
+            self._total = sum(self._legs)
+            self._legs_version = City.registry_version
+            # associates the cache key of a vehicle to the vehicle, the travel time of each leg,
+            # the sum of the finite ones and the number of impossible ones
+            self._times = {}
+
+    def leg_distances(self) -> list[int]:
+        """
+        Returns the distance (in km) of each leg of the itinerary, that is
+        between each city and the next one.
+        :return: the list of distances, one fewer than there are cities.
+        """
+        self._check_legs()
+        return list(self._legs)
+
     def total_distance(self) -> int:
         """
         Returns the total distance (in km) of the itinerary, which is
         the sum of the distances between successive cities.
         :return: the total distance.
         """
-        # Loop through the self.cities list
-        # Add the distance between successive cities using distance method 
-        total_distance = 0
-        for index, city in enumerate(self.cities[:-1]):
-            total_distance += City.distance(city, self.cities[index+1])
-        return total_distance
+        self._check_legs()
+        return self._total
+
+    def leg_travel_times(self, vehicle: Vehicle) -> list[float]:
+        """
+        Returns the travel time (in hours) of each leg of the itinerary with a vehicle.
+        :param vehicle: the vehicle.
+        :return: the list of travel times, math.inf for the legs the vehicle cannot travel.
+        """
+        return list(self._leg_times(vehicle)[1])
+
+    def total_travel_time(self, vehicle: Vehicle) -> float:
+        """
+        Returns the travel time (in hours) of the entire itinerary with a vehicle.
+        :param vehicle: the vehicle.
+        :return: the sum of the travel times of the legs, or math.inf if any leg is not possible.
+        """
+        _, _, total, impossible = self._leg_times(vehicle)
+        return math.inf if impossible else total
+
+    def _leg_times(self, vehicle: Vehicle) -> list:
+        """
+        Returns the entry of self._times of a vehicle, computing it if needed.
+        """
+        self._check_legs()
+        key = vehicle.cache_key()
+        if key not in self._times:
+            times = [vehicle.travel_time_from_distance(self._cities[index], self._cities[index + 1], distance)
+                     for index, distance in enumerate(self._legs)]
+            self._times[key] = [vehicle, times, sum(time for time in times if time != math.inf),
+                                times.count(math.inf)]
+        return self._times[key]
+
+    def _insert(self, position: int, city: City) -> None:
+        """
+        Inserts a city at an index of the itinerary, or at the end if the index is the length,
+        and updates the legs and travel times with the distances to its neighbours.
+        """
+        self._check_legs()
+        cities = self._cities
+        previous = cities[position - 1] if position > 0 else None
+        following = cities[position] if position < len(cities) else None
+        cities.insert(position, city)
+        self._cities_view = None
+
+        # the leg from previous to following, if any, is replaced by the ones to and from city
+        removed = position - 1 if previous is not None and following is not None else None
+        added = [(previous, city, previous.distance(city))] if previous is not None else []
+        if following is not None:
+            added.append((city, following, city.distance(following)))
+        first_leg = max(position - 1, 0)
+
+        if removed is not None:
+            self._total -= self._legs[removed]
+        self._legs[first_leg:first_leg + (removed is not None)] = [distance for _, _, distance in added]
+        self._total += sum(distance for _, _, distance in added)
+        for entry in self._times.values():
+            vehicle, times = entry[0], entry[1]
+            if removed is not None:
+                self._add_time(entry, times[removed], -1)
+            new_times = [vehicle.travel_time_from_distance(*leg) for leg in added]
+            times[first_leg:first_leg + (removed is not None)] = new_times
+            for time in new_times:
+                self._add_time(entry, time, 1)
+
+    @staticmethod
+    def _add_time(entry: list, time: float, sign: int) -> None:
+        """
+        Adds the travel time of a leg to the totals of an entry of self._times,
+        or takes it out if sign is -1.
+        """
+        if time == math.inf:
+            entry[3] += sign
+        else:
+            entry[2] += sign * time
 
     def append_city(self, city: City) -> None:
         """
@@ -36,7 +166,24 @@ class Itinerary():
         :param city: the city to append
         :return: None.
         """
-        self.cities.append(city)
+        self._insert(len(self._cities), city)
+
+    def insertion_costs(self, city: City) -> np.ndarray:
+        """
+        Returns by how much inserting a city at each index of the itinerary would
+        increase its total distance: d(a, city) + d(city, b) - d(a, b) when inserting
+        between a and b, or d(city, first city) when inserting at the start.
+        :param city: the city to insert
+        :return: an array of distances in km, one per index where the city can be inserted.
+        """
+        engine = City.distance_engine
+        indices = np.array([other.index for other in self.cities], dtype=np.intp)
+        # the distances are taken in the direction of travel, as total_distance would
+        to_city = engine.pairwise(indices[:-1], np.intp(city.index))
+        from_city = engine.one_to_many(city.index, indices)
+        costs = from_city.copy()
+        costs[1:] += to_city - np.asarray(self.leg_distances(), dtype=np.int64)
+        return costs
 
     def min_distance_insert_city(self, city: City) -> None:
         """
@@ -45,26 +192,245 @@ class Itinerary():
         :param city: the city to insert
         :return: None.
         """
-        # Creating a list for the possible total distances
-        min_distance = []
-
-        # Loop through the list
-        for index, _ in enumerate(self.cities):
-            # Create a shallow copy of the list
-            test_list = self.cities[:]
-            # Insert the city in each index
-            test_list.insert(index, city)
-
-            # Create an instance for the new list, calculate its distance
-            itinerary = Itinerary(test_list)
-            new_distance = itinerary.total_distance()
-            # Append the new distance to the list of distances
-            min_distance.append(new_distance)
-        
-        # Find the index of the minimum index and insert the city in that index
-        min_index = min_distance.index(min(min_distance))
-        self.cities.insert(min_index, city)
-            
+        if not self.cities:
+            raise ValueError("Cannot insert a city in an empty itinerary")
+        # The city is inserted before one of the cities of the itinerary, never after the last one,
+        # at the first index where the increase of the total distance is the smallest
+        with instrumentation.phase("itinerary_insertion"):
+            min_index = int(np.argmin(self.insertion_costs(city)))
+            self._insert(min_index, city)
+
+    def insert_cities(self, cities: list[City], strategy: str = "cheapest") -> None:
+        """
+        Inserts many cities in the itinerary, choosing which city to insert next with a strategy:
+            - "cheapest": the city whose insertion increases the total distance the least.
+            - "farthest": the city farthest from the cities already in the itinerary.
+            - "in order": the cities in the order given.
+        Each city is then inserted where it increases the total distance the least, as
+        min_distance_insert_city does, so the last city of the itinerary stays the last.
+        If the itinerary is empty, the first of the cities is added first.
+        :param cities: the cities to insert
+        :param strategy: "cheapest", "farthest" or "in order"
+        :return: None.
+        """
+        if strategy not in ("cheapest", "farthest", "in order"):
+            raise ValueError(f"Unknown insertion strategy: {strategy}")
+        cities = list(cities)
+        if not cities:
+            return
+        if not self.cities:
+            self.append_city(cities.pop(0))
+        if strategy == "in order":
+            for city in cities:
+                self.min_distance_insert_city(city)
+            return
+
+        engine = City.distance_engine
+        remaining = np.array([city.index for city in cities], dtype=np.intp)
+        # while the cities are inserted, the itinerary is a linked list of nodes, so that a city is
+        # inserted before a node without looking for its position: each node has its city, the node
+        # before it (-1 for the first) and the distance of the leg from that node (0 for the first)
+        count = len(self.cities)
+        node_objects = list(self.cities) + [None] * len(cities)
+        node_cities = np.empty(len(node_objects), dtype=np.intp)
+        node_cities[:count] = [city.index for city in self.cities]
+        previous_nodes = np.full(len(node_objects), -1, dtype=np.intp)
+        previous_nodes[1:count] = np.arange(count - 1)
+        leg_distances = np.zeros(len(node_objects), dtype=np.int64)
+        leg_distances[1:count] = self.leg_distances()
+        # for each remaining city: the smallest increase of the total distance it can make, the node
+        # it must be inserted before to make it, and its distance to the closest city of the itinerary
+        costs, slots = self._cheapest_slots(remaining, node_cities[:count], previous_nodes[:count], leg_distances[:count])
+        closest = np.min(engine.many_to_many(remaining, node_cities[:count]), axis=1)
+        pending = np.ones(len(cities), dtype=bool)
+
+        for _ in range(len(cities)):
+            if strategy == "cheapest":
+                chosen = int(np.argmin(np.where(pending, costs, np.iinfo(np.int64).max)))
+            else:
+                chosen = int(np.argmax(np.where(pending, closest, -1)))
+            pending[chosen] = False
+            city = cities[chosen]
+            following = int(slots[chosen])
+            previous = int(previous_nodes[following])
+            node = count
+            count += 1
+            node_objects[node], node_cities[node] = city, city.index
+            following_city = City.index_to_cities[node_cities[following]]
+            previous_nodes[node], previous_nodes[following] = previous, node
+            leg_distances[following] = city.distance(following_city)
+            if previous >= 0:
+                leg_distances[node] = City.index_to_cities[node_cities[previous]].distance(city)
+
+            # the slot before the following node was split in two: the cities whose best slot it
+            # was search again, the others compare their best slot with the two new ones
+            closest = np.minimum(closest, engine.pairwise(remaining, np.intp(city.index)))
+            before_following = (engine.pairwise(np.intp(city.index), remaining) + engine.pairwise(remaining, np.intp(following_city.index))
+                                - leg_distances[following])
+            before_city = engine.pairwise(remaining, np.intp(city.index))
+            if previous >= 0:
+                before_city += engine.pairwise(np.intp(node_cities[previous]), remaining) - leg_distances[node]
+
+            split = pending & (slots == following)
+            if split.any():
+                costs[split], slots[split] = self._cheapest_slots(remaining[split], node_cities[:count], previous_nodes[:count],
+                                                                  leg_distances[:count])
+            for slot_costs, slot in ((before_city, node), (before_following, following)):
+                better = pending & ~split & (slot_costs < costs)
+                costs[better], slots[better] = slot_costs[better], slot
+
+        # the cities in the order of the linked list, from the node no other node follows
+        next_nodes = np.full(count, -1, dtype=np.intp)
+        linked = previous_nodes[:count] >= 0
+        next_nodes[previous_nodes[:count][linked]] = np.flatnonzero(linked)
+        order = [int(np.flatnonzero(~linked)[0])]
+        for _ in range(count - 1):
+            order.append(int(next_nodes[order[-1]]))
+        self._cities[:] = [node_objects[node] for node in order]
+        self._cities_view = None
+        # the legs and their travel times are computed again in one batch when needed
+        self._legs = None
+
+    def _cheapest_slots(self, indices: np.ndarray, node_cities: np.ndarray, previous_nodes: np.ndarray,
+                        leg_distances: np.ndarray, chunk_size: int = 1 << 20) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns, for each of some cities, the smallest increase of the total distance inserting
+        it can make and the node of the itinerary it must be inserted before, the itinerary being
+        the linked list of nodes of insert_cities. The insertion costs are computed as in
+        insertion_costs, at most chunk_size at a time.
+        """
+        engine = City.distance_engine
+        has_previous = previous_nodes >= 0
+        # the first node has no leg to it: its own city stands in for the one before it, and the leg is ignored
+        previous_cities = np.where(has_previous, node_cities[np.maximum(previous_nodes, 0)], node_cities)
+        costs = np.empty(len(indices), dtype=np.int64)
+        slots = np.empty(len(indices), dtype=np.intp)
+        rows = max(chunk_size // len(node_cities), 1)
+        for start in range(0, len(indices), rows):
+            chunk = indices[start:start + rows, np.newaxis]
+            chunk_costs = engine.pairwise(chunk, node_cities[np.newaxis, :])
+            chunk_costs += np.where(has_previous, engine.pairwise(previous_cities[np.newaxis, :], chunk) - leg_distances, 0)
+            best = np.argmin(chunk_costs, axis=1)
+            costs[start:start + rows] = chunk_costs[np.arange(len(best)), best]
+            slots[start:start + rows] = best
+        return costs, slots
+
+    def cost_matrix(self, vehicle: Vehicle | None = None) -> np.ndarray:
+        """
+        Returns the cost of going directly between every pair of cities of the itinerary:
+        the distance in km, or the travel time in hours of a vehicle (math.inf where the
+        vehicle cannot go). Each pair is computed once, and the matrix is symmetric, unless
+        the travel times of the vehicle depend on the direction.
+        :param vehicle: the vehicle whose travel times to use, or None for distances.
+        :return: a square matrix with a row and a column per city, in order,
+                 costs[i, j] being the cost of going from city i to city j.
+        """
+        indices = np.array([city.index for city in self.cities], dtype=np.intp)
+        costs = np.zeros((len(indices), len(indices)))
+        if vehicle is not None and not vehicle.symmetric:
+            first, second = np.nonzero(~np.eye(len(indices), dtype=bool))
+            costs[first, second] = vehicle.compute_travel_time_many(indices[first], indices[second])
+            return costs
+        first, second = np.triu_indices(len(indices), 1)
+        if vehicle is not None:
+            upper = vehicle.compute_travel_time_many(indices[first], indices[second])
+        else:
+            upper = City.distance_engine.pairwise(indices[first], indices[second]).astype(np.float64)
+        costs[first, second] = upper
+        costs[second, first] = upper
+        return costs
+
+    def optimize(self, vehicle: Vehicle | None = None, fixed_start: bool = False, fixed_end: bool = False,
+                 time_budget: float | None = 1.0, neighbour_count: int = 10) -> float:
+        """
+        Reorders the cities of the itinerary to make it shorter. Itineraries of at most
+        BRUTE_FORCE_SIZE cities are given their best order, by trying every order. Longer ones
+        are improved with a local search that applies 2-opt moves (reversing a part of the
+        itinerary) and Or-opt moves (moving up to three successive cities elsewhere) until none
+        improves it.
+        The itinerary never gets more costly.
+        :param vehicle: a vehicle whose travel time to minimise instead of the distance.
+        :param fixed_start: whether the first city must stay first.
+        :param fixed_end: whether the last city must stay last.
+        :param time_budget: the maximum time to spend searching, in seconds, or None for no limit.
+        :param neighbour_count: the number of closest cities tried as new neighbours of each city.
+        :return: the total cost of the reordered itinerary, in km or in hours.
+        """
+        count = len(self.cities)
+        costs = self.cost_matrix(vehicle)
+        if count <= Itinerary.BRUTE_FORCE_SIZE:
+            order = self._best_order(costs, fixed_start, fixed_end)
+            self.cities = [self.cities[city] for city in order]
+            return self._path_cost(costs, order)
+        symmetric = vehicle is None or vehicle.symmetric
+
+        # the itinerary is optimised as a cycle through an extra node, which costs nothing to reach
+        # from the cities that may end the itinerary; a fixed end is linked to it with a cost so
+        # negative that no move ever unlinks it
+        finite = costs[np.isfinite(costs)]
+        too_much = (float(finite.max(initial=0.0)) + 1.0) * (count + 1)
+        if symmetric:
+            extra_costs = np.full(count, too_much) if fixed_start and fixed_end else np.zeros(count)
+            if fixed_start:
+                extra_costs[0] = -too_much
+            if fixed_end:
+                extra_costs[-1] = -too_much
+            from_extra = to_extra = extra_costs
+        else:
+            # the direction of the cycle is kept, so the trips from the extra node lead to the
+            # cities that may start the itinerary, and the trips to it from those that may end it
+            from_extra, to_extra = np.zeros(count), np.zeros(count)
+            for extra_costs, fixed, city in ((from_extra, fixed_start, 0), (to_extra, fixed_end, count - 1)):
+                if fixed:
+                    extra_costs[:] = too_much
+                    extra_costs[city] = -too_much
+        cycle_costs = np.zeros((count + 1, count + 1))
+        cycle_costs[:count, :count] = np.where(np.isfinite(costs), costs, too_much)
+        cycle_costs[count, :count] = from_extra
+        cycle_costs[:count, count] = to_extra
+
+        city_costs = cycle_costs[:count, :count]
+        neighbours = nearest_neighbours(city_costs if symmetric else np.minimum(city_costs, city_costs.T), neighbour_count)
+        free_ends = [city for city in range(count) if from_extra[city] == 0.0 or to_extra[city] == 0.0]
+        for city in free_ends:
+            neighbours[city].insert(0, count)
+        neighbours.append(free_ends)
+
+        tour = TourOptimizer(cycle_costs, neighbours, list(range(count + 1)), symmetric).optimize(time_budget)
+        # cut the cycle at the extra node, and keep the fixed ends at their place
+        position = tour.index(count)
+        order = tour[position + 1:] + tour[:position]
+        if symmetric and (order[0] != 0 if fixed_start else fixed_end and order[-1] != count - 1):
+            order.reverse()
+        self.cities = [self.cities[city] for city in order]
+        return self._path_cost(costs, order)
+
+    @staticmethod
+    def _best_order(costs: np.ndarray, fixed_start: bool, fixed_end: bool) -> list[int]:
+        """
+        Returns the cheapest order to visit cities in, trying every order, given the matrix of
+        costs between them. On a tie the current order is kept.
+        """
+        count = len(costs)
+        if count < 2:
+            return list(range(count))
+        middle = list(range(int(fixed_start), count - int(fixed_end)))
+        orders = np.array(list(itertools.permutations(middle)), dtype=np.intp)
+        if fixed_start:
+            orders = np.column_stack((np.zeros(len(orders), dtype=np.intp), orders))
+        if fixed_end:
+            orders = np.column_stack((orders, np.full(len(orders), count - 1, dtype=np.intp)))
+        totals = costs[orders[:, :-1], orders[:, 1:]].sum(axis=1)
+        # the first order is the current one, which argmin prefers on a tie
+        return orders[int(np.argmin(totals))].tolist()
+
+    @staticmethod
+    def _path_cost(costs: np.ndarray, order: list[int]) -> float:
+        """
+        Returns the total cost of visiting cities in some order, given the matrix of costs between them.
+        """
+        return float(sum(costs[departure, arrival] for departure, arrival in zip(order, order[1:])))
+
     def __str__(self) -> str:
         """
         Returns the sequence of cities and the distance in parentheses
@@ -72,6 +438,13 @@ class Itinerary():
 
         :return: a string representing the itinerary.
         """
+        with instrumentation.phase("itinerary_formatting"):
+            return self._format()
+
+    def _format(self) -> str:
+        """
+        Returns the string of __str__.
+        """
         # Calculates the total distance to travel
         total_distance = self.total_distance()
 
@@ -103,3 +476,14 @@ if __name__ == "__main__":
     test_itin.min_distance_insert_city(get_cities_by_name("Canberra")[0])
     print(test_itin)
 
+
+    #we try building an itinerary from many cities at once
+    for strategy in ["cheapest", "farthest"]:
+        built_itin = Itinerary([get_cities_by_name("Santiago")[0]])
+        built_itin.insert_cities([get_cities_by_name(name)[0] for name in ["Melbourne", "Kuala Lumpur", "Baoding", "Sydney", "Canberra"]],
+                                 strategy)
+        print(f"{strategy}: {built_itin}")
+
+    #we try reordering the last itinerary to make it shorter, starting from the same city
+    built_itin.optimize(fixed_start=True)
+    print(f"optimized: {built_itin}")
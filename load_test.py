@@ -0,0 +1,131 @@
+"""
+@file load_test.py
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import random
+import socket
+import subprocess
+import sys
+import time
+import numpy as np
+from csv_parsing import read_csv_columns
+
+def create_requests(path_to_csv: str, count: int, distinct: int, seed: int = 0) -> list[str]:
+    """
+    Creates a random mix of route and distance requests between cities of a CSV file.
+    The requests are drawn from a smaller set of distinct ones, so that some repeat,
+    as they do in real traffic.
+
+    :param path_to_csv: The path to the CSV file of cities the service loaded.
+    :param count: the number of requests.
+    :param distinct: the number of distinct requests.
+    :param seed: the seed of the random choices.
+    :return: the targets (path and query string) of the requests.
+    """
+    generator = random.Random(seed)
+    city_ids = read_csv_columns(path_to_csv)["id"].tolist()
+    targets = []
+    for _ in range(distinct):
+        from_id, to_id = generator.sample(city_ids, 2)
+        if generator.random() < 0.2:
+            targets.append(f"/distance?from={from_id}&to={to_id}")
+        else:
+            targets.append(f"/route?vehicle={generator.randint(1, 3)}&from={from_id}&to={to_id}")
+    return [generator.choice(targets) for _ in range(count)]
+
+async def _client(host: str, port: int, targets: list[str], latencies: list[float], statuses: dict[int, int]) -> None:
+    """
+    Sends requests one after the other over a single kept-alive connection, and records
+    the latency and status of each.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for target in targets:
+            start = time.perf_counter()
+            writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n".encode())
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            headers = {}
+            while (line := await reader.readline()) != b"\r\n":
+                name, _, value = line.decode().partition(":")
+                headers[name.strip().lower()] = value.strip()
+            await reader.readexactly(int(headers["content-length"]))
+            latencies.append(time.perf_counter() - start)
+            statuses[status] = statuses.get(status, 0) + 1
+    finally:
+        writer.close()
+
+async def run_load(host: str, port: int, targets: list[str], concurrency: int) -> dict:
+    """
+    Sends requests to a running service from several concurrent connections.
+
+    :param host: the address of the service.
+    :param port: the port of the service.
+    :param targets: the targets of the requests.
+    :param concurrency: the number of connections sending requests at the same time.
+    :return: a dict with the number of requests, their statuses, the requests per second
+             and the 50th and 99th percentiles of the latencies in milliseconds.
+    """
+    latencies, statuses = [], {}
+    start = time.perf_counter()
+    await asyncio.gather(*(_client(host, port, targets[client::concurrency], latencies, statuses)
+                           for client in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    return {"requests": len(latencies), "statuses": statuses, "seconds": elapsed,
+            "requests_per_second": len(latencies) / elapsed,
+            "p50_ms": float(np.percentile(latencies, 50)), "p99_ms": float(np.percentile(latencies, 99))}
+
+async def _get(host: str, port: int, target: str) -> dict:
+    """
+    Sends one request and returns its JSON answer.
+    """
+    reader, writer = await asyncio.open_connection(host, port)
+    writer.write(f"GET {target} HTTP/1.1\r\nHost: {host}\r\nConnection: close\r\n\r\n".encode())
+    response = await reader.read()
+    writer.close()
+    return json.loads(response.partition(b"\r\n\r\n")[2])
+
+def start_service(path_to_csv: str, workers: int | None, ttl: float) -> tuple[subprocess.Popen, int]:
+    """
+    Starts the routing service in another process on a free port, and waits until it serves requests.
+
+    :return: the process and the port.
+    """
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    command = [sys.executable, "routing_service.py", "--csv", path_to_csv, "--port", str(port), "--ttl", str(ttl)]
+    if workers is not None:
+        command += ["--workers", str(workers)]
+    service = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    for line in service.stdout:
+        print(f"service: {line.rstrip()}")
+        if line.startswith("Serving on"):
+            return service, port
+    raise RuntimeError("The routing service stopped before serving requests")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test of the routing service, started locally.")
+    parser.add_argument("--csv", default="worldcities_truncated.csv", help="the CSV file of cities")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--distinct", type=int, default=500, help="the number of distinct requests")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=None, help="the number of worker processes of the service")
+    parser.add_argument("--ttl", type=float, default=60.0)
+    parser.add_argument("--seed", type=int, default=0)
+    arguments = parser.parse_args()
+
+    targets = create_requests(arguments.csv, arguments.requests, arguments.distinct, arguments.seed)
+    service, port = start_service(arguments.csv, arguments.workers, arguments.ttl)
+    try:
+        report = asyncio.run(run_load("127.0.0.1", port, targets, arguments.concurrency))
+        print(f"{report['requests']} requests in {report['seconds']:.2f} s: {report['requests_per_second']:.0f} requests/s, "
+              f"p50 {report['p50_ms']:.2f} ms, p99 {report['p99_ms']:.2f} ms, statuses {report['statuses']}")
+        print(f"service: {asyncio.run(_get('127.0.0.1', port, '/stats'))}")
+    finally:
+        service.terminate()
+        service.wait()
@@ -1,47 +1,89 @@
 """
 @file map_plotting.py
 """
-from mpl_toolkits.basemap import Basemap #have to do 'pip install basemap'
-import matplotlib.pyplot as plt
+from __future__ import annotations
+import time
 from itinerary import Itinerary
 from city import City
 
-def plot_itinerary(itinerary: Itinerary, projection = 'robin', line_width=2, colour='b') -> None:
+# the ways an itinerary can be written:
+# - "basemap": a PNG image drawn with Basemap, see basemap_rendering,
+# - "html": a GeoJSON file and a self-contained HTML page with an SVG map, see vector_maps.
+# The backends are only imported when used, Basemap and matplotlib taking long to import.
+BACKENDS = ("basemap", "html")
+
+# the extension of the file of each backend
+_EXTENSIONS = {"basemap": ".png", "html": ".html"}
+
+def _check_backend(backend: str) -> None:
+    """
+    Raises a ValueError if a backend is unknown.
+    """
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown map backend: {backend}, expected one of {', '.join(BACKENDS)}")
+
+def map_file_name(itinerary: Itinerary, backend: str = "basemap") -> str:
+    """
+    Returns the name of the file of the map of an itinerary,
+    for example "Map of Itinerary from Melbourne to Perth.png".
+    """
+    return 'Map of Itinerary from {} to {}{}'.format(itinerary.cities[0].name, itinerary.cities[-1].name, _EXTENSIONS[backend])
+
+def plot_itinerary(itinerary: Itinerary, projection = 'robin', line_width=2, colour='b', path: str | None = None,
+                   backend: str = "basemap") -> float:
     """
     Plots an itinerary on a map and writes it to a file.
     Ensures a size of at least 50 degrees in each direction.
     Ensures the cities are not on the edge of the map by padding by 5 degrees.
-    The name of the file is map_city1_city2_city3_..._cityX.png.
+    With the "basemap" backend, the base layers of the maps are kept between calls, see MapRenderer.
+    The "html" backend writes the itinerary as GeoJSON too, next to the page.
 
     :param itinerary: The itinerary to plot.
-    :param projection: The map projection to use.
+    :param projection: The map projection to use, with the "basemap" backend
+                       (the "html" backend uses an equirectangular projection).
     :param line_width: The width of the line to draw.
     :param colour: The colour of the line to draw.
+    :param path: the path of the file to write, by default given by map_file_name.
+    :param backend: how the map is drawn, one of BACKENDS.
+    :return: the number of seconds it took.
     """
-    # Setting the latitude and longitude limits
-    min_lat = min(city.coordinates[0] for city in itinerary.cities) - 5
-    max_lat = max(city.coordinates[0] for city in itinerary.cities) + 5
-    min_lon = min(city.coordinates[1] for city in itinerary.cities) - 5
-    max_lon = max(city.coordinates[1] for city in itinerary.cities) + 5
-
-    # Creating the map 
-    world_map = Basemap(projection=projection, lat_0=0, lon_0=0, resolution='l', llcrnrlat=min_lat, urcrnrlat=max_lat, llcrnrlon=min_lon, urcrnrlon=max_lon)
-    world_map.drawcoastlines(linewidth=1, color='gray')
-    world_map.drawcountries(linewidth=1, color='gray')
-    world_map.fillcontinents(color='#C1BBBA', lake_color='white')
-
-    # Adding city courdinates to a list
-    city_locations = [city.coordinates for city in itinerary.cities]
-
-    # For every city coordinate in the list, draw a line between consecutive cities using drawgreatcircle
-    for index, city in enumerate(city_locations[:-1]):
-        start = city
-        end = city_locations[index+1]
-        world_map.drawgreatcircle(start[1], start[0], end[1], end[0], linewidth=line_width, color=colour)
-    
-    # Save the file and output
-    plt.savefig('Map of Itinerary from {} to {}'.format(itinerary.cities[0].name, itinerary.cities[-1].name))
-    
+    _check_backend(backend)
+    path = path or map_file_name(itinerary, backend)
+    if backend == "html":
+        from vector_maps import write_vector_map
+        start = time.perf_counter()
+        write_vector_map(itinerary, path, line_width, colour)
+        return time.perf_counter() - start
+    from basemap_rendering import renderer
+    return renderer(projection).render([city.coordinates for city in itinerary.cities], path, line_width, colour)
+
+def plot_itineraries(itineraries: list[Itinerary], projection = 'robin', line_width=2, colour='b',
+                     paths: list[str] | None = None, workers: int = 0, backend: str = "basemap") -> list[tuple[str, float]]:
+    """
+    Plots many itineraries, each on its own map, and writes them to files.
+    With the "basemap" backend, maps sharing a base layer are rendered one after the other,
+    so it is drawn once, and can be rendered by several processes.
+
+    :param itineraries: The itineraries to plot.
+    :param projection: The map projection to use, with the "basemap" backend.
+    :param line_width: The width of the line to draw.
+    :param colour: The colour of the line to draw.
+    :param paths: the path of the file of each map, by default given by map_file_name.
+    :param workers: the number of worker processes rendering maps in parallel, 0 to render them in this process.
+                    Only the "basemap" backend, by far the slowest, uses them.
+    :param backend: how the maps are drawn, one of BACKENDS.
+    :return: the path of each map and the number of seconds it took to render, in the order of the itineraries.
+    """
+    _check_backend(backend)
+    paths = paths or [map_file_name(itinerary, backend) for itinerary in itineraries]
+    if backend == "html":
+        return [(path, plot_itinerary(itinerary, line_width=line_width, colour=colour, path=path, backend=backend))
+                for itinerary, path in zip(itineraries, paths)]
+    from basemap_rendering import render_many
+    seconds = render_many([[city.coordinates for city in itinerary.cities] for itinerary in itineraries], paths,
+                          projection, line_width, colour, workers)
+    return list(zip(paths, seconds))
+
 if __name__ == "__main__":
     # create some cities
     city_list = list()
@@ -51,8 +93,13 @@ if __name__ == "__main__":
     city_list.append(City("Brisbane", (-27.4698, 153.0251), "primary", 2314000, 1036192929))
     city_list.append(City("Perth", (-31.9505, 115.8605), "1992000", 2039200, 1036178956))
 
-    # plot itinerary
-    plot_itinerary(Itinerary(city_list))
+    # plot itinerary, as a page that needs neither Basemap nor a network connection
+    print(f"Written in {plot_itinerary(Itinerary(city_list), backend='html'):.3f} s")
 
-    
+    # plot itinerary
+    print(f"Plotted in {plot_itinerary(Itinerary(city_list)):.2f} s")
 
+    # plot several itineraries, the base layer being drawn once
+    itineraries = [Itinerary(city_list[:end]) for end in range(2, len(city_list) + 1)]
+    for path, seconds in plot_itineraries(itineraries, paths=[f"map_{index}.png" for index in range(len(itineraries))]):
+        print(f"{path}: {seconds:.2f} s")
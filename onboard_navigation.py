@@ -1,13 +1,16 @@
 """
 @file onboard_navigation.py
 """
+import sys
+import threading
 from city import City, get_city_by_id
 from country import Country, find_country_of_city, add_city_to_country
 from itinerary import Itinerary
 from vehicles import Vehicle, create_example_vehicles
-from csv_parsing import create_cities_countries_from_csv
-from path_finding import find_shortest_path
-from map_plotting import plot_itinerary
+from csv_parsing import LoadReport, load_cities_countries
+from city_search import city_name_index, search_cities
+# path_finding (with the routing graphs) and map_plotting are imported when first used,
+# so that the first prompt shows as soon as possible
 
 def validate_input(prompt: str, valid_inputs: dict[str, any], show_options=True, item_descriptors=None):
     """
@@ -65,6 +68,79 @@ def select_from_duplicate_cities(cities: list):
             item_descriptors=[c.country for c in cities]
         )
 
+def select_city(prompt: str, limit: int = 9) -> City:
+    """
+    allows the user to choose a city by typing its name, the start of its name, or its name
+    with a few typos, ignoring case and accents.
+    :param prompt: a string to prepend to the line the user types the name on
+    :param limit: the maximum number of matching cities to choose from
+    :return: the chosen city
+    """
+    while True:
+        query = input(prompt)
+        # a name typed exactly is taken as is, as before
+        cities = city_name_index().exact(query)
+        if cities:
+            print()
+            return select_from_duplicate_cities(cities)
+        matches = search_cities(query, limit)
+        if not matches:
+            print('No city found, please try again.')
+        elif len(matches) == 1:
+            print(f"Found {matches[0]} ({matches[0].country})\n")
+            return matches[0]
+        else:
+            # 0 lets the user type another name if none of the matches is the one they meant
+            city_choices = {**create_numbered_input_options(matches), "0": "Search again"}
+            city = validate_input(
+                "Did you mean one of these cities? Select one, or 0 to search again: ",
+                city_choices,
+                show_options=True,
+                item_descriptors=[c.country for c in matches]
+            )
+            if isinstance(city, City):
+                return city
+
+class BackgroundLoad():
+    """
+    Loads the cities and countries of a CSV file (from its snapshot when it is up to date)
+    and indexes their names in a thread, so that the user can pick a vehicle meanwhile.
+    """
+
+    def __init__(self, path_to_csv: str) -> None:
+        """
+        Starts loading.
+
+        :param path_to_csv: The path to the CSV file.
+        :return: None
+        """
+        self.path_to_csv = path_to_csv
+        self.report = None
+        self.error = None
+        self._thread = threading.Thread(target=self._load, name="load cities", daemon=True)
+        self._thread.start()
+
+    def _load(self) -> None:
+        """
+        Loads the data and indexes the names of the cities, keeping any error for wait.
+        """
+        try:
+            self.report = load_cities_countries(self.path_to_csv)
+            city_name_index()
+        except BaseException as error:
+            self.error = error
+
+    def wait(self) -> LoadReport:
+        """
+        Waits until loading is done.
+
+        :return: the report of the load.
+        """
+        self._thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.report
+
 # Creates a dictionary, numbering each items in the list to use with valid input
 def create_numbered_input_options(items: list):
     """
@@ -78,33 +154,42 @@ def create_numbered_input_options(items: list):
     # cast to dict then return
     return dict(zip(map(str, range(1, len(items)+1)), items))
               
-def navigate():
+def navigate(path_to_csv: str = "worldcities_truncated.csv"):
     """
     allows a user to:
     - select a vehicle
     - select an origin and destination city
     - view a plotted map of the shortest path between those cities if it exists
+    :param path_to_csv: The path to the CSV file of cities.
     :return: None
     """
-    create_cities_countries_from_csv("worldcities_truncated.csv")
-    
+    # the cities are loaded, and their names indexed, while the user picks a vehicle
+    loading = BackgroundLoad(path_to_csv)
+
     # Number the vehices using create number input options
     vehicle_choices = create_numbered_input_options(create_example_vehicles())
     # Prompt user to choose vehicle
     vehicle_chosen = validate_input('Please pick a vehicle: ', vehicle_choices)
 
-    # select from duplicate cities check if the city is equal to 1
-    # if not, select function returns the duplicate cities along with its countries
-    origin = select_from_duplicate_cities(validate_input('Please enter an origin city: ', City.name_to_cities, show_options=False))
-    destination = select_from_duplicate_cities(validate_input('Please enter a destination city: ', City.name_to_cities, show_options=False))
+    loading.wait()
+    # the user can type part of a name, or misspell it, and pick from the matching cities
+    origin = select_city('Please enter an origin city: ')
+    destination = select_city('Please enter a destination city: ')
 
+    from path_finding import find_shortest_path
+    from map_plotting import plot_itinerary, map_file_name
     itinerary = find_shortest_path(vehicle_chosen, origin, destination)
     if itinerary != None:
         print(f"Path found! {str(itinerary)}\nPlotting...")
-        plot_itinerary(itinerary, projection = 'robin', line_width=2, colour='b')
+        try:
+            plot_itinerary(itinerary, projection = 'robin', line_width=2, colour='b')
+        except ImportError:
+            # without Basemap, the itinerary is written as a page viewable in a browser
+            plot_itinerary(itinerary, line_width=2, colour='b', backend="html")
+            print(f"Basemap is not installed, the map was written to {map_file_name(itinerary, 'html')}")
     else:
         print("Could not find a path.")
     return
 
 if __name__ == "__main__":
-    navigate()
+    navigate(*sys.argv[1:2])
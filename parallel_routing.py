@@ -0,0 +1,78 @@
+"""
+@file parallel_routing.py
+"""
+from __future__ import annotations
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import os
+from city import City, get_city_by_id
+from itinerary import Itinerary
+from vehicles import Vehicle, create_example_vehicles
+from csv_parsing import load_cities_countries
+from path_finding import find_shortest_path
+
+# A query as sent to a worker: the vehicle, and the IDs of the departure and arrival cities
+Query = tuple[Vehicle, int, int]
+
+def _load_dataset(path_to_csv: str) -> None:
+    """
+    Initializer of the worker processes: loads the cities and countries once per worker,
+    so that queries only need to carry city IDs.
+
+    :param path_to_csv: The path to the CSV file.
+    :return: None
+    """
+    load_cities_countries(path_to_csv)
+
+def _find_shortest_paths(queries: list[Query]) -> list[list[int] | None]:
+    """
+    Runs a chunk of queries in a worker process.
+
+    :param queries: the queries.
+    :return: for each query, the IDs of the cities of a shortest path, or None if there is none.
+    """
+    results = []
+    for vehicle, from_id, to_id in queries:
+        itinerary = find_shortest_path(vehicle, get_city_by_id(from_id), get_city_by_id(to_id))
+        results.append([city.city_id for city in itinerary.cities] if itinerary is not None else None)
+    return results
+
+def find_shortest_paths_parallel(queries: list[tuple[Vehicle, City, City]], path_to_csv: str,
+                                 workers: int | None = None, chunk_size: int = 32) -> list[Itinerary | None]:
+    """
+    Runs many find_shortest_path queries over several processes and returns the results in
+    the same order as the queries.
+
+    Each worker process loads the cities and countries from the CSV file once, then only
+    receives vehicles and city IDs. The cities of the returned itineraries are looked up by ID
+    in this process, so the same CSV file must have been loaded here too.
+
+    :param queries: a list of (vehicle, departure city, arrival city) tuples.
+    :param path_to_csv: The path to the CSV file the cities were loaded from.
+    :param workers: the number of worker processes, by default the number of CPUs.
+    :param chunk_size: the number of queries sent to a worker at a time.
+    :return: for each query, a shortest path as an Itinerary, or None if there is none.
+    """
+    workers = workers or os.cpu_count() or 1
+    chunks = [[(vehicle, from_city.city_id, to_city.city_id) for vehicle, from_city, to_city in queries[start:start + chunk_size]]
+              for start in range(0, len(queries), chunk_size)]
+
+    # workers are started fresh rather than forked, so that they load the dataset into empty registries
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                             initializer=_load_dataset, initargs=(path_to_csv,)) as executor:
+        results = []
+        # map returns the results of the chunks in the order they were given
+        for chunk_results in executor.map(_find_shortest_paths, chunks):
+            results.extend(Itinerary([get_city_by_id(city_id) for city_id in path]) if path is not None else None
+                           for path in chunk_results)
+    return results
+
+if __name__ == "__main__":
+    load_cities_countries("worldcities_truncated.csv")
+
+    cities = [get_city_by_id(city_id) for city_id in [1036533631, 1036142029, 1458988644]]
+    queries = [(vehicle, from_city, to_city) for vehicle in create_example_vehicles()
+               for from_city in cities for to_city in cities if from_city != to_city]
+
+    for (vehicle, from_city, to_city), itinerary in zip(queries, find_shortest_paths_parallel(queries, "worldcities_truncated.csv")):
+        print(f"{from_city} to {to_city} with {vehicle}: {itinerary}")
@@ -2,77 +2,127 @@
 @file path_finding.py
 """
 import math
-import networkx as nx
+import numpy as np
 from country import find_country_of_city
 from city import City, get_city_by_id
 from itinerary import Itinerary
 from vehicles import Vehicle, create_example_vehicles, CrappyCrepeCar, DiplomacyDonutDinghy, TeleportingTarteTrolley
 from csv_parsing import create_cities_countries_from_csv
+from routing_cache import routing_graph_cache
+import instrumentation
 
 
-def find_shortest_path(vehicle: Vehicle, from_city: City, to_city: City) -> Itinerary | None:
+def find_direct_path(vehicle: Vehicle, from_city: City, to_city: City) -> Itinerary | None:
     """
-    Returns a shortest path between two cities for a given vehicle as an Itinerary,
-    or None if there is no path.
+    Returns the direct trip between two cities as an Itinerary if it is known to be
+    a shortest path for the vehicle without searching, or None otherwise.
 
     :param vehicle: The vehicle to use.
     :param from_city: The departure city.
     :param to_city: The arrival city.
-    :return: A shortest path from departure to arrival, or None if there is none.
+    :return: the direct itinerary, or None if a search is needed.
     """
-    # return the trivial cases so we don't waste resources on a graph if not necessary
     match vehicle:
         case CrappyCrepeCar():
             # trivial as can go from anywhere to anywhere so the fastest route is always just A to B
             return Itinerary([from_city, to_city])
 
         case DiplomacyDonutDinghy():
-            # trivial case where both cities are primary
-            if (from_city.city_type == 'primary' and to_city.city_type == 'primary' 
+            # trivial case where both cities are primary, in different countries: inside a country
+            # the trip between them is at the slower speed, and may be beaten through another country
+            if (from_city.city_type == 'primary' and to_city.city_type == 'primary'
+                and from_city.country is not to_city.country
                 and vehicle.between_primary_speed > vehicle.in_country_speed):
                 return Itinerary([from_city, to_city])
 
-            # create two complete graphs of the origin and destination countries, then merge
-            country1_graph = nx.complete_graph(find_country_of_city(from_city).get_cities())
-            country2_graph = nx.complete_graph(find_country_of_city(to_city).get_cities())
-            country_graph = nx.compose(country1_graph, country2_graph)
-            # iterate through all edges of merged country graphs and update edge weights
-            for city1, city2 in country_graph.edges:
-                country_graph[city1][city2]["weight"] = vehicle.compute_travel_time(city1, city2)
-
-            # create complete graph of all primary cities, then update edge weights
-            primarycity_graph = nx.complete_graph([c for c in country_graph.nodes if c.city_type == "primary"])
-            for city1, city2 in primarycity_graph.edges:
-                primarycity_graph[city1][city2]["weight"] = vehicle.compute_travel_time(city1, city2)
-
-            # merge primary city and country graphs
-            mapgraph = nx.compose(country_graph, primarycity_graph)
-
-            # return shortest path of our graph
-            try:
-                return Itinerary(nx.shortest_path(mapgraph, from_city, to_city))
-            except:
-                return None
-
         case TeleportingTarteTrolley():
             # trivial case if we can hop directly to the end
             if from_city.distance(to_city) < vehicle.max_distance:
                 return Itinerary([from_city, to_city])
+    return None
+
+def find_shortest_path(vehicle: Vehicle, from_city: City, to_city: City) -> Itinerary | None:
+    """
+    Returns a shortest path between two cities for a given vehicle as an Itinerary,
+    or None if there is no path.
 
-            # create a complete graph
-            mapgraph = nx.complete_graph(City.id_to_cities.values())
-            # create a subgraph comprised of edges in complete graph that are possible
-            final_graph = nx.Graph()
-            for city1, city2 in mapgraph.edges:
-                time = vehicle.compute_travel_time(city1, city2)
-                if time != math.inf:
-                    final_graph.add_edge(city1, city2, weight=time)
-
-            # return the shortest path of our graph
-            try:
-                return Itinerary(nx.shortest_path(final_graph, from_city, to_city))
-            except:
-                return None
+    :param vehicle: The vehicle to use.
+    :param from_city: The departure city.
+    :param to_city: The arrival city.
+    :return: A shortest path from departure to arrival, or None if there is none.
+    """
+    instrumentation.count("queries")
+    # return the trivial cases so we don't waste resources on a graph if not necessary
+    with instrumentation.phase("direct_path"):
+        itinerary = find_direct_path(vehicle, from_city, to_city)
+    if itinerary is not None:
+        return itinerary
+
+    # otherwise search the graph of the vehicle, only generating the edges of the cities
+    # the search reaches, and reusing the graph of earlier queries with the same vehicle
+    with instrumentation.phase("graph"):
+        graph = routing_graph_cache.get(vehicle)
+    if graph is None:
+        # the vehicle has no routing graph, so no itinerary is known for it
+        return None
+    with instrumentation.phase("search"):
+        path = graph.shortest_path(from_city, to_city)
+    return Itinerary(path) if path is not None else None
+
+def find_shortest_paths(vehicle: Vehicle, origins: list[City],
+                        destinations: list[City]) -> tuple[list[list[Itinerary | None]], np.ndarray]:
+    """
+    Returns shortest paths between every origin and every destination for a given vehicle.
+    Gives the same travel times as calling find_shortest_path on each pair, but runs
+    one search per distinct origin (or per distinct destination, if there are fewer of those)
+    and shares the vehicle's graph between all of them.
+
+    :param vehicle: The vehicle to use.
+    :param origins: The departure cities.
+    :param destinations: The arrival cities.
+    :return: a tuple (itineraries, times), where itineraries[i][j] is a shortest path from
+             origins[i] to destinations[j] or None if there is none, and times is an array of
+             the travel times in hours of these itineraries, math.inf where there is no path.
+    """
+    itineraries = [[None] * len(destinations) for _ in origins]
+
+    # the positions in the matrix of each pair of cities that needs a search
+    searches = {}
+    for row, from_city in enumerate(origins):
+        for column, to_city in enumerate(destinations):
+            itinerary = find_direct_path(vehicle, from_city, to_city)
+            if itinerary is not None:
+                itineraries[row][column] = itinerary
+            else:
+                searches.setdefault(from_city, {}).setdefault(to_city, []).append((row, column))
+
+    instrumentation.count("queries", len(origins) * len(destinations))
+    graph = None
+    if searches:
+        with instrumentation.phase("graph"):
+            graph = routing_graph_cache.get(vehicle)
+    # without a routing graph, the pairs that need a search have no known itinerary
+    if graph is not None:
+        # search from whichever side has fewer distinct cities, which is allowed
+        # when paths are the same backwards
+        backwards = {}
+        for from_city, to_cities in searches.items():
+            for to_city, positions in to_cities.items():
+                backwards.setdefault(to_city, {})[from_city] = positions
+        reverse = graph.undirected and len(backwards) < len(searches)
+
+        for source, targets in (backwards if reverse else searches).items():
+            with instrumentation.phase("search"):
+                paths = graph.shortest_paths(source, list(targets))
+            for target, path in paths.items():
+                if path is None:
+                    continue
+                for row, column in targets[target]:
+                    itineraries[row][column] = Itinerary(path[::-1] if reverse else path[:])
+
+    times = np.array([[vehicle.compute_itinerary_time(itinerary) if itinerary is not None else math.inf
+                       for itinerary in row] for row in itineraries], dtype=float).reshape(len(origins), len(destinations))
+    return itineraries, times
 
 if __name__ == "__main__":
     create_cities_countries_from_csv("worldcities_truncated.csv")
@@ -85,13 +135,14 @@ if __name__ == "__main__":
     #we create some vehicles
     vehicles = create_example_vehicles()
 
-    to_cities = set(from_cities)
-    for from_city in from_cities:
-        to_cities -= {from_city}
-        for to_city in to_cities:
+    # compute the paths between all pairs at once for each vehicle
+    from_cities = list(from_cities)
+    results = {test_vehicle: find_shortest_paths(test_vehicle, from_cities, from_cities) for test_vehicle in vehicles}
+
+    for row, from_city in enumerate(from_cities):
+        for column, to_city in enumerate(from_cities[row+1:], start=row+1):
             print(f"{from_city} to {to_city}:")
             for test_vehicle in vehicles:
-                shortest_path = find_shortest_path(test_vehicle, from_city, to_city)
-                print(f"\t{test_vehicle.compute_itinerary_time(shortest_path)}"
-                      f" hours with {test_vehicle} with path {shortest_path}.")
-
+                itineraries, times = results[test_vehicle]
+                print(f"\t{times[row][column]:g}"
+                      f" hours with {test_vehicle} with path {itineraries[row][column]}.")
@@ -0,0 +1,268 @@
+"""
+@file primary_backbone.py
+"""
+from __future__ import annotations
+import math
+from typing import Callable
+import numpy as np
+from city import City
+from country import Country
+from vehicles import DiplomacyDonutDinghy
+
+class CityTypeIndex():
+    """
+    The cities of some types (by default the primary cities) of the whole world,
+    with the distance between every pair of them.
+
+    The distances do not depend on any vehicle, so one index is shared by all the
+    vehicles that need it, see city_type_index.
+    """
+
+    def __init__(self, city_types: tuple[str, ...] = ("primary",)) -> None:
+        """
+        Indexes the cities of some types among the cities loaded.
+
+        :param city_types: the types of the cities to index.
+        :return: None
+        """
+        table = City.table
+        self.city_types = tuple(city_types)
+        codes = [code for code, city_type in enumerate(table.city_types) if city_type in self.city_types]
+        # the rows of the cities in the table, in the order they were created
+        self.indices = np.flatnonzero(np.isin(table.column("type_code"), codes)).astype(np.intp)
+        # the index of the country of each city, -1 for the cities without a country
+        self.country_indices = table.column("country_index")[self.indices].copy()
+        self.kilometers = City.distance_engine.many_to_many(self.indices, self.indices)
+        self.versions = (City.registry_version, Country.registry_version)
+
+    def __len__(self) -> int:
+        """
+        Returns the number of cities indexed.
+        """
+        return len(self.indices)
+
+    def is_current(self) -> bool:
+        """
+        Returns whether the index still describes the cities loaded: it must be rebuilt
+        once cities or countries have changed.
+        """
+        return self.versions == (City.registry_version, Country.registry_version)
+
+    def nbytes(self) -> int:
+        """
+        Returns the memory used by the index, in bytes.
+        """
+        return self.indices.nbytes + self.country_indices.nbytes + self.kilometers.nbytes
+
+
+# associates the types of cities to the index of the cities of these types
+_type_indices = {}
+
+def city_type_index(city_types: tuple[str, ...] = ("primary",)) -> CityTypeIndex:
+    """
+    Returns the index of the cities of some types, building it if it does not exist
+    or if cities or countries changed since it was built.
+
+    :param city_types: the types of the cities, for example ("primary", "admin").
+    :return: the index.
+    """
+    key = tuple(sorted(set(city_types)))
+    index = _type_indices.get(key)
+    if index is None or not index.is_current():
+        index = _type_indices[key] = CityTypeIndex(key)
+    return index
+
+
+def fastest_hub_trips(kilometers: np.ndarray, countries: np.ndarray, in_speed: int, between_speed: int,
+                      country_trips: Callable[[int, np.ndarray], tuple[np.ndarray, np.ndarray]]
+                      ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Computes the fastest travel times of a DiplomacyDonutDinghy between every two primary cities
+    (the hubs), for PrimaryBackbone and build_dinghy_index.
+
+    :param kilometers: the distances between the hubs.
+    :param countries: the index of the country of each hub, -1 for the hubs without a country.
+    :param in_speed: the in-country speed of the vehicle.
+    :param between_speed: the speed of the vehicle between primary cities.
+    :param country_trips: given the index of a country and the positions of its hubs, returns the
+                          other cities of the country (as numbers identifying them to the caller)
+                          and the in-country travel times from each of them to each of the hubs.
+    :return: the travel times between every two hubs, the next hub of a fastest itinerary from
+             each hub to each other, and the city to go through between two adjacent hubs of a
+             country, or -1 if the direct trip is the fastest.
+    """
+    # direct trips: between countries at the speed between primary cities,
+    # inside a country at the slower of the two speeds
+    # (cities without a country are in no country, so not in the same one as each other)
+    same_country = (countries[:, np.newaxis] == countries[np.newaxis, :]) & (countries >= 0)[:, np.newaxis]
+    hours = np.ceil(kilometers / between_speed)
+    hours[same_country] = np.maximum(hours[same_country], np.ceil(kilometers[same_country] / in_speed))
+    via = np.full(hours.shape, -1, dtype=np.intp)
+
+    # two primary cities of a country can also be linked through one other city of the country
+    # at the in-country speed (going through more of them is never faster)
+    for country_index in np.unique(countries[countries >= 0]).tolist():
+        hubs = np.flatnonzero(countries == country_index)
+        if len(hubs) < 2:
+            continue
+        others, hub_hours = country_trips(country_index, hubs)
+        if len(others) == 0:
+            continue
+        for first, second in zip(*np.triu_indices(len(hubs), 1)):
+            total = hub_hours[:, first] + hub_hours[:, second]
+            best = int(np.argmin(total))
+            first_hub, second_hub = hubs[first], hubs[second]
+            if total[best] < hours[first_hub, second_hub]:
+                hours[first_hub, second_hub] = hours[second_hub, first_hub] = total[best]
+                via[first_hub, second_hub] = via[second_hub, first_hub] = others[best]
+
+    # fastest trips between all pairs, with the Floyd-Warshall algorithm
+    np.fill_diagonal(hours, 0.0)
+    next_hubs = np.tile(np.arange(len(hours), dtype=np.intp), (len(hours), 1))
+    for hub in range(len(hours)):
+        through = hours[:, hub, np.newaxis] + hours[np.newaxis, hub, :]
+        faster = through < hours
+        hours[faster] = through[faster]
+        next_hubs[faster] = np.broadcast_to(next_hubs[:, hub, np.newaxis], next_hubs.shape)[faster]
+    return hours, next_hubs, via
+
+def hub_path(first: int, last: int, next_hubs: np.ndarray, via: np.ndarray, hub_cities: np.ndarray) -> list[int]:
+    """
+    Returns the cities of a fastest itinerary between two hubs, both included, from the arrays
+    computed by fastest_hub_trips.
+
+    :param first: the position of the departure hub.
+    :param last: the position of the arrival hub.
+    :param next_hubs: the next hub of a fastest itinerary from each hub to each other.
+    :param via: the city to go through between two adjacent hubs, or -1.
+    :param hub_cities: the number identifying the city of each hub, as the cities in via are identified.
+    :return: the numbers identifying the cities of the itinerary.
+    """
+    cities = [int(hub_cities[first])]
+    while first != last:
+        following = int(next_hubs[first, last])
+        # the trip between two primary cities of a country may be faster through another of its cities
+        if via[first, following] >= 0:
+            cities.append(int(via[first, following]))
+        cities.append(int(hub_cities[following]))
+        first = following
+    return cities
+
+
+class PrimaryBackbone():
+    """
+    The fastest travel times of a DiplomacyDonutDinghy between every two primary cities
+    of the world, precomputed once for the speeds of the vehicle.
+
+    A Dinghy only leaves a country from one of its primary cities, so a fastest itinerary
+    between two cities is either the direct trip inside their country, or a trip to a primary
+    city of the departure country, fastest trips through the primary cities of any countries
+    (the backbone), and a trip from a primary city of the arrival country. A query only looks
+    at the primary cities of the two endpoint countries, the rest being precomputed.
+
+    Cities without a country are in no country: they are only linked to the other primary
+    cities, if they are primary, as in DinghyGraph.
+    """
+
+    def __init__(self, vehicle: DiplomacyDonutDinghy) -> None:
+        """
+        Computes the backbone of a vehicle over the cities and countries loaded.
+
+        :param vehicle: the vehicle.
+        :return: None
+        """
+        self.vehicle = vehicle
+        self.primaries = city_type_index(("primary",))
+        in_speed, between_speed = vehicle.in_country_speed, vehicle.between_primary_speed
+        table = City.table
+        # the position of each primary city in the backbone, by row of the table
+        self.positions = np.full(len(table), -1, dtype=np.intp)
+        self.positions[self.primaries.indices] = np.arange(len(self.primaries))
+
+        # the other cities of a country are identified by their rows in the table
+        def country_trips(country_index: int, hubs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+            others = self._country_rows(country_index)
+            others = others[self.positions[others] < 0]
+            return others, np.ceil(City.distance_engine.many_to_many(others, self.primaries.indices[hubs]) / in_speed)
+
+        self.hours, self.next, self.via = fastest_hub_trips(self.primaries.kilometers, self.primaries.country_indices,
+                                                            in_speed, between_speed, country_trips)
+        # the primary cities of each country, as positions in the backbone
+        self._country_hubs = {}
+
+    @staticmethod
+    def _country_rows(country_index: int) -> np.ndarray:
+        """
+        Returns the rows of the cities of a country.
+        """
+        return np.array([city.index for city in Country.index_to_countries[country_index].cities], dtype=np.intp)
+
+    def is_current(self) -> bool:
+        """
+        Returns whether the backbone still describes the cities loaded.
+        """
+        return self.primaries.is_current()
+
+    def nbytes(self) -> int:
+        """
+        Returns the memory used by the backbone, in bytes.
+        """
+        return self.primaries.nbytes() + self.positions.nbytes + self.hours.nbytes + self.next.nbytes + self.via.nbytes
+
+    def _hubs(self, city: City) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the primary cities a city can leave its country from, as positions in the
+        backbone, and the travel time from the city to each.
+        """
+        position = int(self.positions[city.index])
+        if position >= 0:
+            return np.array([position], dtype=np.intp), np.zeros(1)
+        country_index = int(City.table.country_index[city.index])
+        if country_index < 0:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        hubs = self._country_hubs.get(country_index)
+        if hubs is None:
+            hubs = self._country_hubs[country_index] = np.flatnonzero(self.primaries.country_indices == country_index)
+        kilometers = City.distance_engine.one_to_many(city.index, self.primaries.indices[hubs])
+        return hubs, np.ceil(kilometers / self.vehicle.in_country_speed)
+
+    def _hub_path(self, first: int, last: int) -> list[City]:
+        """
+        Returns the cities of the fastest itinerary between two primary cities, given by their positions.
+        """
+        return [City.index_to_cities[row] for row in hub_path(first, last, self.next, self.via, self.primaries.indices)]
+
+    def shortest_path(self, from_city: City, to_city: City) -> list[City] | None:
+        """
+        Returns the cities of a fastest itinerary between two cities, or None if there is none.
+
+        :param from_city: The departure city.
+        :param to_city: The arrival city.
+        :return: the list of cities from departure to arrival, or None.
+        """
+        if from_city is to_city:
+            return [from_city]
+        from_hubs, from_hours = self._hubs(from_city)
+        to_hubs, to_hours = self._hubs(to_city)
+
+        best_hours, best_path = math.inf, None
+        if len(from_hubs) > 0 and len(to_hubs) > 0:
+            totals = from_hours[:, np.newaxis] + self.hours[np.ix_(from_hubs, to_hubs)] + to_hours[np.newaxis, :]
+            first, last = np.unravel_index(int(np.argmin(totals)), totals.shape)
+            best_hours = float(totals[first, last])
+            if best_hours < math.inf:
+                path = self._hub_path(int(from_hubs[first]), int(to_hubs[last]))
+                best_path = ([from_city] if path[0] is not from_city else []) + path + ([to_city] if path[-1] is not to_city else [])
+        # the direct trip, which is the only way between two cities of a country without primary cities
+        if from_city.country is not None and from_city.country is to_city.country:
+            direct_hours = self.vehicle.compute_travel_time(from_city, to_city)
+            if direct_hours <= best_hours and direct_hours < math.inf:
+                best_path = [from_city, to_city]
+        return best_path
+
+    def __str__(self) -> str:
+        """
+        Returns a summary of the backbone, for example
+        "PrimaryBackbone of DiplomacyDonutDinghy (100 km/h | 500 km/h): 243 primary cities, 1.2 MB"
+        """
+        return f"PrimaryBackbone of {self.vehicle}: {len(self.primaries)} primary cities, {self.nbytes() / 1e6:.1f} MB"
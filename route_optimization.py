@@ -0,0 +1,217 @@
+"""
+@file route_optimization.py
+"""
+from __future__ import annotations
+from collections import deque
+import time
+import numpy as np
+
+def nearest_neighbours(costs: np.ndarray, count: int) -> list[list[int]]:
+    """
+    Returns, for each node, the nodes it is cheapest to go to from it, cheapest first.
+
+    :param costs: a square matrix of the costs between nodes.
+    :param count: the number of neighbours of each node.
+    :return: a list with the neighbours of each node.
+    """
+    size = len(costs)
+    count = min(count, size - 1)
+    if count <= 0:
+        return [[] for _ in range(size)]
+    others = costs.astype(np.float64)
+    np.fill_diagonal(others, np.inf)
+    # only the count cheapest are sorted, not the whole row
+    nearest = np.argpartition(others, count - 1, axis=1)[:, :count]
+    order = np.argsort(np.take_along_axis(others, nearest, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(nearest, order, axis=1).tolist()
+
+class TourOptimizer():
+    """
+    Improves a tour (a cycle through all the nodes of a graph) with 2-opt and Or-opt moves,
+    searched only among the nearest neighbours of each node.
+
+    When costs depend on the direction, the cost of the part of the tour a 2-opt move reverses
+    is computed again, and Or-opt moves keep segments the same way round.
+    A path rather than a cycle is optimised by adding a node that costs nothing to reach
+    from its possible ends, see Itinerary.optimize.
+    """
+
+    def __init__(self, costs: np.ndarray, neighbours: list[list[int]], tour: list[int], symmetric: bool = True) -> None:
+        """
+        :param costs: a square matrix of the finite costs between nodes, costs[a, b] being the cost from a to b.
+        :param neighbours: for each node, the nodes to try to link it to, cheapest first.
+        :param tour: the initial order of the nodes, each node appearing once.
+        :param symmetric: whether the costs are the same in both directions.
+        :return: None
+        """
+        self.costs = costs.tolist()
+        self.symmetric = symmetric
+        self.neighbours = neighbours
+        self.tour = list(tour)
+        self.positions = [0] * len(tour)
+        for position, node in enumerate(self.tour):
+            self.positions[node] = position
+        self.moves = 0
+
+    def cost(self) -> float:
+        """
+        Returns the total cost of the tour.
+
+        :return: the sum of the costs of its edges, including the one back to the first node.
+        """
+        return sum(self.costs[self.tour[position - 1]][node] for position, node in enumerate(self.tour))
+
+    def _next(self, node: int) -> int:
+        return self.tour[(self.positions[node] + 1) % len(self.tour)]
+
+    def _previous(self, node: int) -> int:
+        return self.tour[self.positions[node] - 1]
+
+    def _reverse(self, first: int, last: int) -> None:
+        """
+        Reverses the part of the tour from position first to position last, going forward
+        and wrapping around. When costs are symmetric, the rest of the tour is reversed instead
+        if it is shorter, which gives the same cycle.
+        """
+        size = len(self.tour)
+        length = (last - first) % size + 1
+        if self.symmetric and 2 * length > size:
+            first, last, length = (last + 1) % size, (first - 1) % size, size - length
+        for _ in range(length // 2):
+            first_node, last_node = self.tour[first], self.tour[last]
+            self.tour[first], self.tour[last] = last_node, first_node
+            self.positions[last_node], self.positions[first_node] = first, last
+            first, last = (first + 1) % size, (last - 1) % size
+
+    def _two_opt(self, node: int) -> bool:
+        """
+        Applies the first improving 2-opt move that links a node to one of its neighbours:
+        removes two edges and reconnects the tour the other way around.
+        """
+        costs = self.costs
+        for successor in (True, False):
+            other = self._next(node) if successor else self._previous(node)
+            # the costs of the edges in the direction of the tour
+            removed = costs[node][other] if successor else costs[other][node]
+            for neighbour in self.neighbours[node]:
+                if min(costs[node][neighbour], costs[neighbour][node]) >= removed:
+                    # the neighbours are sorted, so no further one can do better
+                    break
+                neighbour_other = self._next(neighbour) if successor else self._previous(neighbour)
+                if neighbour_other == node or neighbour == other:
+                    continue
+                if successor:
+                    # node, other ... neighbour, neighbour_other becomes node, neighbour ... other, neighbour_other
+                    delta = (costs[node][neighbour] + costs[other][neighbour_other]
+                             - removed - costs[neighbour][neighbour_other])
+                    first, last = self.positions[other], self.positions[neighbour]
+                else:
+                    # neighbour_other, neighbour ... other, node becomes neighbour_other, other ... neighbour, node
+                    delta = (costs[neighbour][node] + costs[neighbour_other][other]
+                             - removed - costs[neighbour_other][neighbour])
+                    first, last = self.positions[neighbour], self.positions[other]
+                if not self.symmetric:
+                    delta += self._reversal_change(first, last)
+                if delta < -1e-9:
+                    self._reverse(first, last)
+                    return True
+        return False
+
+    def _reversal_change(self, first: int, last: int) -> float:
+        """
+        Returns by how much reversing the part of the tour from position first to position last
+        changes the cost of the edges inside it, which only happens when costs depend on the direction.
+        """
+        costs, tour = self.costs, self.tour
+        change = 0.0
+        position = first
+        while position != last:
+            following = (position + 1) % len(tour)
+            change += costs[tour[following]][tour[position]] - costs[tour[position]][tour[following]]
+            position = following
+        return change
+
+    def _or_opt(self, node: int, max_length: int = 3) -> bool:
+        """
+        Applies the first improving Or-opt move of a segment starting at a node: moves the
+        segment next to a neighbour of one of its ends, reversed if that is cheaper and costs are symmetric.
+        """
+        costs = self.costs
+        size = len(self.tour)
+        for length in range(1, min(max_length, size - 3) + 1):
+            start = self.positions[node]
+            segment = [self.tour[(start + offset) % size] for offset in range(length)]
+            first, last = segment[0], segment[-1]
+            before, after = self._previous(first), self._next(last)
+            removed = costs[before][first] + costs[last][after] - costs[before][after]
+            # the segment either follows a neighbour of its first node, or precedes a neighbour of its last one
+            for follows, (end, other_end) in ((True, (first, last)), (False, (last, first))):
+                for neighbour in self.neighbours[end]:
+                    if min(costs[end][neighbour], costs[neighbour][end]) >= removed:
+                        break
+                    if neighbour in segment:
+                        continue
+                    # insert the segment between neighbour and the node next to it on either side,
+                    # with end next to neighbour
+                    for neighbour_other in (self._next(neighbour), self._previous(neighbour)):
+                        if neighbour_other in segment:
+                            continue
+                        if self.symmetric:
+                            added = costs[neighbour][end] + costs[other_end][neighbour_other] - costs[neighbour][neighbour_other]
+                        elif (neighbour_other == self._next(neighbour)) == follows:
+                            # the segment goes from first to last between the two nodes
+                            previous, following = (neighbour, neighbour_other) if follows else (neighbour_other, neighbour)
+                            added = costs[previous][first] + costs[last][following] - costs[previous][following]
+                        else:
+                            continue
+                        if added - removed < -1e-9:
+                            self._move(segment, end, neighbour, neighbour_other)
+                            return True
+        return False
+
+    def _move(self, segment: list[int], end: int, neighbour: int, neighbour_other: int) -> None:
+        """
+        Moves a segment of the tour between two adjacent nodes, with end next to neighbour.
+        """
+        moved = segment if end == segment[0] else segment[::-1]
+        in_segment = set(segment)
+        rest = [node for node in self.tour if node not in in_segment]
+        position = rest.index(neighbour)
+        if rest[(position + 1) % len(rest)] == neighbour_other:
+            # neighbour comes first: the segment follows it starting with end
+            self.tour = rest[:position + 1] + moved + rest[position + 1:]
+        else:
+            # neighbour comes second: the segment precedes it ending with end
+            self.tour = rest[:position] + moved[::-1] + rest[position:]
+        for position, node in enumerate(self.tour):
+            self.positions[node] = position
+
+    def optimize(self, time_budget: float | None = None) -> list[int]:
+        """
+        Applies improving moves until there are none left or the time budget is spent.
+        Nodes whose surroundings have not changed since they were last tried are skipped.
+
+        :param time_budget: the maximum time to spend, in seconds, or None for no limit.
+        :return: the improved order of the nodes.
+        """
+        deadline = time.perf_counter() + time_budget if time_budget is not None else None
+        queue = deque(self.tour)
+        queued = set(queue)
+        while queue:
+            if deadline is not None and time.perf_counter() > deadline:
+                break
+            node = queue.popleft()
+            queued.discard(node)
+            before = (self._previous(node), self._next(node))
+            if self._two_opt(node) or self._or_opt(node):
+                self.moves += 1
+                # the nodes around the changed edges may now have improving moves
+                for changed in (node, *before, self._previous(node), self._next(node)):
+                    if changed not in queued:
+                        queue.append(changed)
+                        queued.add(changed)
+                        for around in (self._previous(changed), self._next(changed)):
+                            if around not in queued:
+                                queue.append(around)
+                                queued.add(around)
+        return self.tour
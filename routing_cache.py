@@ -0,0 +1,113 @@
+"""
+@file routing_cache.py
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from vehicles import Vehicle, DiplomacyDonutDinghy, TeleportingTarteTrolley
+from routing_graphs import RoutingGraph, DinghyGraph, TrolleyGraph, RuleGraph
+from rule_vehicles import RuleVehicle
+import instrumentation
+
+class RoutingGraphCache():
+    """
+    Keeps the routing graphs of recently used vehicles, so that queries with the same vehicle
+    (or another one with the same parameters) reuse the edges generated by earlier queries.
+
+    Graphs are keyed on Vehicle.cache_key. The least recently used graphs are evicted when
+    there are more than max_graphs of them, or when together they use more than max_bytes.
+    Graphs notice by themselves when cities or countries change and drop what is stale.
+    """
+
+    def __init__(self, max_graphs: int = 8, max_bytes: int = 256 * 1024 * 1024) -> None:
+        """
+        Creates an empty cache.
+
+        :param max_graphs: the maximum number of graphs to keep.
+        :param max_bytes: the maximum memory the graphs may use together, in bytes.
+        :return: None
+        """
+        self.max_graphs = max_graphs
+        self.max_bytes = max_bytes
+        self._graphs = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        """
+        Returns the number of graphs in the cache.
+        """
+        return len(self._graphs)
+
+    def get(self, vehicle: Vehicle) -> RoutingGraph | None:
+        """
+        Returns the routing graph of a vehicle, building it if it is not in the cache.
+
+        :param vehicle: the vehicle.
+        :return: the graph, or None if the vehicle has no routing graph.
+        """
+        key = vehicle.cache_key()
+        graph = self._graphs.get(key)
+        if graph is not None:
+            self.hits += 1
+            instrumentation.count("graph_cache_hits")
+            self._graphs.move_to_end(key)
+        else:
+            with instrumentation.phase("graph_construction"):
+                graph = create_routing_graph(vehicle)
+            if graph is None:
+                return None
+            self.misses += 1
+            instrumentation.count("graph_cache_misses")
+            self._graphs[key] = graph
+        self._evict()
+        return graph
+
+    def nbytes(self) -> int:
+        """
+        Returns an estimate of the memory used by the cached graphs, in bytes.
+
+        :return: the number of bytes.
+        """
+        return sum(graph.nbytes() for graph in self._graphs.values())
+
+    def clear(self) -> None:
+        """
+        Removes all graphs from the cache.
+
+        :return: None
+        """
+        self._graphs.clear()
+
+    def _evict(self) -> None:
+        """
+        Removes the least recently used graphs until the cache fits its limits.
+        The most recently used graph is never removed, but forgets its edges if it alone is too big.
+        """
+        while len(self._graphs) > self.max_graphs:
+            self._graphs.popitem(last=False)
+        while len(self._graphs) > 1 and self.nbytes() > self.max_bytes:
+            self._graphs.popitem(last=False)
+        if self._graphs and self.nbytes() > self.max_bytes:
+            next(reversed(self._graphs.values())).clear_edges()
+
+
+def create_routing_graph(vehicle: Vehicle) -> RoutingGraph | None:
+    """
+    Returns a new routing graph for a vehicle, or None if routing that vehicle needs no graph.
+
+    :param vehicle: the vehicle.
+    :return: the graph, or None.
+    """
+    match vehicle:
+        case DiplomacyDonutDinghy():
+            return DinghyGraph(vehicle)
+        case TeleportingTarteTrolley():
+            return TrolleyGraph(vehicle)
+        case RuleVehicle():
+            # vehicles described by rules are compiled into their graph
+            return RuleGraph(vehicle)
+    return None
+
+
+# the cache used by find_shortest_path
+routing_graph_cache = RoutingGraphCache()
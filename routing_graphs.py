@@ -0,0 +1,439 @@
+"""
+@file routing_graphs.py
+"""
+from __future__ import annotations
+from abc import ABC, abstractmethod
+from typing import TYPE_CHECKING
+import math
+import numpy as np
+from city import City
+from country import Country
+from graph_search import a_star_search, dijkstra_search, path_to
+from spatial_index import SpatialIndex
+from vehicles import DiplomacyDonutDinghy, TeleportingTarteTrolley
+from rule_vehicles import RuleVehicle, TravelRule
+from primary_backbone import PrimaryBackbone
+import instrumentation
+
+if TYPE_CHECKING:
+    from dinghy_index import DinghyIndex
+
+class RoutingGraph(ABC):
+    """
+    The graph of the direct trips a vehicle can make between cities, whose edges
+    are generated from the vehicle's rules only when a search reaches a city.
+    The edges of each city are kept once generated, so a graph gets faster as it is reused.
+
+    Nodes are the indices of the cities in City.distance_engine.
+    """
+
+    # whether travel times are the same in both directions, so that paths can be searched backwards
+    undirected = True
+
+    def __init__(self) -> None:
+        """
+        Creates a graph with no edges generated yet.
+
+        :return: None
+        """
+        # associates a node to the (indices, hours) arrays returned by neighbours
+        self._edges = {}
+        self._edges_nbytes = 0
+        self._versions = (City.registry_version, Country.registry_version)
+
+    def refresh(self) -> None:
+        """
+        Drops what was derived from cities or countries that changed since it was computed.
+
+        :return: None
+        """
+        versions = (City.registry_version, Country.registry_version)
+        if versions != self._versions:
+            self._versions = versions
+            self.clear_edges()
+            self.registries_changed()
+
+    def registries_changed(self) -> None:
+        """
+        Called when cities or countries have changed since the graph last checked.
+        Subclasses drop or patch the data they derived from them.
+
+        :return: None
+        """
+        pass
+
+    def clear_edges(self) -> None:
+        """
+        Forgets the edges generated so far, to free memory.
+
+        :return: None
+        """
+        self._edges.clear()
+        self._edges_nbytes = 0
+
+    def nbytes(self) -> int:
+        """
+        Returns an estimate of the memory used by the graph, in bytes.
+
+        :return: the number of bytes.
+        """
+        return self._edges_nbytes
+
+    def edges(self, node: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the same as neighbours, generating the edges of a city only once.
+
+        :param node: the index of the departure city.
+        :return: a tuple (indices, hours) of two arrays.
+        """
+        edges = self._edges.get(node)
+        if edges is None:
+            with instrumentation.phase("edge_weighting"):
+                edges = self._edges[node] = self.neighbours(node)
+            self._edges_nbytes += edges[0].nbytes + edges[1].nbytes
+            instrumentation.count("edges_built", len(edges[0]))
+        elif instrumentation.active is not None:
+            instrumentation.active.count("edge_cache_hits")
+        return edges
+
+    @abstractmethod
+    def neighbours(self, node: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the cities that can be reached directly from a city, and the travel time to each.
+
+        :param node: the index of the departure city.
+        :return: a tuple (indices, hours) of two arrays.
+        """
+        pass
+
+    @abstractmethod
+    def lower_bounds(self, nodes: np.ndarray, target: int) -> np.ndarray:
+        """
+        Returns, for each of the given cities, a travel time to the target city that
+        no itinerary can beat. Used as the A* heuristic.
+
+        :param nodes: the indices of the cities.
+        :param target: the index of the arrival city.
+        :return: an array of hours, one per city.
+        """
+        pass
+
+    def shortest_path(self, from_city: City, to_city: City) -> list[City] | None:
+        """
+        Returns the cities of a fastest itinerary between two cities, or None if there is none.
+
+        :param from_city: The departure city.
+        :param to_city: The arrival city.
+        :return: the list of cities from departure to arrival, or None.
+        """
+        return self.search_path(from_city, to_city)
+
+    def search_path(self, from_city: City, to_city: City) -> list[City] | None:
+        """
+        Returns the cities of a fastest itinerary between two cities, or None if there is none,
+        found with an A* search over the edges of the graph. Graphs that answer shortest_path
+        otherwise still have it, to check their answers against.
+
+        :param from_city: The departure city.
+        :param to_city: The arrival city.
+        :return: the list of cities from departure to arrival, or None.
+        """
+        self.refresh()
+        result = a_star_search(from_city.index, to_city.index, len(City.distance_engine),
+                               self.edges, lambda nodes: self.lower_bounds(nodes, to_city.index))
+        if result is None:
+            return None
+        return [City.index_to_cities[node] for node in result[0]]
+
+    def shortest_paths(self, from_city: City, to_cities: list[City]) -> dict[City, list[City] | None]:
+        """
+        Returns the cities of fastest itineraries from one city to many others, found with
+        a single search.
+
+        :param from_city: The departure city.
+        :param to_cities: The arrival cities.
+        :return: a dict that associates each arrival city to the list of cities from departure
+                 to arrival, or to None if it cannot be reached.
+        """
+        self.refresh()
+        costs, parents = dijkstra_search(from_city.index, [city.index for city in to_cities],
+                                         len(City.distance_engine), self.edges)
+        return {to_city: [City.index_to_cities[node] for node in path_to(parents, from_city.index, to_city.index)]
+                         if costs[to_city.index] != math.inf else None
+                for to_city in to_cities}
+
+
+class DinghyGraph(RoutingGraph):
+    """
+    The routing graph of a DiplomacyDonutDinghy: every city is linked to the other cities
+    of its country, and every primary city to every other primary city.
+
+    Queries are answered with a PrimaryBackbone, or a DinghyIndex if one is used, rather than
+    by searching the graph. search_path still searches its edges, which is how the backbone
+    and the index are checked.
+    """
+
+    def __init__(self, vehicle: DiplomacyDonutDinghy) -> None:
+        """
+        Creates the routing graph of a vehicle.
+
+        :param vehicle: the vehicle.
+        :return: None
+        """
+        super().__init__()
+        self.vehicle = vehicle
+        # the fastest speed the vehicle can ever travel at, for lower bounds
+        self.max_speed = max(vehicle.in_country_speed, vehicle.between_primary_speed)
+        # associates a country to the indices of its cities and the version of the country
+        # they were taken from
+        self._countries = {}
+        self._primaries = None
+        # a precomputed DinghyIndex of the vehicle, used instead of searching when set
+        self.index = None
+        # the fastest trips between all primary cities, computed on the first query
+        self._backbone = None
+
+    def use_index(self, index: DinghyIndex) -> None:
+        """
+        Answers the queries with a precomputed index rather than by searching the graph,
+        as long as the cities and countries do not change.
+
+        :param index: an index built for a vehicle with the same speeds.
+        :return: None
+        :raise ValueError: if the index is for other speeds or other cities.
+        """
+        if not index.matches(self.vehicle):
+            raise ValueError(f"{index} is not an index of {self.vehicle}")
+        if not index.is_current():
+            raise ValueError(f"{index} was not built from the cities and countries loaded")
+        self.index = index
+
+    def registries_changed(self) -> None:
+        # only the countries that gained cities need their arrays rebuilt
+        self._countries = {country: arrays for country, arrays in self._countries.items()
+                           if arrays[1] == country.version}
+        self._primaries = None
+        self._backbone = None
+        if self.index is not None and not self.index.is_current():
+            self.index = None
+
+    def nbytes(self) -> int:
+        country_nbytes = sum(indices.nbytes for indices, _ in self._countries.values())
+        primary_nbytes = self._primaries[0].nbytes if self._primaries is not None else 0
+        backbone_nbytes = self._backbone.nbytes() if self._backbone is not None else 0
+        return super().nbytes() + country_nbytes + primary_nbytes + backbone_nbytes
+
+    def backbone(self) -> PrimaryBackbone:
+        """
+        Returns the fastest trips of the vehicle between all primary cities, computing them
+        the first time and again once cities or countries have changed.
+
+        :return: the backbone.
+        """
+        self.refresh()
+        if self._backbone is None:
+            with instrumentation.phase("backbone_construction"):
+                self._backbone = PrimaryBackbone(self.vehicle)
+        return self._backbone
+
+    def _country_cities(self, country: Country) -> np.ndarray:
+        """
+        Returns the indices of the cities of a country.
+        """
+        if country not in self._countries:
+            indices = np.array(list(dict.fromkeys(city.index for city in country.cities)), dtype=np.intp)
+            self._countries[country] = (indices, country.version)
+        return self._countries[country][0]
+
+    def _primary_cities(self) -> tuple[np.ndarray, list[Country]]:
+        """
+        Returns the indices of all primary cities, and the country of each.
+        """
+        if self._primaries is None:
+            # the primary cities of each country are kept apart by the country, and the few without
+            # a country are found in the table
+            table = City.table
+            without_country = np.flatnonzero((table.column("country_index") == -1)
+                                             & (table.column("type_code") == table.code_of_type("primary")))
+            indices = np.unique(np.concatenate([[city.index for country in Country.index_to_countries
+                                                 for city in country.get_cities(["primary"])], without_country]).astype(np.intp))
+            self._primaries = (indices, [City.index_to_cities[index].country for index in indices.tolist()])
+        return self._primaries
+
+    def neighbours(self, node: int) -> tuple[np.ndarray, np.ndarray]:
+        city = City.index_to_cities[node]
+        candidates = []
+
+        if city.country is not None:
+            # cities of the same country
+            indices = self._country_cities(city.country)
+            candidates.append(indices[indices != node])
+
+        if city.city_type == "primary":
+            # primary cities of other countries, and the primary cities without a country
+            indices, countries = self._primary_cities()
+            abroad = np.fromiter((country is None or country is not city.country for country in countries),
+                                 dtype=bool, count=len(countries))
+            candidates.append(indices[abroad & (indices != node)])
+
+        if not candidates:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        indices = np.concatenate(candidates)
+        # the vehicle's own rules give the travel time to each of them
+        return indices, self.vehicle.compute_travel_time_many(node, indices)
+
+    def lower_bounds(self, nodes: np.ndarray, target: int) -> np.ndarray:
+        # no leg can be faster than the fastest speed over the straight-line distance
+        return City.distance_engine.kilometers(nodes, target) / self.max_speed
+
+    def shortest_path(self, from_city: City, to_city: City) -> list[City] | None:
+        self.refresh()
+        if self.index is not None and self.index.indexes(from_city) and self.index.indexes(to_city):
+            return self.index.shortest_path(from_city, to_city)
+        # rather than searching the graph, combine the trips to and from the primary cities
+        # of the two countries with the precomputed trips between primary cities
+        return self.backbone().shortest_path(from_city, to_city)
+
+    def shortest_paths(self, from_city: City, to_cities: list[City]) -> dict[City, list[City] | None]:
+        self.refresh()
+        if self.index is not None and self.index.indexes(from_city) and all(map(self.index.indexes, to_cities)):
+            return {to_city: self.index.shortest_path(from_city, to_city) for to_city in to_cities}
+        backbone = self.backbone()
+        return {to_city: backbone.shortest_path(from_city, to_city) for to_city in to_cities}
+
+
+class TrolleyGraph(RoutingGraph):
+    """
+    The routing graph of a TeleportingTarteTrolley: every city is linked to the cities
+    closer than the vehicle's maximum distance, found with a spatial index.
+    """
+
+    def __init__(self, vehicle: TeleportingTarteTrolley) -> None:
+        """
+        Creates the routing graph of a vehicle.
+
+        :param vehicle: the vehicle.
+        :return: None
+        """
+        super().__init__()
+        self.vehicle = vehicle
+        # distances are integers, so being less than max_distance means being at most this radius
+        self.radius = math.ceil(vehicle.max_distance) - 1
+        self._spatial_index = None
+
+    def registries_changed(self) -> None:
+        self._spatial_index = None
+
+    def nbytes(self) -> int:
+        index_nbytes = self._spatial_index.nbytes() if self._spatial_index is not None else 0
+        return super().nbytes() + index_nbytes
+
+    @property
+    def spatial_index(self) -> SpatialIndex:
+        """
+        The spatial index of all cities, built on first use.
+        """
+        if self._spatial_index is None:
+            with instrumentation.phase("spatial_index_construction"):
+                indices = [city.index for city in City.id_to_cities.values()]
+                self._spatial_index = SpatialIndex(City.distance_engine, indices, self.radius)
+        return self._spatial_index
+
+    def neighbours(self, node: int) -> tuple[np.ndarray, np.ndarray]:
+        indices, _ = self.spatial_index.within(node, self.radius)
+        return indices, np.full(len(indices), float(self.vehicle.travel_time))
+
+    def lower_bounds(self, nodes: np.ndarray, target: int) -> np.ndarray:
+        # each hop covers less than max_distance, so at least this many hops are needed
+        hops = np.ceil(City.distance_engine.kilometers(nodes, target) / self.vehicle.max_distance - 1e-9)
+        return np.maximum(hops, 0) * self.vehicle.travel_time
+
+
+class RuleGraph(RoutingGraph):
+    """
+    The routing graph of a RuleVehicle, compiled from its rules: the cities each rule can
+    reach from a city are found with the cheapest index that covers them (a spatial index
+    for rules with a maximum distance, the cities of the country for same-country rules,
+    the cities of some types for rules on arrival types), and the vehicle's batched
+    compute_travel_time_many gives the travel times.
+    """
+
+    def __init__(self, vehicle: RuleVehicle) -> None:
+        """
+        Creates the routing graph of a vehicle.
+
+        :param vehicle: the vehicle.
+        :return: None
+        """
+        super().__init__()
+        self.vehicle = vehicle
+        self.undirected = vehicle.symmetric
+        # no trip can be faster than this, for lower bounds
+        self.hours_per_km = min((rule.lowest_hours_per_km() for rule in vehicle.rules), default=0.0)
+        self.registries_changed()
+
+    def registries_changed(self) -> None:
+        self._cities = None
+        # candidates shared by the rules, by country index, by types, and by radius
+        self._countries = {}
+        self._types = {}
+        self._spatial_indices = {}
+
+    def nbytes(self) -> int:
+        arrays = [self._cities] if self._cities is not None else []
+        arrays += list(self._countries.values()) + list(self._types.values())
+        index_nbytes = sum(index.nbytes() for index in self._spatial_indices.values())
+        return super().nbytes() + sum(array.nbytes for array in arrays) + index_nbytes
+
+    def _all_cities(self) -> np.ndarray:
+        """
+        Returns the indices of all cities.
+        """
+        if self._cities is None:
+            self._cities = np.array([city.index for city in City.id_to_cities.values()], dtype=np.intp)
+        return self._cities
+
+    def _candidates(self, rule: TravelRule, node: int) -> np.ndarray:
+        """
+        Returns the indices of cities that include every city a rule can reach from a city.
+        """
+        table = City.table
+        if rule.max_distance != math.inf:
+            # distances are integers, so being less than max_distance means being at most this radius
+            radius = math.ceil(rule.max_distance) - 1
+            if radius < 0:
+                return np.empty(0, dtype=np.intp)
+            if radius not in self._spatial_indices:
+                self._spatial_indices[radius] = SpatialIndex(City.distance_engine, self._all_cities(), radius)
+            return self._spatial_indices[radius].within(node, radius)[0]
+        if rule.same_country:
+            country_index = int(table.country_index[node])
+            if country_index < 0:
+                # a city without a country is in no country
+                return np.empty(0, dtype=np.intp)
+            if country_index not in self._countries:
+                cities = self._all_cities()
+                self._countries[country_index] = cities[table.country_index[cities] == country_index]
+            return self._countries[country_index]
+        if rule.arrival_types is not None:
+            if rule.arrival_types not in self._types:
+                cities = self._all_cities()
+                self._types[rule.arrival_types] = cities[np.isin(table.type_code[cities], rule.type_codes(rule.arrival_types))]
+            return self._types[rule.arrival_types]
+        return self._all_cities()
+
+    def neighbours(self, node: int) -> tuple[np.ndarray, np.ndarray]:
+        city_type = City.index_to_cities[node].city_type
+        candidates = [self._candidates(rule, node) for rule in self.vehicle.rules
+                      if rule.departure_types is None or city_type in rule.departure_types]
+        if not candidates:
+            return np.empty(0, dtype=np.intp), np.empty(0)
+        indices = np.unique(np.concatenate(candidates)) if len(candidates) > 1 else candidates[0]
+        indices = indices[indices != node]
+        hours = self.vehicle.compute_travel_time_many(node, indices)
+        possible = hours != math.inf
+        return indices[possible], hours[possible]
+
+    def lower_bounds(self, nodes: np.ndarray, target: int) -> np.ndarray:
+        # no trip is faster than the fastest rate of the rules over the straight-line distance
+        return City.distance_engine.kilometers(nodes, target) * self.hours_per_km
@@ -0,0 +1,439 @@
+"""
+@file routing_service.py
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import json
+import math
+import multiprocessing
+import os
+import signal
+import time
+from typing import Awaitable, Callable
+from urllib.parse import urlsplit, parse_qs
+from city import get_city_by_id
+from vehicles import Vehicle, create_example_vehicles
+from csv_parsing import load_cities_countries
+from path_finding import find_shortest_path, find_shortest_paths
+
+class ServiceError(Exception):
+    """
+    An error in a request, answered with an HTTP status and a message instead of a result.
+    """
+
+    def __init__(self, status: int, message: str) -> None:
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+class ResultCache():
+    """
+    Remembers the results of requests for ttl seconds, keeping at most max_entries of them:
+    the least recently used are evicted first.
+    """
+
+    def __init__(self, ttl: float = 60.0, max_entries: int = 10_000) -> None:
+        """
+        :param ttl: the number of seconds a result is kept.
+        :param max_entries: the maximum number of results to keep.
+        :return: None
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._results)
+
+    def get(self, key: tuple) -> dict | None:
+        """
+        Returns the result of a request if it is in the cache and has not expired, None otherwise.
+        """
+        entry = self._results.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._results[key]
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._results.move_to_end(key)
+        return entry[1]
+
+    def put(self, key: tuple, result: dict) -> None:
+        """
+        Stores the result of a request, evicting the least recently used result if the cache is full.
+        """
+        self._results[key] = (time.monotonic() + self.ttl, result)
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_entries:
+            self._results.popitem(last=False)
+
+
+# Functions run by the worker processes, which load the dataset once and then receive city IDs
+
+def _load_dataset(path_to_csv: str) -> None:
+    """
+    Initializer of the worker processes: loads the cities and countries once per worker.
+
+    :param path_to_csv: The path to the CSV file.
+    :return: None
+    """
+    load_cities_countries(path_to_csv)
+
+def _hours(hours: float) -> float | None:
+    """
+    Returns a travel time as it is written in JSON, None when the travel is not possible.
+    """
+    return None if math.isinf(hours) else hours
+
+def _route(vehicle: Vehicle, from_id: int, to_id: int) -> dict:
+    """
+    Finds a shortest path between two cities.
+
+    :return: the IDs of the cities of the path and its travel time in hours, both None if there is no path.
+    """
+    itinerary = find_shortest_path(vehicle, get_city_by_id(from_id), get_city_by_id(to_id))
+    if itinerary is None:
+        return {"path": None, "hours": None}
+    return {"path": [city.city_id for city in itinerary.cities], "hours": _hours(vehicle.compute_itinerary_time(itinerary))}
+
+def _matrix(vehicle: Vehicle, origin_ids: list[int], destination_ids: list[int]) -> dict:
+    """
+    Finds the travel times of shortest paths between every origin and every destination.
+
+    :return: the matrix of travel times in hours, None where there is no path.
+    """
+    _, times = find_shortest_paths(vehicle, [get_city_by_id(city_id) for city_id in origin_ids],
+                                   [get_city_by_id(city_id) for city_id in destination_ids])
+    return {"hours": [[_hours(hours) for hours in row] for row in times.tolist()]}
+
+
+class RoutingService():
+    """
+    A local HTTP/JSON service answering routing requests on a dataset loaded once:
+
+    - GET /route?vehicle=1&from=<city ID>&to=<city ID>: a shortest path and its travel time,
+    - GET /distance?from=<city ID>&to=<city ID>: the distance between two cities in km,
+    - POST /matrix with {"vehicle": 1, "origins": [IDs], "destinations": [IDs]}: travel times
+      between every origin and every destination,
+    - GET /stats: counters of the service.
+
+    Vehicles are the example vehicles, given by their number (as in onboard_navigation) or
+    class name. Searches run in a pool of worker processes, identical requests arriving while
+    one is being computed share its result, and results are cached for a while.
+    Without worker processes, searches run one at a time in a thread of this process, as the
+    routing graphs and caches they share are not safe to use from several threads.
+    """
+
+    def __init__(self, path_to_csv: str, workers: int | None = None, ttl: float = 60.0,
+                 max_cached: int = 10_000, max_matrix_size: int = 10_000, max_body_size: int = 1024 * 1024,
+                 max_header_size: int = 16 * 1024, max_headers: int = 100) -> None:
+        """
+        :param path_to_csv: The path to the CSV file of cities.
+        :param workers: the number of worker processes, by default the number of CPUs,
+                        or 0 to compute in a thread of this process.
+        :param ttl: the number of seconds results are cached.
+        :param max_cached: the maximum number of results to cache.
+        :param max_matrix_size: the maximum number of pairs of cities of a matrix request.
+        :param max_body_size: the maximum size of the body of a request, in bytes.
+        :param max_header_size: the maximum size of the request line and headers of a request, in bytes.
+        :param max_headers: the maximum number of headers of a request.
+        :return: None
+        """
+        self.path_to_csv = path_to_csv
+        self.workers = workers if workers is not None else os.cpu_count() or 1
+        self.max_matrix_size = max_matrix_size
+        self.max_body_size = max_body_size
+        self.max_header_size = max_header_size
+        self.max_headers = max_headers
+        self.cache = ResultCache(ttl, max_cached)
+        self.vehicles = {}
+        for number, vehicle in enumerate(create_example_vehicles(), start=1):
+            self.vehicles[str(number)] = self.vehicles[type(vehicle).__name__.lower()] = vehicle
+        # the computations in progress, by request
+        self._pending = {}
+        self._executor = None
+        self.requests = 0
+        self.computations = 0
+        self.coalesced = 0
+
+    def start_workers(self) -> None:
+        """
+        Loads the dataset in this process, where it is needed to check requests, and starts the worker processes.
+
+        :return: None
+        """
+        print(load_cities_countries(self.path_to_csv))
+        if self.workers > 0:
+            # workers are started fresh rather than forked, so that they load the dataset into empty registries
+            self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                                 initializer=_load_dataset, initargs=(self.path_to_csv,))
+            # start all the workers now rather than on the first requests
+            for future in [self._executor.submit(time.sleep, 0) for _ in range(self.workers)]:
+                future.result()
+        else:
+            self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def shutdown(self) -> None:
+        """
+        Stops the worker processes, or the thread computing without them.
+
+        :return: None
+        """
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    async def _compute(self, key: tuple, function: Callable, *args) -> dict:
+        """
+        Returns the result of a request: from the cache, from an identical request being
+        computed, or by computing it in a worker (or in the thread computing without them).
+
+        :param key: what identifies the request.
+        :param function: the function computing the result, run in a worker.
+        :param args: the arguments of the function.
+        :return: the result.
+        """
+        result = self.cache.get(key)
+        if result is not None:
+            return result
+        pending = self._pending.get(key)
+        if pending is not None:
+            self.coalesced += 1
+            return await asyncio.shield(pending)
+
+        self.computations += 1
+        pending = self._pending[key] = asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+        # the result is cached even if the requests waiting for it are cancelled
+        pending.add_done_callback(lambda future: self._finish(key, future))
+        return await asyncio.shield(pending)
+
+    def _finish(self, key: tuple, future: asyncio.Future) -> None:
+        """
+        Called when the computation of a request is done: caches its result if it succeeded.
+        """
+        del self._pending[key]
+        if not future.cancelled() and future.exception() is None:
+            self.cache.put(key, future.result())
+
+    def _vehicle(self, name: str | None) -> Vehicle:
+        vehicle = self.vehicles.get((name or "").lower())
+        if vehicle is None:
+            raise ServiceError(400, f"Unknown vehicle: {name}")
+        return vehicle
+
+    @staticmethod
+    def _city_id(value: object) -> int:
+        try:
+            city_id = int(value)
+        except (TypeError, ValueError):
+            raise ServiceError(400, f"Invalid city ID: {value}")
+        if get_city_by_id(city_id) is None:
+            raise ServiceError(404, f"Unknown city ID: {city_id}")
+        return city_id
+
+    async def route(self, query: dict, body: dict) -> dict:
+        vehicle = self._vehicle(query.get("vehicle"))
+        from_id, to_id = self._city_id(query.get("from")), self._city_id(query.get("to"))
+        result = await self._compute(("route", vehicle.cache_key(), from_id, to_id), _route, vehicle, from_id, to_id)
+        return {"from": from_id, "to": to_id, "vehicle": str(vehicle), **result}
+
+    async def distance(self, query: dict, body: dict) -> dict:
+        # a single distance is cheaper to compute here than to send to a worker
+        from_id, to_id = self._city_id(query.get("from")), self._city_id(query.get("to"))
+        return {"from": from_id, "to": to_id, "km": get_city_by_id(from_id).distance(get_city_by_id(to_id))}
+
+    async def matrix(self, query: dict, body: dict) -> dict:
+        vehicle = self._vehicle(str(body.get("vehicle", query.get("vehicle", ""))))
+        origins, destinations = body.get("origins"), body.get("destinations")
+        if not isinstance(origins, list) or not isinstance(destinations, list):
+            raise ServiceError(400, "A matrix request needs lists of origins and destinations")
+        if len(origins) * len(destinations) > self.max_matrix_size:
+            raise ServiceError(413, f"A matrix request can have at most {self.max_matrix_size} pairs of cities")
+        origin_ids = [self._city_id(city_id) for city_id in origins]
+        destination_ids = [self._city_id(city_id) for city_id in destinations]
+        result = await self._compute(("matrix", vehicle.cache_key(), tuple(origin_ids), tuple(destination_ids)),
+                                     _matrix, vehicle, origin_ids, destination_ids)
+        return {"origins": origin_ids, "destinations": destination_ids, "vehicle": str(vehicle), **result}
+
+    async def stats(self, query: dict, body: dict) -> dict:
+        return {"requests": self.requests, "computations": self.computations, "coalesced": self.coalesced,
+                "cache_hits": self.cache.hits, "cache_entries": len(self.cache), "workers": self.workers}
+
+    async def handle(self, method: str, target: str, body: bytes) -> tuple[int, dict]:
+        """
+        Answers one request.
+
+        :param method: the HTTP method.
+        :param target: the path and query string of the request.
+        :param body: the body of the request.
+        :return: the HTTP status and the JSON object to answer with.
+        """
+        self.requests += 1
+        url = urlsplit(target)
+        endpoints: dict[str, tuple[tuple[str, ...], Callable[[dict, dict], Awaitable[dict]]]] = {
+            "/route": (("GET",), self.route),
+            "/distance": (("GET",), self.distance),
+            "/matrix": (("GET", "POST"), self.matrix),
+            "/stats": (("GET",), self.stats),
+        }
+        try:
+            if url.path not in endpoints:
+                raise ServiceError(404, f"Unknown endpoint: {url.path}")
+            methods, endpoint = endpoints[url.path]
+            if method not in methods:
+                raise ServiceError(405, f"{url.path} does not accept {method}")
+            query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+            try:
+                json_body = json.loads(body) if body else {}
+            except ValueError:
+                raise ServiceError(400, "The body of the request is not valid JSON")
+            if not isinstance(json_body, dict):
+                raise ServiceError(400, "The body of the request must be a JSON object")
+            return 200, await endpoint(query, json_body)
+        except ServiceError as error:
+            return error.status, {"error": error.message}
+        except Exception as error:
+            return 500, {"error": f"{type(error).__name__}: {error}"}
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Reads requests from a connection and writes their answers, keeping the connection
+        open between requests unless the client asks otherwise.
+        """
+        try:
+            while True:
+                try:
+                    head = await self._read_head(reader)
+                    if head is None:
+                        break
+                    method, target, version, headers = head
+                    length = self._content_length(headers.get("content-length", "0"))
+                except ServiceError as error:
+                    # the rest of the request cannot be skipped, so the connection is closed after the answer
+                    await self._answer(writer, error.status, {"error": error.message}, False)
+                    break
+                body = await reader.readexactly(length)
+
+                status, result = await self.handle(method, target, body)
+                keep_alive = headers.get("connection", "").lower() != "close" and version == "HTTP/1.1"
+                await self._answer(writer, status, result, keep_alive)
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+    async def _read_head(self, reader: asyncio.StreamReader) -> tuple[str, str, str, dict[str, str]] | None:
+        """
+        Reads the request line and the headers of a request.
+
+        :param reader: the stream of the connection.
+        :return: the method, target, HTTP version and headers (by lowercase name) of the request,
+                 or None if the connection is closed or the request line is not valid.
+        :raise ServiceError: if the request line and headers are longer than max_header_size,
+                             or if there are more than max_headers headers.
+        """
+        too_large = ServiceError(431, f"The headers of a request can have at most {self.max_header_size} bytes "
+                                      f"and {self.max_headers} lines")
+        size = 0
+        lines = []
+        while True:
+            try:
+                # a line longer than the limit of the stream raises ValueError
+                line = await reader.readline()
+            except (ValueError, asyncio.LimitOverrunError):
+                raise too_large
+            size += len(line)
+            if size > self.max_header_size or len(lines) > self.max_headers:
+                raise too_large
+            if line in (b"\r\n", b"\n", b""):
+                break
+            lines.append(line.decode("latin-1"))
+        if not lines:
+            return None
+        try:
+            method, target, version = lines[0].split()
+        except ValueError:
+            return None
+        headers = {}
+        for line in lines[1:]:
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        return method, target, version, headers
+
+    def _content_length(self, value: str) -> int:
+        """
+        Returns the length of the body of a request given by its Content-Length header.
+
+        :param value: the value of the header.
+        :return: the number of bytes.
+        :raise ServiceError: if the value is not a number of bytes, or if it is more than max_body_size.
+        """
+        if not (value.isascii() and value.isdigit()):
+            raise ServiceError(400, f"Invalid Content-Length: {value}")
+        length = int(value)
+        if length > self.max_body_size:
+            raise ServiceError(413, f"The body of a request can have at most {self.max_body_size} bytes")
+        return length
+
+    @staticmethod
+    async def _answer(writer: asyncio.StreamWriter, status: int, result: dict, keep_alive: bool) -> None:
+        """
+        Writes the answer to a request.
+        """
+        content = json.dumps(result).encode()
+        writer.write(f"HTTP/1.1 {status} {_REASONS.get(status, '')}\r\n"
+                     f"Content-Type: application/json\r\nContent-Length: {len(content)}\r\n"
+                     f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode() + content)
+        await writer.drain()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 8080) -> None:
+        """
+        Starts the workers and serves requests until cancelled.
+
+        :param host: the address to listen on.
+        :param port: the port to listen on.
+        :return: None
+        """
+        self.start_workers()
+        try:
+            # stop cleanly when terminated, so that the workers are stopped too
+            asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        except NotImplementedError:
+            pass
+        server = await asyncio.start_server(self._serve_connection, host, port)
+        print(f"Serving on http://{host}:{port} with {self.workers} workers", flush=True)
+        try:
+            async with server:
+                await server.serve_forever()
+        except asyncio.CancelledError:
+            pass
+        finally:
+            self.shutdown()
+
+# the reason phrases of the statuses the service answers with
+_REASONS = {200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+            413: "Payload Too Large", 431: "Request Header Fields Too Large", 500: "Internal Server Error"}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HTTP/JSON routing service.")
+    parser.add_argument("--csv", default="worldcities_truncated.csv", help="the CSV file of cities")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--workers", type=int, default=None, help="the number of worker processes, 0 for none")
+    parser.add_argument("--ttl", type=float, default=60.0, help="the number of seconds results are cached")
+    parser.add_argument("--max-body-size", type=int, default=1024 * 1024, help="the maximum size of a request body, in bytes")
+    arguments = parser.parse_args()
+    try:
+        asyncio.run(RoutingService(arguments.csv, arguments.workers, arguments.ttl,
+                                   max_body_size=arguments.max_body_size).serve(arguments.host, arguments.port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,241 @@
+"""
+@file rule_vehicles.py
+"""
+from __future__ import annotations
+import math
+import numpy as np
+from city import City
+from vehicles import Vehicle, CrappyCrepeCar, DiplomacyDonutDinghy, TeleportingTarteTrolley
+
+class TravelRule():
+    """
+    One line of the speed table of a RuleVehicle: when a trip between two cities matches the
+    rule's conditions, the rule gives its travel time, either at a speed or as a fixed time.
+
+    The conditions are all optional: whether the two cities are in the same country,
+    the types of the departure and arrival cities, and a band of distances.
+    """
+
+    def __init__(self, speed: float | None = None, hours: float | None = None, same_country: bool | None = None,
+                 departure_types: list[str] | None = None, arrival_types: list[str] | None = None,
+                 min_distance: float = 0, max_distance: float = math.inf) -> None:
+        """
+        Creates a rule. Exactly one of speed and hours must be given.
+
+        :param speed: the speed in km/h; the travel time is the distance divided by it, rounded up.
+        :param hours: the fixed travel time of a trip, whatever its distance.
+        :param same_country: True if the cities must be in the same country, False if they must not, None for either.
+                             A city without a country is never in the same country as another city.
+        :param departure_types: the types the departure city can have (e.g. ["primary"]), or None for any.
+        :param arrival_types: the types the arrival city can have, or None for any.
+        :param min_distance: the smallest distance (in km) of a matching trip.
+        :param max_distance: the distance (in km) matching trips are shorter than.
+        :return: None
+        """
+        if (speed is None) == (hours is None):
+            raise ValueError("A travel rule needs either a speed or a fixed number of hours")
+        self.speed = speed
+        self.hours = hours
+        self.same_country = same_country
+        self.departure_types = tuple(sorted(set(departure_types))) if departure_types is not None else None
+        self.arrival_types = tuple(sorted(set(arrival_types))) if arrival_types is not None else None
+        self.min_distance = min_distance
+        self.max_distance = max_distance
+
+    def key(self) -> tuple:
+        """
+        Returns the parameters of the rule as a tuple, so that rules can be compared and hashed.
+        """
+        return (self.speed, self.hours, self.same_country, self.departure_types, self.arrival_types,
+                self.min_distance, self.max_distance)
+
+    def __eq__(self, other: object) -> bool:
+        return isinstance(other, TravelRule) and self.key() == other.key()
+
+    def __hash__(self) -> int:
+        return hash(self.key())
+
+    def travel_time(self, departure: City, arrival: City, distance: int) -> float | None:
+        """
+        Returns the travel time the rule gives for a trip, or None if the trip does not match it.
+
+        :param departure: the departure city.
+        :param arrival: the arrival city.
+        :param distance: the distance between the two cities, as returned by City.distance.
+        :return: the travel time in hours, or None.
+        """
+        if not self.min_distance <= distance < self.max_distance:
+            return None
+        if (self.same_country is not None
+                and (departure.country is not None and departure.country == arrival.country) != self.same_country):
+            return None
+        if self.departure_types is not None and departure.city_type not in self.departure_types:
+            return None
+        if self.arrival_types is not None and arrival.city_type not in self.arrival_types:
+            return None
+        return math.ceil(distance / self.speed) if self.speed is not None else self.hours
+
+    def travel_times(self, departure_indices: np.ndarray, arrival_indices: np.ndarray,
+                     distances: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the same as travel_time for many trips at once, given by the indices of their
+        cities in City.table.
+
+        :param departure_indices: the indices of the departure cities.
+        :param arrival_indices: the indices of the arrival cities.
+        :param distances: the distances of the trips, as returned by City.distance_engine.pairwise.
+        :return: a tuple (matches, hours) of two arrays: whether each trip matches the rule,
+                 and its travel time if it does.
+        """
+        table = City.table
+        matches = (self.min_distance <= distances) & (distances < self.max_distance)
+        if self.same_country is not None:
+            departure_countries = table.country_index[departure_indices]
+            same_country = (departure_countries == table.country_index[arrival_indices]) & (departure_countries >= 0)
+            matches &= same_country if self.same_country else ~same_country
+        if self.departure_types is not None:
+            matches &= np.isin(table.type_code[departure_indices], self.type_codes(self.departure_types))
+        if self.arrival_types is not None:
+            matches &= np.isin(table.type_code[arrival_indices], self.type_codes(self.arrival_types))
+        hours = np.ceil(distances / self.speed) if self.speed is not None else np.full(distances.shape, float(self.hours))
+        return matches, hours
+
+    @staticmethod
+    def type_codes(city_types: tuple[str, ...]) -> list[int]:
+        """
+        Returns the codes of some city types in City.table.
+        """
+        return [City.table.code_of_type(city_type) for city_type in city_types]
+
+    def lowest_hours_per_km(self) -> float:
+        """
+        Returns a rate no trip matching the rule can beat, in hours per km, for A* lower bounds.
+        """
+        if self.speed is not None:
+            return 1 / self.speed
+        # a fixed-time hop covers less than max_distance
+        return self.hours / self.max_distance if self.max_distance != math.inf else 0.0
+
+    def __str__(self) -> str:
+        """
+        Returns a description of the rule, for example "same country, primary -> primary: 300 km/h"
+        """
+        conditions = []
+        if self.same_country is not None:
+            conditions.append("same country" if self.same_country else "different countries")
+        if self.departure_types is not None or self.arrival_types is not None:
+            conditions.append(f"{'|'.join(self.departure_types or ['any'])} -> {'|'.join(self.arrival_types or ['any'])}")
+        if self.min_distance > 0 or self.max_distance != math.inf:
+            conditions.append(f"{self.min_distance:g} to {self.max_distance:g} km")
+        time = f"{self.speed:g} km/h" if self.speed is not None else f"{self.hours:g} h"
+        return f"{', '.join(conditions) or 'any trip'}: {time}"
+
+
+class RuleVehicle(Vehicle):
+    """
+    A vehicle described by a table of TravelRules rather than by code.
+
+    The travel time of a trip is the slowest (or, with combine="min", the fastest) of the
+    times given by the rules it matches, and math.inf if it matches none. Routing compiles
+    the rules into a RuleGraph, so new kinds of vehicles are routed without new code.
+    """
+
+    def __init__(self, name: str, rules: list[TravelRule], combine: str = "max") -> None:
+        """
+        Creates a vehicle from its rules.
+
+        :param name: the name of the vehicle, shown by __str__.
+        :param rules: the rules of the vehicle.
+        :param combine: "max" or "min", how the times of several matching rules are combined.
+        :return: None
+        """
+        if combine not in ("max", "min"):
+            raise ValueError(f"Unknown way to combine travel rules: {combine}")
+        self.name = name
+        self.rules = tuple(rules)
+        self.combine = combine
+
+    @property
+    def symmetric(self) -> bool:
+        """
+        Whether travel times are the same in both directions: rules on the types of only
+        one end of a trip make them depend on the direction.
+        """
+        return all(rule.departure_types == rule.arrival_types for rule in self.rules)
+
+    def compute_travel_time(self, departure: City, arrival: City) -> float:
+        """
+        Returns the travel duration of a direct trip from one city
+        to another, in hours, rounded up to an integer.
+        Returns math.inf if the travel is not possible.
+
+        :param departure: the departure city.
+        :param arrival: the arrival city.
+        :return: the travel time in hours, rounded up to an integer,
+                 or math.inf if the travel is not possible.
+        """
+        return self.travel_time_from_distance(departure, arrival, City.distance(departure, arrival))
+
+    def travel_time_from_distance(self, departure: City, arrival: City, distance: int) -> float:
+        times = [time for time in (rule.travel_time(departure, arrival, distance) for rule in self.rules) if time is not None]
+        if not times:
+            return math.inf
+        return max(times) if self.combine == "max" else min(times)
+
+    def compute_travel_time_many(self, departure_indices: np.ndarray, arrival_indices: np.ndarray) -> np.ndarray:
+        departure_indices, arrival_indices = np.asarray(departure_indices), np.asarray(arrival_indices)
+        distances = City.distance_engine.pairwise(departure_indices, arrival_indices)
+        combine = np.maximum if self.combine == "max" else np.minimum
+        result = np.full(distances.shape, -math.inf if self.combine == "max" else math.inf)
+        matched = np.zeros(distances.shape, dtype=bool)
+        for rule in self.rules:
+            matches, hours = rule.travel_times(departure_indices, arrival_indices, distances)
+            result = np.where(matches, combine(result, hours), result)
+            matched |= matches
+        return np.where(matched, result, math.inf)
+
+    def __str__(self) -> str:
+        """
+        Returns the name of the vehicle and its rules in parentheses.
+        For example "Ferry (same country: 40 km/h)"
+
+        :return: the string representation of the vehicle.
+        """
+        return f"{self.name} ({' | '.join(str(rule) for rule in self.rules)})"
+
+
+def as_rule_vehicle(vehicle: Vehicle) -> RuleVehicle:
+    """
+    Returns a RuleVehicle with the same travel times as one of the example vehicles.
+
+    :param vehicle: a CrappyCrepeCar, DiplomacyDonutDinghy or TeleportingTarteTrolley.
+    :return: the equivalent RuleVehicle.
+    """
+    match vehicle:
+        case CrappyCrepeCar():
+            return RuleVehicle("CrappyCrepeCar", [TravelRule(speed=vehicle.speed)])
+        case DiplomacyDonutDinghy():
+            # between two primary cities of the same country both rules match, and the slower wins
+            return RuleVehicle("DiplomacyDonutDinghy", [
+                TravelRule(speed=vehicle.in_country_speed, same_country=True),
+                TravelRule(speed=vehicle.between_primary_speed, departure_types=["primary"], arrival_types=["primary"])])
+        case TeleportingTarteTrolley():
+            return RuleVehicle("TeleportingTarteTrolley", [TravelRule(hours=vehicle.travel_time, max_distance=vehicle.max_distance)])
+    raise ValueError(f"{vehicle} has no equivalent travel rules")
+
+if __name__ == "__main__":
+    from country import create_example_countries
+    from vehicles import create_example_vehicles
+    create_example_countries()
+    melbourne, canberra = City.id_to_cities[1036533631], City.id_to_cities[1036142029]
+
+    # the example vehicles, described by rules, travel exactly as before
+    for vehicle in create_example_vehicles():
+        rule_vehicle = as_rule_vehicle(vehicle)
+        print(f"{rule_vehicle}: {rule_vehicle.compute_travel_time(melbourne, canberra)} hours "
+              f"({vehicle.compute_travel_time(melbourne, canberra)} with {vehicle})")
+
+    # a new kind of vehicle needs no code: slow in the country, with long jumps between capitals
+    ferry = RuleVehicle("Ferry", [TravelRule(speed=40, same_country=True),
+                                  TravelRule(hours=30, departure_types=["primary"], arrival_types=["primary"])], combine="min")
+    print(f"{ferry}: {ferry.compute_travel_time(melbourne, canberra)} hours")
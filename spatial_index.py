@@ -0,0 +1,191 @@
+"""
+@file spatial_index.py
+"""
+from __future__ import annotations
+from typing import Iterator, Sequence
+import itertools
+import math
+import numpy as np
+from distances import DistanceEngine, chord_length
+
+# the number of pairs of points whose distances are evaluated together
+_CHUNK_SIZE = 1 << 18
+
+# the smallest cell side allowed on the unit sphere (about 60 m on the earth),
+# so that cell keys always fit in an int64
+_MIN_CELL_SIZE = 1e-5
+
+class SpatialIndex():
+    """
+    A grid over the unit sphere that finds the points within a given distance of each other
+    without comparing every pair.
+
+    Points are placed on the unit sphere and bucketed into cubic cells whose side is the
+    chord length of cell_km. A radius query only looks at the cells around the query point,
+    so its cost depends on the number of nearby points rather than on the total.
+    """
+
+    def __init__(self, engine: DistanceEngine, indices: Sequence[int] | np.ndarray, cell_km: float) -> None:
+        """
+        Builds the index over some points of a distance engine.
+
+        :param engine: the distance engine holding the coordinates of the points.
+        :param indices: the indices of the points to index.
+        :param cell_km: the size of a cell in kilometers. Queries are cheapest for radii up to this size.
+        :return: None
+        """
+        self.engine = engine
+        # a little slack so that rounding never puts two points within cell_km more than one cell apart
+        self.cell_size = max(chord_length(cell_km) * (1 + 1e-9), _MIN_CELL_SIZE)
+        # cell coordinates are shifted by this much to be non-negative, leaving room for neighbours
+        self._shift = 3 * math.ceil(1 / self.cell_size) + 3
+        self._base = 2 * self._shift + 1
+
+        indices = np.asarray(indices, dtype=np.intp)
+        keys = self._keys(indices)
+        # sort the points by cell so that the points of each cell are contiguous
+        order = np.argsort(keys, kind="stable")
+        self.points = indices[order]
+        keys = keys[order]
+        starts = np.flatnonzero(np.diff(keys)) + 1
+        starts = np.concatenate(([0], starts)) if len(keys) else starts
+        # the sorted keys of the non-empty cells, and where their points start and end in self.points
+        self.cell_keys = keys[starts]
+        self.cell_starts = starts
+        self.cell_ends = np.append(starts[1:], len(keys)).astype(starts.dtype)
+
+    def __len__(self) -> int:
+        """
+        Returns the number of indexed points.
+        """
+        return len(self.points)
+
+    def nbytes(self) -> int:
+        """
+        Returns the memory used by the index arrays, in bytes.
+        """
+        return self.points.nbytes + self.cell_keys.nbytes + self.cell_starts.nbytes + self.cell_ends.nbytes
+
+    def _keys(self, indices: np.ndarray) -> np.ndarray:
+        """
+        Returns the key of the cell of each point, a single int64 that orders cells lexicographically.
+        """
+        cells = np.floor(self.engine.unit_vectors(indices) / self.cell_size).astype(np.int64) + self._shift
+        return (cells[:, 0] * self._base + cells[:, 1]) * self._base + cells[:, 2]
+
+    def _reach(self, radius_km: float) -> int:
+        """
+        Returns how many cells away from a point its neighbours within radius_km can be.
+        """
+        return max(1, math.ceil(chord_length(radius_km) / self.cell_size))
+
+    def _offsets(self, reach: int) -> np.ndarray:
+        """
+        Returns the differences between the key of a cell and the keys of the cells
+        at most reach cells away from it, including itself.
+        """
+        return np.array([(dx * self._base + dy) * self._base + dz
+                         for dx, dy, dz in itertools.product(range(-reach, reach + 1), repeat=3)],
+                        dtype=np.int64)
+
+    def _find_cells(self, keys: np.ndarray) -> np.ndarray:
+        """
+        Returns the position in self.cell_keys of each key, or -1 for the keys of empty cells.
+        """
+        if len(self.cell_keys) == 0:
+            return np.full(len(keys), -1)
+        positions = np.searchsorted(self.cell_keys, keys)
+        positions[positions == len(self.cell_keys)] = 0
+        return np.where(self.cell_keys[positions] == keys, positions, -1)
+
+    def within(self, index: int, radius_km: int) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the indexed points at distance at most radius_km of a point, along with
+        their distances. Distances are rounded up to an integer as with City.distance.
+        The point itself is not part of the result.
+
+        :param index: the index (in the engine) of the point to search around.
+        :param radius_km: the maximum distance in kilometers.
+        :return: a tuple (indices, distances) of two arrays.
+        """
+        reach = self._reach(radius_km)
+        if (2 * reach + 1) ** 3 <= len(self.cell_keys):
+            cells = self._find_cells(self._keys(np.array([index], dtype=np.intp))[0] + self._offsets(reach))
+            cells = cells[cells >= 0].tolist()
+            candidates = (np.concatenate([self.points[self.cell_starts[cell]:self.cell_ends[cell]] for cell in cells])
+                          if cells else np.empty(0, dtype=np.intp))
+        else:
+            # there are fewer non-empty cells than neighbouring cells, so check every point
+            candidates = self.points
+        candidates = candidates[candidates != index]
+        distances = self.engine.one_to_many(index, candidates)
+        close = distances <= radius_km
+        return candidates[close], distances[close]
+
+    def pairs_within(self, radius_km: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns every unordered pair of distinct indexed points at distance at most radius_km
+        of each other, along with their distances (rounded up to an integer).
+        Only pairs of points in neighbouring cells are compared.
+
+        :param radius_km: the maximum distance in kilometers.
+        :return: a tuple (first, second, distances) of three equally long arrays.
+        """
+        reach = self._reach(radius_km)
+        if reach > 1 and (2 * reach + 1) ** 3 > 2 * len(self.cell_keys):
+            # the cells are much smaller than the radius, a grid sized for it is cheaper
+            return SpatialIndex(self.engine, self.points, radius_km).pairs_within(radius_km)
+
+        # pairs of cells to compare: each cell with itself, and with the neighbouring cells
+        # that come after it, so that each pair of cells is visited once
+        cells1, cells2 = [], []
+        for offset in self._offsets(reach).tolist():
+            if offset >= 0:
+                neighbours = self._find_cells(self.cell_keys + offset)
+                found = neighbours >= 0
+                cells1.append(np.flatnonzero(found))
+                cells2.append(neighbours[found])
+
+        firsts, seconds, all_distances = [], [], []
+        for first, second in self._point_pairs(np.concatenate(cells1), np.concatenate(cells2)):
+            distances = self.engine.pairwise(first, second)
+            close = distances <= radius_km
+            firsts.append(first[close])
+            seconds.append(second[close])
+            all_distances.append(distances[close])
+        if not firsts:
+            empty = np.empty(0, dtype=np.intp)
+            return empty, empty, np.empty(0, dtype=np.int64)
+        return np.concatenate(firsts), np.concatenate(seconds), np.concatenate(all_distances)
+
+    def _point_pairs(self, cells1: np.ndarray, cells2: np.ndarray) -> Iterator[tuple[np.ndarray, np.ndarray]]:
+        """
+        Yields the pairs of points of the given pairs of cells, about _CHUNK_SIZE pairs at a time.
+        A cell paired with itself gives the unordered pairs of its distinct points, other pairs
+        of cells give every point of the first cell with every point of the second.
+        """
+        sizes1 = self.cell_ends[cells1] - self.cell_starts[cells1]
+        sizes2 = self.cell_ends[cells2] - self.cell_starts[cells2]
+        # for a cell with itself, all ordered pairs are generated and half of them dropped
+        counts = sizes1 * sizes2
+        cumulative = np.cumsum(counts)
+        start = 0
+        while start < len(counts):
+            # take pairs of cells until there are about _CHUNK_SIZE pairs of points (at least one pair of cells)
+            done = cumulative[start] - counts[start]
+            stop = max(start + 1, int(np.searchsorted(cumulative, done + _CHUNK_SIZE, side="right")))
+            chunk = slice(start, stop)
+            start = stop
+
+            chunk_counts = counts[chunk]
+            total = int(chunk_counts.sum())
+            if total == 0:
+                continue
+            # which pair of cells each pair of points comes from, and its row and column in that block
+            pair = np.repeat(np.arange(len(chunk_counts)), chunk_counts)
+            rank = np.arange(total) - np.repeat(np.cumsum(chunk_counts) - chunk_counts, chunk_counts)
+            width = sizes2[chunk][pair]
+            row, column = rank // width, rank % width
+            keep = (cells1[chunk] != cells2[chunk])[pair] | (row < column)
+            yield (self.points[(self.cell_starts[cells1[chunk]][pair] + row)[keep]],
+                   self.points[(self.cell_starts[cells2[chunk]][pair] + column)[keep]])
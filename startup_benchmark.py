@@ -0,0 +1,108 @@
+"""
+@file startup_benchmark.py
+"""
+from __future__ import annotations
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# the longest time-to-first-prompt allowed, in seconds: from starting onboard_navigation
+# to the vehicle prompt being shown
+STARTUP_BUDGET_SECONDS = 0.25
+
+# what onboard_navigation shows when it is ready for each answer
+VEHICLE_PROMPT = b"Please pick a vehicle: "
+CITY_PROMPT = b"Please enter an origin city: "
+
+def _read_until(process: subprocess.Popen, text: bytes, output: bytearray) -> None:
+    """
+    Reads the output of a process until some text appears in it.
+    """
+    while text not in output:
+        chunk = os.read(process.stdout.fileno(), 65536)
+        if not chunk:
+            raise RuntimeError(f"onboard_navigation stopped before showing {text.decode()!r}: {output.decode()}")
+        output += chunk
+
+def measure_startup(path_to_csv: str) -> tuple[float, float]:
+    """
+    Starts onboard_navigation, answers the vehicle prompt as soon as it appears, and measures
+    how long the prompts take to show.
+
+    :param path_to_csv: The path to the CSV file of cities.
+    :return: the seconds until the vehicle prompt (time-to-first-prompt), and until the city prompt,
+             by which time the cities are loaded.
+    """
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, "-u", "onboard_navigation.py", path_to_csv],
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        output = bytearray()
+        _read_until(process, VEHICLE_PROMPT, output)
+        first_prompt = time.perf_counter() - start
+        process.stdin.write(b"1\n")
+        process.stdin.flush()
+        _read_until(process, CITY_PROMPT, output)
+        city_prompt = time.perf_counter() - start
+    finally:
+        process.kill()
+        process.wait()
+    return first_prompt, city_prompt
+
+def run_benchmark(path_to_csv: str, runs: int = 5) -> dict:
+    """
+    Measures the startup of onboard_navigation several times, both cold (the CSV file is parsed,
+    as on the first start) and warm (the cities are read from the snapshot of the previous start).
+    The CSV file is copied to a temporary directory, so its own snapshot is left alone.
+
+    :param path_to_csv: The path to the CSV file of cities.
+    :param runs: the number of measures of each kind.
+    :return: for "cold" and "warm", the median seconds until the vehicle prompt ("first_prompt")
+             and until the city prompt ("city_prompt"), and the measures ("runs").
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        copy = os.path.join(directory, os.path.basename(path_to_csv))
+        shutil.copyfile(path_to_csv, copy)
+        for kind in ("cold", "warm"):
+            measures = []
+            for _ in range(runs):
+                if kind == "cold":
+                    for name in os.listdir(directory):
+                        if name.endswith(".npz"):
+                            os.remove(os.path.join(directory, name))
+                measures.append(measure_startup(copy))
+            results[kind] = {"first_prompt": statistics.median(first for first, _ in measures),
+                             "city_prompt": statistics.median(city for _, city in measures),
+                             "runs": measures}
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measures how long onboard_navigation takes to show its first prompt.")
+    parser.add_argument("--csv", default="worldcities_truncated.csv", help="the CSV file of cities")
+    parser.add_argument("--runs", type=int, default=5, help="the number of measures of each kind")
+    parser.add_argument("--budget", type=float, default=STARTUP_BUDGET_SECONDS,
+                        help="the longest time-to-first-prompt allowed, in seconds")
+    parser.add_argument("--output", default=None, help="a JSON file to write the results to")
+    arguments = parser.parse_args()
+
+    results = run_benchmark(arguments.csv, arguments.runs)
+    for kind, result in results.items():
+        print(f"{kind}: first prompt {result['first_prompt'] * 1000:.0f} ms, "
+              f"cities loaded {result['city_prompt'] * 1000:.0f} ms (median of {arguments.runs})")
+    worst = max(result["first_prompt"] for result in results.values())
+    within_budget = worst <= arguments.budget
+    print(f"time-to-first-prompt {worst * 1000:.0f} ms, budget {arguments.budget * 1000:.0f} ms: "
+          f"{'OK' if within_budget else 'OVER BUDGET'}")
+    if arguments.output is not None:
+        with open(arguments.output, "w") as output:
+            json.dump({"csv": arguments.csv, "budget": arguments.budget, "within_budget": within_budget, **results},
+                      output, indent=2)
+    sys.exit(0 if within_budget else 1)
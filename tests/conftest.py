@@ -0,0 +1,105 @@
+"""
+@file conftest.py
+"""
+import heapq
+import math
+import os
+import random
+import sys
+import pytest
+
+# the modules of the navigator are at the root of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from city import City
+from city_table import CityTable
+from country import Country
+import city_search
+import primary_backbone
+from routing_cache import routing_graph_cache
+
+def reset_world() -> None:
+    """
+    Forgets every city and country, and the data derived from them, so that each test
+    starts from an empty world.
+    """
+    City.id_to_cities = {}
+    City.name_to_cities = {}
+    City.table = City.distance_engine = CityTable()
+    City.index_to_cities = []
+    City.registry_version += 1
+    Country.name_to_countries = {}
+    Country.index_to_countries = []
+    Country.registry_version += 1
+    routing_graph_cache.clear()
+    primary_backbone._type_indices.clear()
+    city_search._name_index = None
+
+def create_world(seed: int, country_count: int = 6, cities_per_country: int = 20, primaries_per_country: int = 3) -> list[City]:
+    """
+    Creates a random world: countries scattered around the globe, each with a few primary cities
+    and other cities around its centre.
+
+    :param seed: the seed of the random generator.
+    :param country_count: the number of countries.
+    :param cities_per_country: the number of cities of each country, primary ones included.
+    :param primaries_per_country: the number of primary cities of each country.
+    :return: the cities, in the order they were created.
+    """
+    generator = random.Random(seed)
+    cities = []
+    for country_number in range(country_count):
+        country = Country(f"Country{country_number}", f"C{country_number:02d}")
+        latitude, longitude = generator.uniform(-50, 60), generator.uniform(-170, 170)
+        for city_number in range(cities_per_country):
+            city_type = "primary" if city_number < primaries_per_country else generator.choice(["admin", "minor", ""])
+            city = City(f"City{len(cities)}", (latitude + generator.gauss(0, 6), longitude + generator.gauss(0, 8)),
+                        city_type, generator.randint(1000, 1_000_000), 1_000_000 + len(cities))
+            country.add_city(city)
+            cities.append(city)
+    return cities
+
+def reference_travel_time(vehicle, cities: list[City], from_city: City, to_city: City) -> float:
+    """
+    Returns the travel time of a fastest itinerary between two cities, found with Dijkstra's
+    algorithm over every direct trip between the cities, independently of the routing code.
+    """
+    best = {from_city: 0.0}
+    heap = [(0.0, from_city.index, from_city)]
+    done = set()
+    while heap:
+        hours, _, city = heapq.heappop(heap)
+        if city is to_city:
+            return hours
+        if city in done:
+            continue
+        done.add(city)
+        for other in cities:
+            if other is not city and other not in done:
+                total = hours + vehicle.compute_travel_time(city, other)
+                if total < best.get(other, math.inf):
+                    best[other] = total
+                    heapq.heappush(heap, (total, other.index, other))
+    return math.inf
+
+@pytest.fixture
+def world():
+    """
+    Returns the cities of a small random world, created for the test.
+    """
+    reset_world()
+    yield create_world(seed=0)
+    reset_world()
+
+@pytest.fixture
+def gazetteer(tmp_path):
+    """
+    Returns the path of a synthetic CSV file of 500 cities, written for the test, with no
+    cities loaded yet.
+    """
+    from benchmarks import generate_gazetteer
+    reset_world()
+    path = str(tmp_path / "cities.csv")
+    generate_gazetteer(path, 500, seed=3)
+    yield path
+    reset_world()
@@ -0,0 +1,19 @@
+"""
+@file test_basemap_rendering.py
+"""
+import matplotlib
+import pytest
+
+pytest.importorskip("mpl_toolkits.basemap")
+
+def test_rendering_leaves_pyplot_alone(tmp_path):
+    backend = matplotlib.get_backend()
+    import matplotlib.pyplot as plt
+    from basemap_rendering import MapRenderer
+    renderer = MapRenderer("robin")
+    path = tmp_path / "map.png"
+    renderer.render([(-37.8, 145.0), (-33.9, 151.2)], str(path))
+    renderer.close()
+    assert path.stat().st_size > 0
+    assert matplotlib.get_backend() == backend
+    assert plt.get_fignums() == []
@@ -0,0 +1,57 @@
+"""
+@file test_city.py
+"""
+import pytest
+from conftest import reference_travel_time
+from city import City
+from city_search import search_cities
+from path_finding import find_shortest_path
+from primary_backbone import city_type_index
+from travel_time_cache import PairwiseCache
+from vehicles import DiplomacyDonutDinghy
+
+@pytest.mark.parametrize("attribute, value", [("city_type", "admin"), ("population", 12345), ("city_id", 42)])
+def test_setters_invalidate_derived_data(world, attribute, value):
+    city = world[0]
+    version = City.registry_version
+    setattr(city, attribute, value)
+    assert City.registry_version != version
+    # setting the same value again changes nothing
+    version = City.registry_version
+    setattr(city, attribute, value)
+    assert City.registry_version == version
+
+def test_pairwise_cache_forgets_after_mutation(world):
+    cache = PairwiseCache()
+    cache.put(world[0], world[1], 3.0)
+    assert cache.get(world[0], world[1]) == 3.0
+    world[1].population += 1
+    assert cache.get(world[0], world[1]) is None
+
+def test_primary_index_follows_city_type(world):
+    city = next(city for city in world if city.city_type == "primary")
+    assert city.index in city_type_index().indices
+    city.city_type = "admin"
+    assert city.index not in city_type_index().indices
+
+def test_routing_follows_city_type(world):
+    vehicle = DiplomacyDonutDinghy(100, 500)
+    from_city = next(city for city in world if city.city_type != "primary")
+    to_city = next(city for city in world if city.city_type != "primary" and city.country is not from_city.country)
+    find_shortest_path(vehicle, from_city, to_city)
+    # no primary city is left, so no country can be left
+    for city in world:
+        if city.city_type == "primary":
+            city.city_type = "admin"
+    assert find_shortest_path(vehicle, from_city, to_city) is None
+    to_city.city_type = from_city.city_type = "primary"
+    itinerary = find_shortest_path(vehicle, from_city, to_city)
+    assert vehicle.compute_itinerary_time(itinerary) == reference_travel_time(vehicle, world, from_city, to_city)
+
+def test_name_index_follows_population(world):
+    first = world[0]
+    first.population = 10
+    second = City(first.name, (0.0, 0.0), "", 20, 42)
+    assert search_cities(first.name, 2)[0] is second
+    first.population = 30
+    assert search_cities(first.name, 2)[0] is first
@@ -0,0 +1,113 @@
+"""
+@file test_csv_parsing.py
+"""
+import csv
+import os
+import pytest
+from conftest import reset_world
+from city import City
+from country import Country
+from csv_parsing import (RowFilter, create_cities_countries_from_csv, default_snapshot_path, ingest_cities_countries,
+                         load_cities_countries, read_csv_columns, read_snapshot)
+
+def loaded_world() -> tuple[list[tuple], list[tuple[str, list[int]]]]:
+    """
+    Returns what was loaded: every city in the order it was created, and every country in the
+    order it was created with the IDs of its cities in their order in the country.
+    """
+    cities = [(city.city_id, city.name, city.coordinates, city.city_type, city.population, city.country.name)
+              for city in City.index_to_cities]
+    countries = [(country.name, [city.city_id for city in country.cities]) for country in Country.index_to_countries]
+    return cities, countries
+
+def load(function, *args) -> tuple[list[tuple], list[tuple[str, list[int]]]]:
+    """
+    Loads cities into an empty world with a function, and returns what was loaded.
+    """
+    reset_world()
+    function(*args)
+    return loaded_world()
+
+def test_ragged_line_names_its_line(gazetteer, tmp_path):
+    with open(gazetteer) as file:
+        lines = file.readlines()
+    lines[5] = ",".join(lines[5].split(",")[:4]) + "\n"
+    path = tmp_path / "ragged.csv"
+    path.write_text("".join(lines))
+    with pytest.raises(ValueError, match="line 6"):
+        read_csv_columns(str(path))
+    with pytest.raises(ValueError, match="line 6"):
+        ingest_cities_countries(str(path), chunk_size=2)
+
+def test_empty_lines_are_skipped(gazetteer, tmp_path):
+    with open(gazetteer) as file:
+        lines = file.readlines()
+    path = tmp_path / "gaps.csv"
+    path.write_text("".join(lines[:3]) + "\n" + "".join(lines[3:]) + "\n")
+    assert load(create_cities_countries_from_csv, str(path)) == load(create_cities_countries_from_csv, gazetteer)
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 64, 10_000])
+def test_chunked_ingestion_matches_parsing(gazetteer, chunk_size):
+    expected = load(create_cities_countries_from_csv, gazetteer)
+    assert load(ingest_cities_countries, gazetteer, chunk_size) == expected
+
+@pytest.mark.parametrize("chunk_size", [1, 13, 10_000])
+def test_filtered_ingestion_matches_parsing_filtered_lines(gazetteer, tmp_path, chunk_size):
+    row_filter = RowFilter(countries=["Country0", "Country3", "C005"], min_population=5000)
+    with open(gazetteer, newline="") as file:
+        rows = list(csv.reader(file))
+    header = rows[0]
+    country, iso3, population = (header.index(name) for name in ("country", "iso3", "population"))
+    kept = [row for row in rows[1:] if (row[country] in row_filter.countries or row[iso3] in row_filter.countries)
+            and int(row[population]) >= row_filter.min_population]
+    assert 0 < len(kept) < len(rows) - 1
+    filtered_path = str(tmp_path / "filtered.csv")
+    with open(filtered_path, "w", newline="") as file:
+        csv.writer(file).writerows([header] + kept)
+
+    expected = load(create_cities_countries_from_csv, filtered_path)
+    progress = []
+    assert load(ingest_cities_countries, gazetteer, chunk_size, row_filter, progress.append) == expected
+    assert progress[-1].rows_read == len(rows) - 1 and progress[-1].rows_kept == len(kept)
+    assert progress[-1].fraction == 1.0
+
+def test_warm_load_matches_cold_parse(gazetteer):
+    expected = load(create_cities_countries_from_csv, gazetteer)
+    reset_world()
+    assert not load_cities_countries(gazetteer).from_snapshot
+    assert loaded_world() == expected
+    reset_world()
+    report = load_cities_countries(gazetteer)
+    assert report.from_snapshot and report.city_count == len(expected[0])
+    assert loaded_world() == expected
+
+def test_changed_csv_makes_snapshot_stale(gazetteer):
+    load_cities_countries(gazetteer)
+    snapshot_path = default_snapshot_path(gazetteer)
+    # a new modification time alone does not, as the content has the same hash
+    status = os.stat(gazetteer)
+    os.utime(gazetteer, ns=(status.st_atime_ns, status.st_mtime_ns + 10**9))
+    assert read_snapshot(gazetteer, snapshot_path) is not None
+
+    with open(gazetteer) as file:
+        lines = file.readlines()
+    with open(gazetteer, "w") as file:
+        file.writelines(lines[:-1])
+    assert read_snapshot(gazetteer, snapshot_path) is None
+    expected = load(create_cities_countries_from_csv, gazetteer)
+    reset_world()
+    assert not load_cities_countries(gazetteer).from_snapshot
+    assert loaded_world() == expected
+    # the snapshot was written again from the new content
+    assert read_snapshot(gazetteer, snapshot_path) is not None
+
+@pytest.mark.parametrize("content", [b"", b"not a zip file", b"PK\x03\x04 truncated"])
+def test_corrupt_snapshot_falls_back_to_parsing(gazetteer, content):
+    expected = load(create_cities_countries_from_csv, gazetteer)
+    with open(default_snapshot_path(gazetteer), "wb") as file:
+        file.write(content)
+    reset_world()
+    assert not load_cities_countries(gazetteer).from_snapshot
+    assert loaded_world() == expected
+    reset_world()
+    assert load_cities_countries(gazetteer).from_snapshot
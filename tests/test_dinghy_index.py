@@ -0,0 +1,54 @@
+"""
+@file test_dinghy_index.py
+"""
+import random
+import pytest
+from conftest import reference_travel_time
+from dinghy_index import DinghyIndex, build_dinghy_index, verify_dinghy_index
+from primary_backbone import PrimaryBackbone
+from routing_graphs import DinghyGraph
+from vehicles import DiplomacyDonutDinghy
+
+def itinerary_hours(vehicle, cities) -> float:
+    return sum(vehicle.compute_travel_time(*leg) for leg in zip(cities, cities[1:]))
+
+def sample_pairs(world, seed: int) -> list[tuple]:
+    """
+    Returns pairs of primary cities of the same country, where the direct trip may be slow,
+    pairs of cities of the same country, and random pairs.
+    """
+    generator = random.Random(seed)
+    primaries = [city for city in world if city.city_type == "primary"]
+    pairs = [(first, second) for first in primaries for second in primaries
+             if first is not second and first.country is second.country]
+    pairs += [(city, generator.choice(city.country.cities)) for city in generator.sample(world, 20)]
+    return pairs + [tuple(generator.sample(world, 2)) for _ in range(20)]
+
+@pytest.mark.parametrize("speeds", [(100, 500), (300, 200)])
+def test_backbone_and_index_match_reference(world, speeds):
+    vehicle = DiplomacyDonutDinghy(*speeds)
+    backbone, index = PrimaryBackbone(vehicle), build_dinghy_index(vehicle)
+    graph = DinghyGraph(vehicle)
+    for from_city, to_city in sample_pairs(world, speeds[0]):
+        expected = reference_travel_time(vehicle, world, from_city, to_city)
+        for path in (backbone.shortest_path(from_city, to_city), index.shortest_path(from_city, to_city),
+                     graph.search_path(from_city, to_city)):
+            assert path[0] is from_city and path[-1] is to_city
+            assert itinerary_hours(vehicle, path) == expected, f"{from_city} to {to_city}"
+        assert index.travel_time(from_city, to_city) == expected
+
+def test_saved_index_answers_the_same(world, tmp_path):
+    vehicle = DiplomacyDonutDinghy(100, 500)
+    index = build_dinghy_index(vehicle)
+    index.save(str(tmp_path / "index.npz"))
+    loaded = DinghyIndex.load(str(tmp_path / "index.npz"))
+    assert loaded.is_current() and loaded.matches(vehicle)
+    for from_city, to_city in sample_pairs(world, 4):
+        assert loaded.shortest_path(from_city, to_city) == index.shortest_path(from_city, to_city)
+
+def test_verify_dinghy_index(world):
+    index = build_dinghy_index(DiplomacyDonutDinghy(100, 500))
+    assert verify_dinghy_index(index, samples=60) == 0
+    # an index whose hub times are wrong does not pass
+    index.hub_hours[:] = 0.0
+    assert verify_dinghy_index(index, samples=60) > 0
@@ -0,0 +1,45 @@
+"""
+@file test_distances.py
+"""
+import math
+import random
+import numpy as np
+from city import City
+from distances import EARTH_RADIUS_KM
+
+def test_engine_matches_city_distance(world):
+    generator = random.Random(8)
+    cities = list(world)
+    # antipodal points, points on the poles and on both sides of the antimeridian, and identical points
+    for number, (latitude, longitude) in enumerate([(0.0, 0.0), (0.0, 180.0), (-0.0, -180.0), (90.0, 0.0), (-90.0, 45.0),
+                                                    (37.5, -122.25), (-37.5, 57.75), (10.0, 179.9999), (10.0, -179.9999),
+                                                    (37.5, -122.25)]):
+        cities.append(City(f"Point{number}", (latitude, longitude), "", 0, 3_000_000 + number))
+    # points on the equator whose distance from (0, 0) is within an ulp of a whole number of km,
+    # where the rounding up is the most fragile
+    for kilometers in (1000, 4321, 20000):
+        longitude = math.degrees(kilometers / EARTH_RADIUS_KM)
+        for offset in range(-3, 4):
+            point = longitude
+            for _ in range(abs(offset)):
+                point = math.nextafter(point, math.inf if offset > 0 else -math.inf)
+            cities.append(City(f"Equator{kilometers}{offset}", (0.0, point), "", 0, 3_100_000 + len(cities)))
+    for _ in range(5000):
+        cities.append(City(f"Random{len(cities)}", (generator.uniform(-90, 90), generator.uniform(-180, 180)), "", 0,
+                           3_200_000 + len(cities)))
+
+    engine = City.distance_engine
+    indices = np.array([city.index for city in cities], dtype=np.intp)
+    # pairs among the special points, and random pairs
+    special = cities[len(world):len(world) + 31]
+    pairs = [(first, second) for first in special for second in special]
+    pairs += [tuple(generator.sample(cities, 2)) for _ in range(20_000)]
+    expected = [first.distance(second) for first, second in pairs]
+    assert engine.pairwise([first.index for first, _ in pairs], [second.index for _, second in pairs]).tolist() == expected
+
+    for city in special + generator.sample(cities, 20):
+        assert engine.one_to_many(city.index, indices).tolist() == [city.distance(other) for other in cities]
+        assert city.distances(cities) == [city.distance(other) for other in cities]
+    rows = [city.index for city in special]
+    assert engine.many_to_many(rows, rows).tolist() == [[first.distance(second) for second in special] for first in special]
+    assert engine.pairwise(np.intp(special[0].index), np.intp(special[1].index)) == special[0].distance(special[1])
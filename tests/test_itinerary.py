@@ -0,0 +1,119 @@
+"""
+@file test_itinerary.py
+"""
+import math
+import random
+import pytest
+from itinerary import Itinerary
+from rule_vehicles import RuleVehicle, TravelRule
+
+def reference_insertions(itinerary: Itinerary, cities: list) -> None:
+    """
+    Inserts cities one at a time, always the one whose insertion increases the total distance
+    the least, by trying every city at every index.
+    """
+    cities = list(cities)
+    while cities:
+        costs = [(int(cost), position, city_number) for city_number, city in enumerate(cities)
+                 for position, cost in enumerate(itinerary.insertion_costs(city))]
+        _, position, city_number = min(costs)
+        itinerary._insert(position, cities.pop(city_number))
+
+@pytest.mark.parametrize("strategy", ["cheapest", "farthest", "in order"])
+def test_insert_cities_keeps_legs_consistent(world, strategy):
+    generator = random.Random(4)
+    cities = list(world)
+    generator.shuffle(cities)
+    itinerary = Itinerary(cities[:3])
+    last = itinerary.cities[-1]
+    itinerary.insert_cities(cities[3:], strategy)
+    assert sorted(city.index for city in itinerary.cities) == sorted(city.index for city in world)
+    assert itinerary.cities[-1] is last
+    assert itinerary.total_distance() == sum(first.distance(second) for first, second in zip(itinerary.cities, itinerary.cities[1:]))
+
+def test_cheapest_insertion_matches_reference(world):
+    generator = random.Random(5)
+    cities = generator.sample(world, 30)
+    itinerary, expected = Itinerary(cities[:2]), Itinerary(cities[:2])
+    itinerary.insert_cities(cities[2:], "cheapest")
+    reference_insertions(expected, cities[2:])
+    assert itinerary.total_distance() == expected.total_distance()
+
+def test_cities_cannot_be_edited_behind_the_itinerary(world):
+    cities = list(world[:3])
+    itinerary = Itinerary(cities)
+    assert itinerary.total_distance() == world[0].distance(world[1]) + world[1].distance(world[2])
+    with pytest.raises(TypeError):
+        itinerary.cities[1] = world[5]
+    # the itinerary keeps its own copy of the list it was given
+    cities[1] = world[5]
+    assert itinerary.cities == tuple(world[:3])
+    assert itinerary.total_distance() == world[0].distance(world[1]) + world[1].distance(world[2])
+    itinerary.cities = cities
+    assert itinerary.total_distance() == Itinerary([world[0], world[5], world[2]]).total_distance()
+
+def test_insert_cities_updates_travel_times(world):
+    from vehicles import CrappyCrepeCar
+    vehicle = CrappyCrepeCar(80)
+    itinerary = Itinerary(world[:2])
+    itinerary.total_travel_time(vehicle)
+    itinerary.insert_cities(world[2:20])
+    assert itinerary.total_travel_time(vehicle) == sum(vehicle.compute_travel_time(first, second)
+                                                       for first, second in zip(itinerary.cities, itinerary.cities[1:]))
+
+def cheapest_path_cost(costs, fixed_start: bool, fixed_end: bool) -> float:
+    """
+    Returns the cost of the cheapest order to visit cities in, with the Held-Karp algorithm.
+    """
+    count = len(costs)
+    best = {(1 << start, start): 0.0 for start in ([0] if fixed_start else range(count))}
+    for visited in range(1, 1 << count):
+        for last in range(count):
+            cost = best.get((visited, last))
+            if cost is None:
+                continue
+            for following in range(count):
+                if not visited & (1 << following):
+                    key = (visited | (1 << following), following)
+                    best[key] = min(best.get(key, math.inf), cost + costs[last][following])
+    return min(best.get(((1 << count) - 1, last), math.inf) for last in ([count - 1] if fixed_end else range(count)))
+
+def uphill_vehicle() -> RuleVehicle:
+    """
+    Returns a vehicle whose travel times depend on the direction: going to a primary city is faster.
+    """
+    return RuleVehicle("Uphill", [TravelRule(speed=300), TravelRule(speed=900, arrival_types=["primary"])], combine="min")
+
+def test_cost_matrix_follows_direction(world):
+    vehicle = uphill_vehicle()
+    assert not vehicle.symmetric
+    itinerary = Itinerary(world[::7])
+    costs = itinerary.cost_matrix(vehicle)
+    for row, departure in enumerate(itinerary.cities):
+        for column, arrival in enumerate(itinerary.cities):
+            if row != column:
+                assert costs[row, column] == vehicle.compute_travel_time(departure, arrival)
+    assert (costs != costs.T).any()
+
+@pytest.mark.parametrize("use_vehicle", [False, True])
+def test_optimize_never_increases_cost(world, use_vehicle):
+    generator = random.Random(6)
+    vehicle = uphill_vehicle() if use_vehicle else None
+    for _ in range(60):
+        cities = generator.sample(world, generator.randint(2, 11))
+        fixed_start, fixed_end = generator.random() < 0.5, generator.random() < 0.5
+        itinerary = Itinerary(list(cities))
+        costs = itinerary.cost_matrix(vehicle)
+        before = Itinerary._path_cost(costs, list(range(len(cities))))
+        after = itinerary.optimize(vehicle, fixed_start, fixed_end)
+        assert after <= before
+        assert after == (itinerary.total_distance() if vehicle is None else itinerary.total_travel_time(vehicle))
+        assert sorted(city.index for city in itinerary.cities) == sorted(city.index for city in cities)
+        if fixed_start:
+            assert itinerary.cities[0] is cities[0]
+        if fixed_end:
+            assert itinerary.cities[-1] is cities[-1]
+        if len(cities) <= Itinerary.BRUTE_FORCE_SIZE:
+            assert after == cheapest_path_cost(costs.tolist(), fixed_start, fixed_end)
+        else:
+            assert after <= 1.15 * cheapest_path_cost(costs.tolist(), fixed_start, fixed_end)
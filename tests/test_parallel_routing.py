@@ -0,0 +1,28 @@
+"""
+@file test_parallel_routing.py
+"""
+import random
+from city import City
+from csv_parsing import load_cities_countries
+from parallel_routing import find_shortest_paths_parallel
+from path_finding import find_shortest_path
+from vehicles import DiplomacyDonutDinghy, TeleportingTarteTrolley
+
+def test_parallel_results_match_serial(gazetteer):
+    load_cities_countries(gazetteer)
+    generator = random.Random(7)
+    cities = list(City.id_to_cities.values())
+    # the Trolley cannot reach most cities of other countries, so some results are None
+    vehicles = [DiplomacyDonutDinghy(100, 500), TeleportingTarteTrolley(3, 400)]
+    queries = [(generator.choice(vehicles), *generator.sample(cities, 2)) for _ in range(60)]
+    results = find_shortest_paths_parallel(queries, gazetteer, workers=2, chunk_size=7)
+
+    assert len(results) == len(queries)
+    expected = [find_shortest_path(*query) for query in queries]
+    assert [itinerary is None for itinerary in results] == [itinerary is None for itinerary in expected]
+    assert any(itinerary is None for itinerary in results) and not all(itinerary is None for itinerary in results)
+    for (vehicle, from_city, to_city), itinerary, serial in zip(queries, results, expected):
+        if itinerary is not None:
+            # the workers loaded the same cities, and the results are cities of this process
+            assert itinerary.cities[0] is from_city and itinerary.cities[-1] is to_city
+            assert vehicle.compute_itinerary_time(itinerary) == vehicle.compute_itinerary_time(serial)
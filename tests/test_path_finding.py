@@ -0,0 +1,92 @@
+"""
+@file test_path_finding.py
+"""
+import math
+import random
+from conftest import reference_travel_time
+from city import City
+from itinerary import Itinerary
+from path_finding import find_shortest_path, find_shortest_paths
+from routing_graphs import DinghyGraph
+from rule_vehicles import as_rule_vehicle
+from vehicles import Vehicle, CrappyCrepeCar, DiplomacyDonutDinghy, TeleportingTarteTrolley
+
+def test_dinghy_matches_reference_search(world):
+    vehicle = DiplomacyDonutDinghy(100, 500)
+    generator = random.Random(1)
+    primaries = [city for city in world if city.city_type == "primary"]
+    # pairs of primary cities of the same country, where the direct trip is slow, and random pairs
+    pairs = [(first, second) for first in primaries for second in primaries
+             if first is not second and first.country is second.country]
+    pairs += [tuple(generator.sample(world, 2)) for _ in range(40)]
+    for from_city, to_city in pairs:
+        itinerary = find_shortest_path(vehicle, from_city, to_city)
+        expected = reference_travel_time(vehicle, world, from_city, to_city)
+        assert vehicle.compute_itinerary_time(itinerary) == expected, f"{from_city} to {to_city}"
+        assert itinerary.cities[0] is from_city and itinerary.cities[-1] is to_city
+
+def test_trolley_matches_reference_search(world):
+    vehicle = TeleportingTarteTrolley(3, 1500)
+    generator = random.Random(2)
+    for _ in range(20):
+        from_city, to_city = generator.sample(world, 2)
+        itinerary = find_shortest_path(vehicle, from_city, to_city)
+        expected = reference_travel_time(vehicle, world, from_city, to_city)
+        if expected == math.inf:
+            assert itinerary is None
+        else:
+            assert vehicle.compute_itinerary_time(itinerary) == expected
+
+def test_matrix_matches_single_queries(world):
+    vehicle = DiplomacyDonutDinghy(100, 500)
+    cities = random.Random(3).sample(world, 8)
+    _, times = find_shortest_paths(vehicle, cities, cities)
+    for row, from_city in enumerate(cities):
+        for column, to_city in enumerate(cities):
+            if from_city is not to_city:
+                assert times[row][column] == vehicle.compute_itinerary_time(find_shortest_path(vehicle, from_city, to_city))
+
+class WalkingVehicle(Vehicle):
+    """
+    A vehicle no routing graph is registered for.
+    """
+
+    def compute_travel_time(self, departure: City, arrival: City) -> float:
+        return math.ceil(departure.distance(arrival) / 5)
+
+    def __str__(self) -> str:
+        return "WalkingVehicle"
+
+def test_vehicle_without_graph_has_no_path(world):
+    vehicle = WalkingVehicle()
+    assert find_shortest_path(vehicle, world[0], world[-1]) is None
+    itineraries, times = find_shortest_paths(vehicle, world[:2], world[-2:])
+    assert itineraries == [[None, None], [None, None]]
+    assert (times == math.inf).all()
+
+def test_car_goes_directly(world):
+    itinerary = find_shortest_path(CrappyCrepeCar(80), world[0], world[-1])
+    assert itinerary.cities == (world[0], world[-1])
+
+def test_dinghy_cities_without_country(world):
+    vehicle = DiplomacyDonutDinghy(100, 500)
+    # cities created without being added to a country
+    primaries = [City(f"Free{number}", (10.0 * number, 20.0 * number), "primary", 1000, 2_000_000 + number)
+                 for number in range(2)]
+    others = [City(f"Free{number}", (10.0 * number, -20.0), "minor", 1000, 2_000_000 + number) for number in range(2, 4)]
+    cities = world + primaries + others
+    rule_vehicle = as_rule_vehicle(vehicle)
+    for from_city in primaries + others + world[:3]:
+        expected = [vehicle.compute_travel_time(from_city, to_city) for to_city in cities]
+        assert vehicle.compute_travel_time_many(from_city.index, [city.index for city in cities]).tolist() == expected
+        assert [rule_vehicle.compute_travel_time(from_city, to_city) for to_city in cities] == expected
+    # a city without a country is in no country: only the primary ones can travel, between primary cities
+    assert vehicle.compute_travel_time(primaries[0], primaries[1]) == math.ceil(primaries[0].distance(primaries[1]) / 500)
+    assert vehicle.compute_travel_time(others[0], others[1]) == math.inf
+    for from_city, to_city in [(primaries[0], primaries[1]), (primaries[1], world[0]), (world[5], primaries[0]),
+                               (others[0], others[1]), (others[0], primaries[0])]:
+        expected = reference_travel_time(vehicle, cities, from_city, to_city)
+        itinerary = find_shortest_path(vehicle, from_city, to_city)
+        assert (vehicle.compute_itinerary_time(itinerary) if itinerary is not None else math.inf) == expected
+        path = DinghyGraph(vehicle).search_path(from_city, to_city)
+        assert (vehicle.compute_itinerary_time(Itinerary(path)) if path is not None else math.inf) == expected
@@ -0,0 +1,103 @@
+"""
+@file test_routing_service.py
+"""
+import asyncio
+import json
+import pytest
+from routing_service import RoutingService
+
+# the ID generate_gazetteer gives to its first city
+FIRST_ID = 1_000_000_000
+
+@pytest.fixture
+def service(gazetteer):
+    service = RoutingService(gazetteer, workers=0, max_body_size=1000)
+    service.start_workers()
+    yield service
+    service.shutdown()
+
+def exchange(service: RoutingService, request: bytes) -> list[tuple[int, dict, str]]:
+    """
+    Sends raw bytes to the service over a local connection and returns the answers,
+    each as its status, JSON object and Connection header, until the service closes the connection.
+    """
+    async def run() -> list[tuple[int, dict, str]]:
+        server = await asyncio.start_server(service._serve_connection, "127.0.0.1", 0)
+        async with server:
+            reader, writer = await asyncio.open_connection("127.0.0.1", server.sockets[0].getsockname()[1])
+            writer.write(request)
+            await writer.drain()
+            answers = []
+            while status_line := await reader.readline():
+                headers = {}
+                while (line := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = line.decode().partition(":")
+                    headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers["content-length"]))
+                answers.append((int(status_line.split()[1]), json.loads(body), headers["connection"]))
+            writer.close()
+            return answers
+    return asyncio.run(asyncio.wait_for(run(), 30))
+
+def request(method: str, target: str, body: bytes = b"", headers: str = "Connection: close\r\n") -> bytes:
+    return (f"{method} {target} HTTP/1.1\r\nContent-Length: {len(body)}\r\n{headers}\r\n").encode() + body
+
+def test_route_and_keep_alive(service):
+    answers = exchange(service, request("GET", f"/route?vehicle=1&from={FIRST_ID}&to={FIRST_ID + 1}", headers="")
+                       + request("GET", f"/distance?from={FIRST_ID}&to={FIRST_ID + 1}"))
+    assert [(status, connection) for status, _, connection in answers] == [(200, "keep-alive"), (200, "close")]
+    route, distance = answers[0][1], answers[1][1]
+    assert route["path"][0] == FIRST_ID and route["path"][-1] == FIRST_ID + 1 and route["hours"] > 0
+    assert distance["km"] > 0
+
+@pytest.mark.parametrize("length", ["abc", "-5", "1e3", "²"])
+def test_invalid_content_length(service, length):
+    answers = exchange(service, f"POST /matrix HTTP/1.1\r\nContent-Length: {length}\r\n\r\n{{}}".encode())
+    assert [(status, connection) for status, _, connection in answers] == [(400, "close")]
+    assert "Content-Length" in answers[0][1]["error"]
+
+def test_body_too_large(service):
+    # the body is not read: the connection is closed after the answer
+    answers = exchange(service, b"POST /matrix HTTP/1.1\r\nContent-Length: 1000000000\r\n\r\n")
+    assert [(status, connection) for status, _, connection in answers] == [(413, "close")]
+
+@pytest.mark.parametrize("head", [
+    # a line longer than the limit of the stream
+    f"GET /stats HTTP/1.1\r\nX-Big: {'x' * 70_000}\r\n\r\n",
+    f"GET /stats?{'x' * 70_000} HTTP/1.1\r\n\r\n",
+    # lines under it, but too many or too long together
+    "GET /stats HTTP/1.1\r\n" + "".join(f"X-{number}: 1\r\n" for number in range(200)) + "\r\n",
+    "GET /stats HTTP/1.1\r\n" + "".join(f"X-{number}: {'x' * 5000}\r\n" for number in range(5)) + "\r\n",
+])
+def test_headers_too_large(service, head):
+    answers = exchange(service, head.encode())
+    assert [(status, connection) for status, _, connection in answers] == [(431, "close")]
+
+def test_matrix_too_large(service):
+    body = json.dumps({"vehicle": 1, "origins": [FIRST_ID] * 30, "destinations": [FIRST_ID] * 30}).encode()
+    service.max_matrix_size = 100
+    assert exchange(service, request("POST", "/matrix", body))[0][0] == 413
+
+@pytest.mark.parametrize("method, target, body, status", [
+    ("POST", "/matrix", b"{not json", 400),
+    ("POST", "/matrix", b"[1, 2]", 400),
+    ("POST", "/matrix", b'{"vehicle": 1, "origins": 1}', 400),
+    ("GET", "/route?vehicle=unknown&from=1&to=2", b"", 400),
+    ("GET", "/route?vehicle=1&from=x&to=2", b"", 400),
+    ("GET", f"/route?vehicle=1&from={FIRST_ID}&to=1", b"", 404),
+    ("GET", "/nowhere", b"", 404),
+    ("DELETE", "/route", b"", 405),
+])
+def test_error_responses(service, method, target, body, status):
+    answers = exchange(service, request(method, target, body))
+    assert answers[0][0] == status and "error" in answers[0][1]
+
+def test_matrix_coalesces_and_caches(service):
+    body = json.dumps({"vehicle": 1, "origins": [FIRST_ID, FIRST_ID + 1], "destinations": [FIRST_ID + 2]}).encode()
+
+    async def run() -> list[tuple[int, dict]]:
+        return await asyncio.gather(*(service.handle("POST", "/matrix", body) for _ in range(5)))
+    answers = asyncio.run(run())
+    assert all(status == 200 and result == answers[0][1] for status, result in answers)
+    assert len(answers[0][1]["hours"]) == 2
+    assert service.computations == 1 and service.coalesced == 4
@@ -0,0 +1,33 @@
+"""
+@file test_rule_vehicles.py
+"""
+import math
+import random
+import pytest
+from path_finding import find_shortest_path
+from rule_vehicles import as_rule_vehicle
+from vehicles import DiplomacyDonutDinghy, create_example_vehicles
+
+# the example vehicles, and a Dinghy that is slower between primary cities than in a country
+VEHICLES = create_example_vehicles() + [DiplomacyDonutDinghy(300, 200)]
+
+def route_hours(vehicle, from_city, to_city) -> float:
+    itinerary = find_shortest_path(vehicle, from_city, to_city)
+    return vehicle.compute_itinerary_time(itinerary) if itinerary is not None else math.inf
+
+@pytest.mark.parametrize("vehicle", VEHICLES, ids=str)
+def test_rule_vehicle_travels_as_example_vehicle(world, vehicle):
+    rule_vehicle = as_rule_vehicle(vehicle)
+    generator = random.Random(6)
+    primaries = [city for city in world if city.city_type == "primary"]
+    # random pairs, and pairs of primary cities where the two speeds of a Dinghy compete
+    pairs = [tuple(generator.sample(world, 2)) for _ in range(200)]
+    pairs += [tuple(generator.sample(primaries, 2)) for _ in range(50)]
+    for from_city, to_city in pairs:
+        assert rule_vehicle.compute_travel_time(from_city, to_city) == vehicle.compute_travel_time(from_city, to_city)
+    for from_city in generator.sample(world, 10):
+        indices = [city.index for city in world]
+        assert (rule_vehicle.compute_travel_time_many(from_city.index, indices).tolist()
+                == vehicle.compute_travel_time_many(from_city.index, indices).tolist())
+    for from_city, to_city in pairs[:20] + pairs[-10:]:
+        assert route_hours(rule_vehicle, from_city, to_city) == route_hours(vehicle, from_city, to_city)
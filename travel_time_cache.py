@@ -0,0 +1,127 @@
+"""
+@file travel_time_cache.py
+"""
+from __future__ import annotations
+from collections import OrderedDict
+from typing import TYPE_CHECKING
+from city import City
+from country import Country
+
+if TYPE_CHECKING:
+    from vehicles import Vehicle
+
+class PairwiseCache():
+    """
+    Remembers a value computed for pairs of cities, such as the travel time of a vehicle,
+    keyed on the IDs of the two cities. When the value is symmetric, (a, b) and (b, a)
+    share an entry.
+
+    At most max_entries values are kept: the least recently used are evicted first.
+    All values are dropped when cities or countries change, as they may depend on them.
+    """
+
+    def __init__(self, max_entries: int = 100_000, symmetric: bool = True) -> None:
+        """
+        Creates an empty cache.
+
+        :param max_entries: the maximum number of values to keep.
+        :param symmetric: whether the value for (a, b) is also the value for (b, a).
+        :return: None
+        """
+        self.max_entries = max_entries
+        self.symmetric = symmetric
+        self._values = OrderedDict()
+        self._versions = (City.registry_version, Country.registry_version)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        """
+        Returns the number of values in the cache.
+        """
+        return len(self._values)
+
+    def _key(self, first: City, second: City) -> tuple[int, int]:
+        """
+        Returns the key of a pair of cities.
+        """
+        first_id, second_id = first.city_id, second.city_id
+        return (second_id, first_id) if self.symmetric and second_id < first_id else (first_id, second_id)
+
+    def get(self, first: City, second: City) -> float | None:
+        """
+        Returns the value of a pair of cities, or None if it is not in the cache.
+
+        :param first: the first city of the pair.
+        :param second: the second city of the pair.
+        :return: the value, or None.
+        """
+        if self._versions != (City.registry_version, Country.registry_version):
+            self._versions = (City.registry_version, Country.registry_version)
+            self._values.clear()
+        key = self._key(first, second)
+        value = self._values.get(key)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self._values.move_to_end(key)
+        return value
+
+    def put(self, first: City, second: City, value: float) -> None:
+        """
+        Stores the value of a pair of cities, evicting the least recently used value if the cache is full.
+
+        :param first: the first city of the pair.
+        :param second: the second city of the pair.
+        :param value: the value.
+        :return: None
+        """
+        key = self._key(first, second)
+        self._values[key] = value
+        self._values.move_to_end(key)
+        while len(self._values) > self.max_entries:
+            self._values.popitem(last=False)
+
+    def clear(self) -> None:
+        """
+        Removes all values from the cache and resets the statistics.
+
+        :return: None
+        """
+        self._values.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> dict[str, float]:
+        """
+        Returns statistics about the use of the cache.
+
+        :return: a dict with the number of hits, misses, entries, the maximum number
+                 of entries and the fraction of lookups that were hits.
+        """
+        lookups = self.hits + self.misses
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self._values),
+                "max_entries": self.max_entries, "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+# associates the cache key of a vehicle to the cache of its travel times, so that
+# vehicles with the same parameters share their cache
+_shared_caches = {}
+
+def shared_travel_time_cache(vehicle: Vehicle, max_entries: int = 100_000) -> PairwiseCache:
+    """
+    Returns the travel time cache shared by the vehicles with the same parameters as a vehicle,
+    creating it if needed.
+
+    :param vehicle: the vehicle.
+    :param max_entries: the maximum number of travel times to keep, if the cache is created
+                        or has a smaller bound.
+    :return: the cache.
+    """
+    key = vehicle.cache_key()
+    cache = _shared_caches.get(key)
+    if cache is None:
+        cache = _shared_caches[key] = PairwiseCache(max_entries, vehicle.symmetric)
+    cache.max_entries = max(cache.max_entries, max_entries)
+    return cache
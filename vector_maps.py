@@ -0,0 +1,205 @@
+"""
+@file vector_maps.py
+"""
+from __future__ import annotations
+import html
+import json
+import math
+import numpy as np
+from itinerary import Itinerary
+from city import City
+from distances import EARTH_RADIUS_KM
+
+# the colours matplotlib gives to single letters, so the same colour arguments work with every backend
+_COLOURS = {'b': 'blue', 'g': 'green', 'r': 'red', 'c': 'cyan', 'm': 'magenta', 'y': 'yellow', 'k': 'black', 'w': 'white'}
+
+def great_circle_points(start: tuple[float, float], end: tuple[float, float], step_km: float = 100) -> np.ndarray:
+    """
+    Returns points along the great circle between two points, about step_km apart,
+    so that the leg can be drawn as a polyline that looks curved on a flat map.
+
+    :param start: the (latitude, longitude) of the start, in degrees.
+    :param end: the (latitude, longitude) of the end, in degrees.
+    :param step_km: the largest distance between consecutive points, in km.
+    :return: an array of (latitude, longitude) rows, from start to end.
+    """
+    latitudes, longitudes = np.radians([start[0], end[0]]), np.radians([start[1], end[1]])
+    vectors = np.column_stack((np.cos(latitudes) * np.cos(longitudes), np.cos(latitudes) * np.sin(longitudes),
+                               np.sin(latitudes)))
+    angle = math.acos(min(1.0, max(-1.0, float(vectors[0] @ vectors[1]))))
+    if angle <= 1e-12 or math.pi - angle <= 1e-12:
+        # no single great circle between identical or antipodal points: the ends are enough
+        return np.array([start, end], dtype=float)
+    count = max(2, math.ceil(angle * EARTH_RADIUS_KM / step_km) + 1)
+    # spherical linear interpolation between the two unit vectors
+    fractions = np.linspace(0, 1, count)[:, np.newaxis]
+    points = (np.sin((1 - fractions) * angle) * vectors[0] + np.sin(fractions * angle) * vectors[1]) / math.sin(angle)
+    result = np.column_stack((np.degrees(np.arcsin(np.clip(points[:, 2], -1, 1))),
+                              np.degrees(np.arctan2(points[:, 1], points[:, 0]))))
+    # the ends are exactly the cities
+    result[0], result[-1] = start, end
+    return result
+
+def split_at_antimeridian(points: np.ndarray) -> list[np.ndarray]:
+    """
+    Splits a polyline where it crosses the 180th meridian, so that no segment goes across the
+    whole map, as GeoJSON (RFC 7946) asks for.
+
+    :param points: an array of (latitude, longitude) rows.
+    :return: the parts of the polyline, each ending or starting on the meridian where split.
+    """
+    parts = []
+    current = [points[0]]
+    for position in range(1, len(points)):
+        (lat1, lon1), (lat2, lon2) = points[position - 1], points[position]
+        if abs(lon2 - lon1) > 180:
+            # the longitude of the second point, continued across the meridian
+            side = 180.0 if lon1 > 0 else -180.0
+            unwrapped = lon2 + 2 * side
+            crossing = lat1 + (lat2 - lat1) * (side - lon1) / (unwrapped - lon1)
+            current.append((crossing, side))
+            parts.append(np.array(current, dtype=float))
+            current = [(crossing, -side)]
+        current.append(points[position])
+    parts.append(np.array(current, dtype=float))
+    return parts
+
+def itinerary_geojson(itinerary: Itinerary, step_km: float = 100) -> dict:
+    """
+    Returns an itinerary as a GeoJSON FeatureCollection: a Point for each city, with its name,
+    ID, type, population and position in the itinerary, and a LineString (or MultiLineString
+    when it crosses the 180th meridian) along the great circle of each leg.
+
+    :param itinerary: The itinerary.
+    :param step_km: the largest distance between consecutive points of the legs, in km.
+    :return: the GeoJSON object, ready for json.dump.
+    """
+    features = []
+    for stop, city in enumerate(itinerary.cities):
+        latitude, longitude = city.coordinates
+        features.append({"type": "Feature", "geometry": {"type": "Point", "coordinates": [longitude, latitude]},
+                         "properties": {"name": city.name, "city_id": city.city_id, "city_type": city.city_type,
+                                        "population": city.population, "stop": stop}})
+    for leg, (departure, arrival) in enumerate(zip(itinerary.cities[:-1], itinerary.cities[1:])):
+        parts = [[[float(lon), float(lat)] for lat, lon in part]
+                 for part in split_at_antimeridian(great_circle_points(departure.coordinates, arrival.coordinates, step_km))]
+        geometry = ({"type": "LineString", "coordinates": parts[0]} if len(parts) == 1
+                    else {"type": "MultiLineString", "coordinates": parts})
+        features.append({"type": "Feature", "geometry": geometry,
+                         "properties": {"leg": leg, "from": departure.name, "to": arrival.name,
+                                        "distance_km": departure.distance(arrival)}})
+    return {"type": "FeatureCollection", "features": features}
+
+def _view_box(parts: list[np.ndarray], padding: float = 5, min_size: float = 50) -> tuple[float, float, float, float]:
+    """
+    Returns the part of the map to show, (min_lat, max_lat, min_lon, max_lon): the legs padded by
+    padding degrees and at least min_size degrees in each direction, or the whole world when a
+    leg crosses the 180th meridian.
+    """
+    if len(parts) > 1 and any(abs(part[-1][1]) == 180 for part in parts[:-1]):
+        return -90.0, 90.0, -180.0, 180.0
+    points = np.concatenate(parts)
+    limits = []
+    for values, bound in ((points[:, 0], 90.0), (points[:, 1], 180.0)):
+        low, high = float(values.min()) - padding, float(values.max()) + padding
+        if high - low < min_size:
+            centre = (low + high) / 2
+            low, high = centre - min_size / 2, centre + min_size / 2
+        limits += [max(low, -bound), min(high, bound)]
+    return tuple(limits)
+
+def itinerary_svg(itinerary: Itinerary, width: int = 1000, line_width: float = 2, colour: str = 'b',
+                  step_km: float = 100) -> str:
+    """
+    Returns an SVG map of an itinerary, in an equirectangular projection: a graticule, the legs
+    along great circles, and the cities, named, with their details shown when hovered.
+    Ensures a size of at least 50 degrees in each direction, and pads the cities by 5 degrees.
+
+    :param itinerary: The itinerary.
+    :param width: the width of the image in pixels, its height following from the part of the map shown.
+    :param line_width: The width of the line to draw, in pixels.
+    :param colour: The colour of the line to draw, a matplotlib letter or any SVG colour.
+    :param step_km: the largest distance between consecutive points of the legs, in km.
+    :return: the SVG document.
+    """
+    colour = _COLOURS.get(colour, colour)
+    legs = [split_at_antimeridian(great_circle_points(departure.coordinates, arrival.coordinates, step_km))
+            for departure, arrival in zip(itinerary.cities[:-1], itinerary.cities[1:])]
+    parts = [part for leg in legs for part in leg] or [np.array([city.coordinates for city in itinerary.cities])]
+    min_lat, max_lat, min_lon, max_lon = _view_box(parts)
+    # one unit of the SVG is one degree, x growing with the longitude and y with the latitude southwards
+    scale = width / (max_lon - min_lon)
+    height = round((max_lat - min_lat) * scale)
+    pixel = 1 / scale
+
+    def polyline(points: np.ndarray, style: str) -> str:
+        coordinates = " ".join(f"{lon:.3f},{-lat:.3f}" for lat, lon in points)
+        return f'<polyline points="{coordinates}" fill="none" vector-effect="non-scaling-stroke" {style}/>'
+
+    elements = [f'<rect x="{min_lon}" y="{-max_lat}" width="{max_lon - min_lon}" height="{max_lat - min_lat}" fill="#EEF3F8"/>']
+    step = 10 if max_lon - min_lon <= 120 else 30
+    for latitude in range(math.ceil(min_lat / step) * step, math.floor(max_lat) + 1, step):
+        elements.append(polyline(np.array([(latitude, min_lon), (latitude, max_lon)]), 'stroke="#C1BBBA" stroke-width="0.5"'))
+    for longitude in range(math.ceil(min_lon / step) * step, math.floor(max_lon) + 1, step):
+        elements.append(polyline(np.array([(min_lat, longitude), (max_lat, longitude)]), 'stroke="#C1BBBA" stroke-width="0.5"'))
+    for part in (part for leg in legs for part in leg):
+        elements.append(polyline(part, f'stroke="{html.escape(colour)}" stroke-width="{line_width}" stroke-linejoin="round"'))
+    for stop, city in enumerate(itinerary.cities):
+        latitude, longitude = city.coordinates
+        details = html.escape(f"{stop + 1}. {city}")
+        elements.append(f'<g><title>{details}</title>'
+                        f'<circle cx="{longitude:.3f}" cy="{-latitude:.3f}" r="{4 * pixel:.3f}" fill="white" '
+                        f'stroke="black" vector-effect="non-scaling-stroke"/>'
+                        f'<text x="{longitude + 6 * pixel:.3f}" y="{-latitude - 4 * pixel:.3f}" '
+                        f'font-size="{12 * pixel:.3f}" font-family="sans-serif">{html.escape(city.name)}</text></g>')
+    return (f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+            f'viewBox="{min_lon} {-max_lat} {max_lon - min_lon} {max_lat - min_lat}">\n'
+            + "\n".join(elements) + "\n</svg>")
+
+def itinerary_html(itinerary: Itinerary, line_width: float = 2, colour: str = 'b', step_km: float = 100) -> str:
+    """
+    Returns a self-contained HTML page showing an itinerary: its SVG map, the list of its
+    cities, and its GeoJSON in a script element for other tools to pick up.
+    It needs no network access to be viewed.
+
+    :param itinerary: The itinerary.
+    :param line_width: The width of the line to draw, in pixels.
+    :param colour: The colour of the line to draw.
+    :param step_km: the largest distance between consecutive points of the legs, in km.
+    :return: the HTML document.
+    """
+    title = html.escape(f"Itinerary from {itinerary.cities[0].name} to {itinerary.cities[-1].name}")
+    stops = "\n".join(f"<li>{html.escape(str(city))}</li>" for city in itinerary.cities)
+    # "</" cannot appear inside a script element
+    geojson = json.dumps(itinerary_geojson(itinerary, step_km)).replace("</", "<\\/")
+    return (f'<!DOCTYPE html>\n<html>\n<head>\n<meta charset="utf-8">\n<title>{title}</title>\n</head>\n'
+            f'<body style="font-family: sans-serif">\n<h1>{title}</h1>\n'
+            f'{itinerary_svg(itinerary, line_width=line_width, colour=colour, step_km=step_km)}\n'
+            f'<ol>\n{stops}\n</ol>\n'
+            f'<script type="application/geo+json" id="itinerary">{geojson}</script>\n</body>\n</html>\n')
+
+def write_vector_map(itinerary: Itinerary, path: str, line_width: float = 2, colour: str = 'b', step_km: float = 100) -> list[str]:
+    """
+    Writes an itinerary as a GeoJSON file and as an HTML page with its map, named after path
+    with the extensions .geojson and .html.
+
+    :param itinerary: The itinerary.
+    :param path: the path of the files, with or without the .html extension.
+    :param line_width: The width of the line to draw, in pixels.
+    :param colour: The colour of the line to draw.
+    :param step_km: the largest distance between consecutive points of the legs, in km.
+    :return: the paths of the files written.
+    """
+    stem = path[:-len(".html")] if path.endswith(".html") else path
+    with open(stem + ".geojson", "w", encoding="utf-8") as geojson_file:
+        json.dump(itinerary_geojson(itinerary, step_km), geojson_file)
+    with open(stem + ".html", "w", encoding="utf-8") as html_file:
+        html_file.write(itinerary_html(itinerary, line_width, colour, step_km))
+    return [stem + ".geojson", stem + ".html"]
+
+if __name__ == "__main__":
+    from city import create_example_cities
+    create_example_cities()
+    melbourne, sydney = City.id_to_cities[1036533631], City.id_to_cities[1036074917]
+    print(great_circle_points(melbourne.coordinates, sydney.coordinates, 200))
+    print(write_vector_map(Itinerary(list(City.index_to_cities)), "example_itinerary"))
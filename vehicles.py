@@ -1,17 +1,61 @@
 """
 @file vehicles.py
 """
+import functools
 import math
 from abc import ABC, abstractmethod
+import numpy as np
 from city import City, get_city_by_id
 from country import find_country_of_city, create_example_countries
 from itinerary import Itinerary
+from travel_time_cache import PairwiseCache, shared_travel_time_cache
+import instrumentation
 
 class Vehicle(ABC):
     """
     A Vehicle defined by a mode of transportation, which results in a specific duration.
+
+    Any vehicle can remember the travel times compute_travel_time returns, see enable_travel_time_cache.
     """
 
+    # whether the travel time from a to b is always the travel time from b to a
+    symmetric = True
+    # the cache of the travel times of the vehicle, if enabled
+    _time_cache = None
+
+    def __init_subclass__(cls, **kwargs) -> None:
+        """
+        Makes the compute_travel_time of every subclass look up the vehicle's cache first, if it has one.
+        """
+        super().__init_subclass__(**kwargs)
+        if 'compute_travel_time' in cls.__dict__:
+            cls.compute_travel_time = _cached_travel_time(cls.__dict__['compute_travel_time'])
+
+    def enable_travel_time_cache(self, max_entries: int = 100_000) -> PairwiseCache:
+        """
+        Makes the vehicle remember the travel times it computes between pairs of cities, in a
+        cache shared with the vehicles that have the same parameters (see cache_key).
+
+        :param max_entries: the maximum number of travel times to remember.
+        :return: the cache, whose stats method tells how useful it is.
+        """
+        self._time_cache = shared_travel_time_cache(self, max_entries)
+        return self._time_cache
+
+    def disable_travel_time_cache(self) -> None:
+        """
+        Makes the vehicle compute every travel time again.
+
+        :return: None
+        """
+        self._time_cache = None
+
+    def __getstate__(self) -> dict:
+        # the cache is not sent to other processes with the vehicle
+        state = dict(vars(self))
+        state.pop('_time_cache', None)
+        return state
+
     @abstractmethod
     def compute_travel_time(self, departure: City, arrival: City) -> float:
         """
@@ -25,7 +69,41 @@ class Vehicle(ABC):
                  or math.inf if the travel is not possible.
         """
         pass
-        
+
+    def travel_time_from_distance(self, departure: City, arrival: City, distance: int) -> float:
+        """
+        Returns the travel duration of a direct trip from one city
+        to another, in hours, given the distance between the two cities.
+        This lets callers compute many distances in one batch with City.distance_engine
+        and only apply the vehicle's rules per pair.
+        Vehicles that do not override this method ignore the distance.
+
+        :param departure: the departure city.
+        :param arrival: the arrival city.
+        :param distance: the distance between the two cities, as returned by City.distance.
+        :return: the travel time in hours, rounded up to an integer,
+                 or math.inf if the travel is not possible.
+        """
+        return self.compute_travel_time(departure, arrival)
+
+    def compute_travel_time_many(self, departure_indices: np.ndarray, arrival_indices: np.ndarray) -> np.ndarray:
+        """
+        Returns the travel durations of many direct trips at once, in hours, as
+        compute_travel_time would return them one by one.
+        Cities are given by their index in City.table; the two arrays must have the same
+        shape, or shapes NumPy can broadcast together (e.g. one departure and many arrivals).
+        Vehicles that do not override this method call compute_travel_time for each pair.
+
+        :param departure_indices: the indices of the departure cities.
+        :param arrival_indices: the indices of the arrival cities.
+        :return: an array of travel times in hours, math.inf where the travel is not possible.
+        """
+        pairs = np.broadcast(np.asarray(departure_indices), np.asarray(arrival_indices))
+        cities = City.index_to_cities
+        hours = np.fromiter((self.compute_travel_time(cities[departure], cities[arrival]) for departure, arrival in pairs),
+                            dtype=np.float64, count=pairs.size)
+        return hours.reshape(pairs.shape)
+
     def compute_itinerary_time(self, itinerary: Itinerary) -> float:
         """
         Returns a travel duration for the entire itinerary for a given vehicle.
@@ -35,18 +113,19 @@ class Vehicle(ABC):
         :return: the travel time in hours (an integer),
                  or math.inf if the travel is not possible.
         """
-        # Set a variable for total time taken
-        total_time = 0
-        # Loop through the list of cities
-        for index, city in enumerate(itinerary.cities[:-1]):
-            # Compute the time taken to travel between each successive cities
-            time = self.compute_travel_time(city, itinerary.cities[index+1])
-            # If there's a break between the list of cities return math.inf
-            if time == math.inf:
-                return math.inf
-            else:
-                total_time += time
-        return total_time
+        # the itinerary keeps the travel time of each leg, so this is only computed once per vehicle
+        return itinerary.total_travel_time(self)
+
+    def cache_key(self) -> tuple:
+        """
+        Returns a key made of the class and the parameters of the vehicle.
+        Two vehicles with the same key have the same travel times, so anything
+        derived from a vehicle's rules can be shared between them.
+
+        :return: a hashable tuple.
+        """
+        parameters = sorted((name, value) for name, value in vars(self).items() if not name.startswith('_'))
+        return (type(self), tuple(parameters))
 
     @abstractmethod
     def __str__(self) -> str:
@@ -57,6 +136,28 @@ class Vehicle(ABC):
         """
         pass
 
+def _cached_travel_time(compute_travel_time):
+    """
+    Wraps the compute_travel_time method of a Vehicle subclass so that it uses the vehicle's
+    cache when there is one, and is counted when instrumentation is enabled.
+    """
+    @functools.wraps(compute_travel_time)
+    def wrapper(self: Vehicle, departure: City, arrival: City) -> float:
+        recording = instrumentation.active
+        if recording is not None:
+            recording.count("travel_time_calls")
+        cache = self._time_cache
+        if cache is None:
+            return compute_travel_time(self, departure, arrival)
+        time = cache.get(departure, arrival)
+        if recording is not None:
+            recording.count("travel_time_cache_misses" if time is None else "travel_time_cache_hits")
+        if time is None:
+            time = compute_travel_time(self, departure, arrival)
+            cache.put(departure, arrival, time)
+        return time
+    return wrapper
+
 class CrappyCrepeCar(Vehicle):
     """
     A type of vehicle that:
@@ -81,8 +182,23 @@ class CrappyCrepeCar(Vehicle):
         :return: the travel time in hours, rounded up to an integer,
                  or math.inf if the travel is not possible.
         """
-        # Computer the distance travelled using distance method
-        return math.ceil(City.distance(departure, arrival) / self.speed)
+        return self.travel_time_from_distance(departure, arrival, City.distance(departure, arrival))
+
+    def travel_time_from_distance(self, departure: City, arrival: City, distance: int) -> float:
+        """
+        Returns the travel duration of a direct trip from one city
+        to another, in hours, given the distance between the two cities.
+
+        :param departure: the departure city.
+        :param arrival: the arrival city.
+        :param distance: the distance between the two cities, as returned by City.distance.
+        :return: the travel time in hours, rounded up to an integer.
+        """
+        return math.ceil(distance / self.speed)
+
+    def compute_travel_time_many(self, departure_indices: np.ndarray, arrival_indices: np.ndarray) -> np.ndarray:
+        distances = City.distance_engine.pairwise(departure_indices, arrival_indices)
+        return np.ceil(distances / self.speed)
         
     def __str__(self) -> str:
         """
@@ -124,14 +240,28 @@ class DiplomacyDonutDinghy(Vehicle):
         :return: the travel time in hours, rounded up to an integer,
                  or math.inf if the travel is not possible.
         """
-        # save the distance
-        distance_to_travel = City.distance(departure, arrival)
+        return self.travel_time_from_distance(departure, arrival, City.distance(departure, arrival))
+
+    def travel_time_from_distance(self, departure: City, arrival: City, distance: int) -> float:
+        """
+        Returns the travel duration of a direct trip from one city
+        to another, in hours, given the distance between the two cities.
+
+        :param departure: the departure city.
+        :param arrival: the arrival city.
+        :param distance: the distance between the two cities, as returned by City.distance.
+        :return: the travel time in hours, rounded up to an integer,
+                 or math.inf if the travel is not possible.
+        """
+        distance_to_travel = distance
         #travel times for both speeds 
         in_country_time = math.ceil(distance_to_travel / self.in_country_speed)
         between_primary_time = math.ceil(distance_to_travel / self.between_primary_speed)
         # bools of whether or not in same country and both primary
+        # (a city without a country is in no country, not in the same one as the others without)
         both_primary = departure.city_type == arrival.city_type == 'primary'
-        same_country = find_country_of_city(departure) == find_country_of_city(arrival)
+        departure_country = find_country_of_city(departure)
+        same_country = departure_country is not None and departure_country == find_country_of_city(arrival)
         
         # then return travel time based on above bools
         if both_primary and same_country:
@@ -142,6 +272,24 @@ class DiplomacyDonutDinghy(Vehicle):
             return in_country_time
         else:
             return math.inf
+
+    def compute_travel_time_many(self, departure_indices: np.ndarray, arrival_indices: np.ndarray) -> np.ndarray:
+        table = City.table
+        departure_indices, arrival_indices = np.asarray(departure_indices), np.asarray(arrival_indices)
+        distances = table.pairwise(departure_indices, arrival_indices)
+        in_country_time = np.ceil(distances / self.in_country_speed)
+        between_primary_time = np.ceil(distances / self.between_primary_speed)
+        # the same rules as travel_time_from_distance, on the columns of the table, where
+        # cities without a country have the country index -1
+        primary = table.code_of_type('primary')
+        both_primary = (table.type_code[departure_indices] == primary) & (table.type_code[arrival_indices] == primary)
+        departure_countries = table.country_index[departure_indices]
+        same_country = (departure_countries == table.country_index[arrival_indices]) & (departure_countries >= 0)
+
+        hours = np.full(distances.shape, math.inf)
+        hours = np.where(same_country, in_country_time, hours)
+        hours = np.where(both_primary, between_primary_time, hours)
+        return np.where(both_primary & same_country, np.maximum(in_country_time, between_primary_time), hours)
         
     def __str__(self) -> str:
         """
@@ -180,10 +328,25 @@ class TeleportingTarteTrolley(Vehicle):
         :return: the travel time in hours, rounded up to an integer,
                  or math.inf if the travel is not possible.
         """
-        distance_to_travel = City.distance(departure, arrival)
-        # If computed distance is smaller than the maximum distance, return the fixed time
+        return self.travel_time_from_distance(departure, arrival, City.distance(departure, arrival))
+
+    def travel_time_from_distance(self, departure: City, arrival: City, distance: int) -> float:
+        """
+        Returns the travel duration of a direct trip from one city
+        to another, in hours, given the distance between the two cities.
+
+        :param departure: the departure city.
+        :param arrival: the arrival city.
+        :param distance: the distance between the two cities, as returned by City.distance.
+        :return: the fixed travel time in hours, or math.inf if the travel is not possible.
+        """
+        # If the distance is smaller than the maximum distance, return the fixed time
         # otherwise return infinity
-        return self.travel_time if distance_to_travel < self.max_distance else math.inf
+        return self.travel_time if distance < self.max_distance else math.inf
+
+    def compute_travel_time_many(self, departure_indices: np.ndarray, arrival_indices: np.ndarray) -> np.ndarray:
+        distances = City.distance_engine.pairwise(departure_indices, arrival_indices)
+        return np.where(distances < self.max_distance, float(self.travel_time), math.inf)
 
     def __str__(self) -> str:
         """